@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,13 +43,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings include every other middleware
+    'home.profiler.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Needs request.user for its per-account limits
+    'home.admission.AdmissionControlMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'home.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'HP10.urls'
@@ -81,6 +88,95 @@ DATABASES = {
     }
 }
 
+# Read replicas for catalog browsing; locally these are file copies of
+# db.sqlite3 refreshed with `manage.py sync_replicas`
+REPLICA_DATABASES = [f'replica{i}' for i in range(1, int(os.environ.get('HP10_SQLITE_REPLICAS', '0')) + 1)]
+for alias in REPLICA_DATABASES:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db.{alias}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['home.routers.ReplicaRouter']
+
+# Gives each test run an admission store of its own, with admission control off (home/runner.py)
+TEST_RUNNER = 'home.runner.TestRunner'
+
+# Without a sync time to compare against, reads stay on the primary this long after a write
+REPLICA_STICKY_SECONDS = 60
+
+# 'queued' turns booking forms into BookingRequest rows that process_booking_queue workers book
+BOOKING_INTAKE = os.environ.get('HP10_BOOKING_INTAKE', 'sync')
+
+# Serve the catalog pages from their async views, which run a page's independent
+# queries at the same time; pays off under ASGI (HP10/asgi.py) with a networked database
+ASYNC_VIEWS = os.environ.get('HP10_ASYNC_VIEWS', '') == '1'
+
+# Seconds a connection is kept open. The async views query from worker threads that
+# would otherwise connect anew for every query, so set this (e.g. 600) with them.
+CONN_MAX_AGE = int(os.environ.get('HP10_CONN_MAX_AGE', '0'))
+for alias in DATABASES:
+    DATABASES[alias].update(CONN_MAX_AGE=CONN_MAX_AGE, CONN_HEALTH_CHECKS=CONN_MAX_AGE > 0)
+
+# Caches. 'catalog' is the shared tier behind home/catalog_cache.py's per-process LRU:
+# private to each process by default, shared by the worker processes of one host when
+# HP10_CACHE_LOCATION is a directory, and by every host when it is a redis:// URL.
+_cache_location = os.environ.get('HP10_CACHE_LOCATION', '')
+if _cache_location.startswith(('redis://', 'rediss://')):
+    _catalog_cache = {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}
+elif _cache_location:
+    _catalog_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'OPTIONS': {'MAX_ENTRIES': 10000}}
+else:
+    _catalog_cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'OPTIONS': {'MAX_ENTRIES': 10000}}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'catalog': dict(_catalog_cache, LOCATION=_cache_location or 'catalog', TIMEOUT=300),
+}
+
+CATALOG_CACHE = os.environ.get('HP10_CATALOG_CACHE', '1') == '1'
+# Seconds a cached catalog read lives at most; saves retire it earlier (home/signals.py)
+CATALOG_CACHE_TIMEOUT = 300
+# Entries each process keeps in memory in front of the shared cache
+CATALOG_CACHE_LOCAL_ENTRIES = 1000
+# Seconds before a process sees a save made in another process
+CATALOG_CACHE_VERSION_TTL = 1
+
+# Admission control for endpoints that hash passwords (login, register) or take the
+# SQLite write lock (booking, checkout, payment). `concurrency` caps their requests in
+# flight over all worker processes (else 503); `rate` per second and `burst` size a
+# token bucket per signed-in user, or per IP address otherwise (else 429).
+ADMISSION_CONTROL = os.environ.get('HP10_ADMISSION_CONTROL', '1') == '1'
+_hashing = {'methods': ['POST'], 'concurrency': os.cpu_count() or 1, 'rate': 10 / 60, 'burst': 10}
+_writing = {'methods': ['POST'], 'concurrency': 4, 'rate': 30 / 60, 'burst': 20}
+ADMISSION_RULES = {
+    'login': _hashing,
+    'register': dict(_hashing, rate=3 / 60, burst=5),
+    'booking': _writing,
+    'checkout': _writing,
+    'payment': _writing,
+}
+# Reverse proxies (addresses or networks) in front of the app. Behind one, REMOTE_ADDR is the
+# proxy for every visitor, so requests from these take the client from X-Forwarded-For instead
+ADMISSION_TRUSTED_PROXIES = [
+    proxy.strip() for proxy in os.environ.get('HP10_TRUSTED_PROXIES', '').split(',') if proxy.strip()
+]
+# Slots, buckets and shed counts live in this file, shared by the worker processes of one host
+ADMISSION_DB = os.environ.get('HP10_ADMISSION_DB', os.path.join(tempfile.gettempdir(), 'hp10-admission.sqlite3'))
+# Seconds to wait for the store before letting a request through unchecked
+ADMISSION_DB_TIMEOUT = 0.2
+# A slot not released by then (its process died) is free again
+ADMISSION_SLOT_TIMEOUT = 60
+# Retry-After of a 503
+ADMISSION_RETRY_AFTER = 2
+# Seconds of admitted and shed requests /_perf/ shows
+ADMISSION_STATS_WINDOW = 15 * 60
+
+# Share of requests whose queries and template time are measured (Server-Timing, /_perf/)
+QUERY_PROFILER_SAMPLE_RATE = float(os.environ.get('HP10_PROFILER_SAMPLE_RATE', '1' if DEBUG else '0'))
+# Seconds of sampled requests /_perf/ aggregates
+QUERY_PROFILER_WINDOW = 15 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -117,6 +213,20 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Uploaded files are stored by content hash; see home/storage.py
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'home.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -17,12 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
-from django.conf.urls.static import static
+from home.views import serve_media, serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('home.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Served by the app in every environment; see home/serving.py
+urlpatterns += [
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name='media'),
+    path(f"{settings.STATIC_URL.strip('/')}/<path:path>", serve_static, name='static'),
+]
\ No newline at end of file
@@ -1,14 +1,124 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.html import format_html
+from . import images
 from .models import (
     Location, Hotel, HotelImage, FlightTicket, Booking, Tour, TourImage,
     CarTransfer, Promotion, UserProfile, Room, RoomImage
 )
 
+# Unfiltered changelists of tables estimated above this size skip COUNT(*)
+EXACT_COUNT_LIMIT = 100000
+
+def estimated_count(model, using='default'):
+    # Row estimate from table statistics, or None when the backend keeps none
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # The highest rowid is one index probe; deleted rows make it an overestimate
+            cursor.execute(f'SELECT MAX(_rowid_) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that was never analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts filtered changelists exactly, but answers an unfiltered one on a big
+    table from its statistics instead of reading every row for COUNT(*).
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Foreign key filter that searches the related admin through its
+    autocomplete view instead of listing every related row in the sidebar.
+    """
+    template = 'admin/home/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # Parameters of the admin autocomplete view, which looks the field up on its own model
+        self.app_label = field.model._meta.app_label
+        self.model_name = field.model._meta.model_name
+
+    def field_choices(self, field, request, model_admin):
+        # Only the selected row is loaded, to show its name
+        if not self.lookup_val:
+            return []
+        try:
+            related = field.related_model._default_manager.filter(pk=self.lookup_val).first()
+        except (ValueError, ValidationError):
+            return []
+        return [(related.pk, str(related))] if related else []
+
+    def has_output(self):
+        return True
+
+    @property
+    def selected_label(self):
+        return self.lookup_choices[0][1] if self.lookup_choices else ''
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows. list_select_related
+    also applies to the change form and to autocomplete results, which render
+    the same related names.
+    """
+    paginator = EstimatedCountPaginator
+    # Date drill-down from index range probes instead of a DISTINCT over every row
+    change_list_template = 'admin/home/scalable_change_list.html'
+    # The "N total" link would run a second COUNT(*) over the whole table
+    show_full_result_count = False
+    # The changelist default; autocomplete pages only get a stable order from here
+    ordering = ('-pk',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if isinstance(self.list_select_related, (list, tuple)):
+            queryset = queryset.select_related(*self.list_select_related)
+        return queryset
+
+    @property
+    def media(self):
+        # select2 for AutocompleteFilter; the widgets load the same files
+        extra = '' if settings.DEBUG else '.min'
+        return super().media + forms.Media(
+            js=(
+                f'admin/js/vendor/jquery/jquery{extra}.js',
+                f'admin/js/vendor/select2/select2.full{extra}.js',
+                'admin/js/jquery.init.js',
+                'admin/js/autocomplete.js',
+                'home/admin/autocomplete_filter.js',
+            ),
+            css={'screen': (f'admin/css/vendor/select2/select2{extra}.css', 'admin/css/autocomplete.css')},
+        )
+
 class ImagePreviewMixin:
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 100px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 100px;" />', images.url(obj.image, obj.image_variants, 100))
         return ""
     image_preview.short_description = 'Image Preview'
 
@@ -25,7 +135,7 @@ class RoomImageInline(admin.TabularInline, ImagePreviewMixin):
 class RoomInline(admin.TabularInline):
     model = Room
     extra = 1
-    fields = ('name', 'room_type', 'bed_type', 'price', 'capacity', 'is_available')
+    fields = ('name', 'room_type', 'bed_type', 'price', 'capacity', 'units', 'is_available')
 
 class TourImageInline(admin.TabularInline, ImagePreviewMixin):
     model = TourImage
@@ -38,17 +148,20 @@ class LocationAdmin(admin.ModelAdmin):
     list_filter = ('is_popular',)
     search_fields = ('name', 'description')
     readonly_fields = ('image_preview',)
+    ordering = ('name',)
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px;" />', images.url(obj.image, obj.image_variants, 50))
         return "No Image"
     image_preview.short_description = 'Image'
 
 @admin.register(Hotel)
-class HotelAdmin(admin.ModelAdmin):
+class HotelAdmin(ScalableAdmin):
     list_display = ('name', 'location', 'stars', 'price', 'rating', 'is_featured')
-    list_filter = ('location', 'stars', 'is_featured')
+    list_filter = (('location', AutocompleteFilter), 'stars', 'is_featured')
+    list_select_related = ('location',)
+    autocomplete_fields = ('location',)
     search_fields = ('name', 'location__name', 'address')
     inlines = [HotelImageInline, RoomInline]
     list_editable = ('is_featured',)
@@ -57,17 +170,21 @@ class HotelAdmin(admin.ModelAdmin):
             'fields': ('name', 'location', 'description', 'price', 'rating')
         }),
         ('Details', {
-            'fields': ('stars', 'address', 'amenities', 'is_featured')
+            'fields': ('stars', 'address', ('latitude', 'longitude'), 'amenities', 'is_featured')
         }),
     )
 
 @admin.register(FlightTicket)
-class FlightTicketAdmin(admin.ModelAdmin):
+class FlightTicketAdmin(ScalableAdmin):
     list_display = ('flight_number', 'airline', 'origin', 'destination', 'departure_time', 'arrival_time', 'seat_class', 'price', 'is_featured')
-    list_filter = ('origin', 'destination', 'seat_class', 'is_featured')
+    list_filter = (('origin', AutocompleteFilter), ('destination', AutocompleteFilter), 'seat_class', 'is_featured')
+    list_select_related = ('origin', 'destination')
+    autocomplete_fields = ('origin', 'destination')
     search_fields = ('flight_number', 'airline', 'origin__name', 'destination__name')
     list_editable = ('is_featured',)
+    # Backed by flight_departure_idx, which also serves the ordering
     date_hierarchy = 'departure_time'
+    ordering = ('-departure_time', '-id')
     fieldsets = (
         (None, {
             'fields': ('flight_number', 'airline', 'airline_logo', 'airline_logo_preview', 'origin', 'destination')
@@ -88,11 +205,17 @@ class FlightTicketAdmin(admin.ModelAdmin):
     airline_logo_preview.short_description = 'Airline Logo'
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(ScalableAdmin):
     list_display = ('user', 'booking_type', 'get_item_name', 'booking_date', 'check_in_date', 'check_out_date', 'total_price', 'status')
     list_filter = ('booking_type', 'status', 'booking_date')
     search_fields = ('user__username', 'hotel__name', 'flight__flight_number', 'tour__name', 'car__name')
+    # Everything get_item_name reads comes in the changelist query
+    list_select_related = ('user', 'hotel', 'flight__origin', 'flight__destination', 'tour', 'car')
+    autocomplete_fields = ('user', 'hotel', 'room', 'flight', 'tour', 'car', 'promotion')
+    # Backed by booking_date_idx, which also serves the ordering (SQLite and
+    # PostgreSQL index entries end with the row id)
     date_hierarchy = 'booking_date'
+    ordering = ('-booking_date', '-id')
     readonly_fields = ('total_price',)
 
     def get_item_name(self, obj):
@@ -108,9 +231,11 @@ class BookingAdmin(admin.ModelAdmin):
     get_item_name.short_description = 'Item'
 
 @admin.register(Tour)
-class TourAdmin(admin.ModelAdmin):
+class TourAdmin(ScalableAdmin):
     list_display = ('name', 'location', 'price', 'duration', 'rating', 'is_featured')
-    list_filter = ('location', 'is_featured')
+    list_filter = (('location', AutocompleteFilter), 'is_featured')
+    list_select_related = ('location',)
+    autocomplete_fields = ('location',)
     search_fields = ('name', 'location__name', 'description')
     list_editable = ('is_featured',)
     inlines = [TourImageInline]
@@ -124,16 +249,18 @@ class TourAdmin(admin.ModelAdmin):
     )
 
 @admin.register(CarTransfer)
-class CarTransferAdmin(admin.ModelAdmin):
+class CarTransferAdmin(ScalableAdmin):
     list_display = ('name', 'car_type', 'location', 'capacity', 'price', 'is_featured', 'image_preview')
-    list_filter = ('car_type', 'location', 'is_featured')
+    list_filter = ('car_type', ('location', AutocompleteFilter), 'is_featured')
+    list_select_related = ('location',)
+    autocomplete_fields = ('location',)
     search_fields = ('name', 'location__name', 'description')
     list_editable = ('is_featured',)
     readonly_fields = ('image_preview',)
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px;" />', images.url(obj.image, obj.image_variants, 50))
         return "No Image"
     image_preview.short_description = 'Image'
 
@@ -144,6 +271,7 @@ class PromotionAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description', 'promo_code')
     list_editable = ('is_active',)
     date_hierarchy = 'end_date'
+    ordering = ('-start_date',)
     readonly_fields = ('image_preview', 'is_valid', 'get_remaining_days')
 
     def image_preview(self, obj):
@@ -162,10 +290,12 @@ class PromotionAdmin(admin.ModelAdmin):
     get_remaining_days.short_description = 'Remaining Days'
 
 @admin.register(Room)
-class RoomAdmin(admin.ModelAdmin):
-    list_display = ('name', 'hotel', 'room_type', 'bed_type', 'price', 'capacity', 'is_available')
-    list_filter = ('hotel', 'room_type', 'bed_type', 'is_available', 'has_bathtub', 'has_refrigerator', 'has_air_conditioning', 'has_hot_water')
+class RoomAdmin(ScalableAdmin):
+    list_display = ('name', 'hotel', 'room_type', 'bed_type', 'price', 'capacity', 'units', 'is_available')
+    list_filter = (('hotel', AutocompleteFilter), 'room_type', 'bed_type', 'is_available', 'has_bathtub', 'has_refrigerator', 'has_air_conditioning', 'has_hot_water')
     search_fields = ('name', 'hotel__name', 'description')
+    list_select_related = ('hotel',)
+    autocomplete_fields = ('hotel',)
     inlines = [RoomImageInline]
     list_editable = ('is_available',)
     fieldsets = (
@@ -173,7 +303,7 @@ class RoomAdmin(admin.ModelAdmin):
             'fields': ('hotel', 'name', 'room_type', 'bed_type', 'description')
         }),
         ('Details', {
-            'fields': ('price', 'capacity', 'size', 'services', 'is_available')
+            'fields': ('price', 'capacity', 'units', 'size', 'services', 'is_available')
         }),
         ('Basic Amenities', {
             'fields': ('is_non_smoking', 'has_waiting_area'),
@@ -194,11 +324,16 @@ class RoomAdmin(admin.ModelAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'phone_number', 'address', 'profile_picture_preview')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
     search_fields = ('user__username', 'user__email', 'phone_number', 'address')
     readonly_fields = ('profile_picture_preview',)
 
     def profile_picture_preview(self, obj):
         if obj.profile_picture:
-            return format_html('<img src="{}" style="max-height: 50px;" />', obj.profile_picture.url)
+            return format_html(
+                '<img src="{}" style="max-height: 50px;" />',
+                images.url(obj.profile_picture, obj.profile_picture_variants, 50),
+            )
         return "No Image"
     profile_picture_preview.short_description = 'Profile Picture'
\ No newline at end of file
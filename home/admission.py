@@ -0,0 +1,247 @@
+import functools
+import ipaddress
+import logging
+import math
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+LIMITED = 'limited'        # 429: the client used up its token bucket
+OVERLOADED = 'overloaded'  # 503: the endpoint already runs `concurrency` requests
+ADMITTED = 'admitted'
+
+MESSAGES = {
+    LIMITED: 'Bạn thao tác quá nhanh, vui lòng thử lại sau {retry_after} giây.',
+    OVERLOADED: 'Hệ thống đang quá tải, vui lòng thử lại sau {retry_after} giây.',
+}
+STATUS_CODES = {LIMITED: 429, OVERLOADED: 503}
+
+BUCKET_SECONDS = 60
+# Share of admissions that also delete idle buckets and outcome counts older than the stats window
+CLEANUP_RATE = 0.01
+IDLE_BUCKET_SECONDS = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slot (
+    endpoint TEXT NOT NULL, holder TEXT NOT NULL, expires REAL NOT NULL, PRIMARY KEY (endpoint, holder)
+);
+CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS outcome (
+    endpoint TEXT NOT NULL, minute INTEGER NOT NULL, outcome TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (endpoint, minute, outcome)
+);
+"""
+
+_local = threading.local()
+
+
+def rules():
+    return getattr(settings, 'ADMISSION_RULES', {}) if getattr(settings, 'ADMISSION_CONTROL', False) else {}
+
+
+def window_seconds():
+    return getattr(settings, 'ADMISSION_STATS_WINDOW', 15 * 60)
+
+
+def _store():
+    # One connection per thread and store file; the file is what the worker processes share
+    path = str(settings.ADMISSION_DB)
+    conn = getattr(_local, 'connections', {}).get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=settings.ADMISSION_DB_TIMEOUT, isolation_level=None)
+        # Counters and leases only: losing the last writes in a crash is harmless
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.executescript(SCHEMA)
+        _local.__dict__.setdefault('connections', {})[path] = conn
+    return conn
+
+
+class _transaction:
+    # BEGIN IMMEDIATE takes the store's write lock up front, so read-modify-write is atomic across processes
+    def __enter__(self):
+        self.conn = _store()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def _count(conn, endpoint, outcome, now):
+    conn.execute(
+        'INSERT INTO outcome VALUES (?, ?, ?, 1) '
+        'ON CONFLICT (endpoint, minute, outcome) DO UPDATE SET count = count + 1',
+        (endpoint, int(now // BUCKET_SECONDS), outcome),
+    )
+
+
+def _cleanup(conn, now):
+    conn.execute('DELETE FROM bucket WHERE updated < ?', (now - IDLE_BUCKET_SECONDS,))
+    conn.execute('DELETE FROM outcome WHERE minute < ?', (int((now - window_seconds()) // BUCKET_SECONDS),))
+
+
+def admit(endpoint, client, rule, now=None):
+    """
+    (outcome, holder or None, Retry-After seconds or None). An admitted
+    request holds one of the endpoint's `concurrency` slots until release();
+    a slot of a process that died frees itself after ADMISSION_SLOT_TIMEOUT.
+    A rejected request takes neither a slot nor a token.
+    """
+    now = time.time() if now is None else now
+    with _transaction() as conn:
+        tokens = None
+        if rule.get('rate'):
+            key = f'{endpoint}:{client}'
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = rule['burst'] if row is None else min(rule['burst'], row[0] + (now - row[1]) * rule['rate'])
+            if tokens < 1:
+                _count(conn, endpoint, LIMITED, now)
+                return LIMITED, None, math.ceil((1 - tokens) / rule['rate'])
+
+        holder = None
+        if rule.get('concurrency'):
+            conn.execute('DELETE FROM slot WHERE endpoint = ? AND expires < ?', (endpoint, now))
+            [running] = conn.execute('SELECT COUNT(*) FROM slot WHERE endpoint = ?', (endpoint,)).fetchone()
+            if running >= rule['concurrency']:
+                _count(conn, endpoint, OVERLOADED, now)
+                return OVERLOADED, None, settings.ADMISSION_RETRY_AFTER
+            holder = uuid.uuid4().hex
+            conn.execute('INSERT INTO slot VALUES (?, ?, ?)', (endpoint, holder, now + settings.ADMISSION_SLOT_TIMEOUT))
+
+        if tokens is not None:
+            conn.execute('REPLACE INTO bucket VALUES (?, ?, ?)', (key, tokens - 1, now))
+        _count(conn, endpoint, ADMITTED, now)
+        if random.random() < CLEANUP_RATE:
+            _cleanup(conn, now)
+    return ADMITTED, holder, None
+
+
+def release(endpoint, holder):
+    _store().execute('DELETE FROM slot WHERE endpoint = ? AND holder = ?', (endpoint, holder))
+
+
+def stats(now=None):
+    """
+    [{endpoint, admitted, limited, overloaded, shed, shed_share, running}]
+    over the last ADMISSION_STATS_WINDOW seconds, for all worker processes.
+    """
+    now = time.time() if now is None else now
+    conn = _store()
+    since = int((now - window_seconds()) // BUCKET_SECONDS)
+    rows = {}
+    for endpoint, outcome, count in conn.execute(
+        'SELECT endpoint, outcome, SUM(count) FROM outcome WHERE minute > ? GROUP BY endpoint, outcome', (since,),
+    ):
+        rows.setdefault(endpoint, {ADMITTED: 0, LIMITED: 0, OVERLOADED: 0})[outcome] = count
+    running = dict(conn.execute('SELECT endpoint, COUNT(*) FROM slot WHERE expires >= ? GROUP BY endpoint', (now,)))
+    result = []
+    for endpoint, counts in sorted(rows.items()):
+        shed = counts[LIMITED] + counts[OVERLOADED]
+        result.append(dict(
+            counts, endpoint=endpoint, shed=shed, shed_share=shed / (shed + counts[ADMITTED]),
+            running=running.get(endpoint, 0),
+        ))
+    return result
+
+
+def reset():
+    with _transaction() as conn:
+        for table in ('slot', 'bucket', 'outcome'):
+            conn.execute(f'DELETE FROM {table}')
+
+
+@functools.lru_cache(maxsize=8)
+def _networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _is_trusted(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in _networks(tuple(getattr(settings, 'ADMISSION_TRUSTED_PROXIES', ()))))
+
+
+def client_address(request):
+    """
+    The address of the client. X-Forwarded-For is only believed when the
+    connection comes from one of ADMISSION_TRUSTED_PROXIES: its entries are
+    read from the right, past the trusted proxies, so an address the client
+    wrote in the header itself is never used.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    if not _is_trusted(address):
+        return address
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if not _is_trusted(hop):
+            break
+    return address
+
+
+def client_key(request):
+    # Signed-in visitors are limited per account, everyone else per address
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{client_address(request)}'
+
+
+def rejection(request, outcome, retry_after):
+    # Plain text, or the {'success', 'message'} shape of the JSON endpoints; no template, no queries
+    message = MESSAGES[outcome].format(retry_after=retry_after)
+    if request.GET.get('format') == 'json' or 'application/json' in request.headers.get('Accept', ''):
+        response = JsonResponse({'success': False, 'message': message}, status=STATUS_CODES[outcome])
+    else:
+        response = HttpResponse(message, status=STATUS_CODES[outcome], content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Guards the expensive endpoints of ADMISSION_RULES (by URL name) before
+    their view runs: over the per-client rate they answer 429, with the
+    endpoint's concurrency used up 503, both at once and with Retry-After.
+    The limits hold across worker processes through the ADMISSION_DB file.
+    If that store cannot be reached in time, requests are let through.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._admission = None
+        try:
+            return self.get_response(request)
+        finally:
+            if request._admission is not None:
+                try:
+                    release(*request._admission)
+                except sqlite3.Error:
+                    logger.warning('Admission slot %s not released; it expires on its own', request._admission[1])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        endpoint = request.resolver_match.url_name
+        rule = rules().get(endpoint)
+        if rule is None or ('methods' in rule and request.method not in rule['methods']):
+            return None
+        try:
+            outcome, holder, retry_after = admit(endpoint, client_key(request), rule)
+        except sqlite3.Error as e:
+            logger.warning('Admission store unavailable, letting %s through: %s', endpoint, e)
+            return None
+        if outcome != ADMITTED:
+            return rejection(request, outcome, retry_after)
+        if holder is not None:
+            request._admission = (endpoint, holder)
+        return None
@@ -0,0 +1,210 @@
+import asyncio
+import contextlib
+import platform
+import re
+import statistics
+import time
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.utils import timezone
+
+from .models import Booking, CarTransfer, FlightTicket, Hotel, Location, Tour
+
+# Views timed by run(), in report order
+ENDPOINTS = (
+    'home', 'search', 'hotel_search', 'flight_search', 'tour_search', 'car_search',
+    'detail', 'booking', 'user_orders',
+)
+
+REQUESTS = 50
+WARMUP = 5
+
+# Relative change of p50/p95 that compare() calls a regression or an improvement
+THRESHOLD = 0.10
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values, fraction):
+    # Nearest rank, so the figure is always one of the measured requests
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(len(values) * fraction) - 1))]
+
+
+def _busiest(model):
+    # The location with the most items of this kind; ties go to the lowest id so runs agree
+    row = model.objects.values('location').annotate(items=Count('id')).order_by('-items', 'location').first()
+    return row['location'] if row else None
+
+
+def targets():
+    """
+    {endpoint: (url, needs login)} for the data in the database, picked the
+    same way on every run so two runs against one dataset time the same pages.
+    """
+    hotel = Hotel.objects.order_by('id').first()
+    flight = FlightTicket.objects.filter(departure_time__gte=timezone.now()).order_by('departure_time', 'id').first()
+    location = Location.objects.filter(pk=_busiest(Hotel)).first()
+    if hotel is None or flight is None or location is None:
+        raise BenchmarkError('The database needs hotels and upcoming flights; run seed_scale first.')
+    departure = timezone.localtime(flight.departure_time).date().isoformat()
+    return {
+        'home': ('/', False),
+        'search': (f"/search/?{urlencode({'q': location.name, 'type': 'hotel'})}", False),
+        'hotel_search': (f'/hotels/?location={location.pk}', False),
+        'flight_search': (
+            f'/flights/?origin={flight.origin_id}&destination={flight.destination_id}&departure_date={departure}',
+            False,
+        ),
+        'tour_search': (f'/tours/?location={_busiest(Tour) or ""}', False),
+        'car_search': (f'/cars/?location={_busiest(CarTransfer) or ""}', False),
+        'detail': (f'/detail/hotel/{hotel.pk}/', False),
+        'booking': (f'/booking/hotel/{hotel.pk}/', True),
+        'user_orders': ('/orders/', True),
+    }
+
+
+def _user():
+    # The visitor behind the latest booking: a real order history, found on booking_date_idx
+    booking = Booking.objects.order_by('-booking_date').select_related('user').first()
+    if booking is None:
+        raise BenchmarkError('The database has no bookings; run seed_scale first.')
+    return booking.user
+
+
+_SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def _measure(response, elapsed, url):
+    # (ms, queries, DB ms); the counts come from the profiler's header, which sees every thread
+    if response.status_code != 200:
+        raise BenchmarkError(f'GET {url} answered {response.status_code}')
+    match = _SERVER_TIMING_DB.match(response.get('Server-Timing', ''))
+    if match is None:
+        raise BenchmarkError('No Server-Timing header; is home.profiler.QueryProfilerMiddleware installed?')
+    return elapsed * 1000, int(match.group(2)), float(match.group(1))
+
+
+def _sample(client, url, requests, warmup):
+    samples = []
+    for i in range(warmup + requests):
+        started = time.perf_counter()
+        response = client.get(url)
+        measured = _measure(response, time.perf_counter() - started, url)
+        if i >= warmup:
+            samples.append(measured)
+    return samples
+
+
+async def _asample(client, url, requests, warmup):
+    samples = []
+    for i in range(warmup + requests):
+        started = time.perf_counter()
+        response = await client.get(url)
+        measured = _measure(response, time.perf_counter() - started, url)
+        if i >= warmup:
+            samples.append(measured)
+    return samples
+
+
+@contextlib.contextmanager
+def simulated_db_latency(ms):
+    # Every statement waits `ms` first, like a round trip to a database server; sleeping releases the GIL
+    if not ms:
+        yield
+        return
+    execute = CursorWrapper._execute
+    executemany = CursorWrapper._executemany
+
+    def delayed(method):
+        def wrapper(self, *args):
+            time.sleep(ms / 1000)
+            return method(self, *args)
+        return wrapper
+    CursorWrapper._execute = delayed(execute)
+    CursorWrapper._executemany = delayed(executemany)
+    try:
+        yield
+    finally:
+        CursorWrapper._execute = execute
+        CursorWrapper._executemany = executemany
+
+
+def run(endpoints=ENDPOINTS, requests=REQUESTS, warmup=WARMUP, asgi=False, db_latency=0, on_result=None):
+    """
+    Times each endpoint through the test client: warmup requests first, then
+    `requests` measured ones. With `asgi` the requests go through Django's
+    ASGI handler, as HP10/asgi.py serves them. Returns a JSON-ready dict;
+    latencies are in milliseconds.
+    """
+    client = AsyncClient() if asgi else Client()
+    client.force_login(_user())
+    urls = targets()
+    results = {}
+    with override_settings(QUERY_PROFILER_SAMPLE_RATE=1), simulated_db_latency(db_latency):
+        for name in endpoints:
+            url, _ = urls[name]
+            if asgi:
+                samples = asyncio.run(_asample(client, url, requests, warmup))
+            else:
+                samples = _sample(client, url, requests, warmup)
+            timings, queries, db_times = zip(*samples)
+            results[name] = {
+                'url': url,
+                'requests': requests,
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'mean_ms': round(statistics.fmean(timings), 3),
+                'max_ms': round(max(timings), 3),
+                'queries': percentile(queries, 0.50),
+                'max_queries': max(queries),
+                'db_p50_ms': round(percentile(db_times, 0.50), 3),
+            }
+            if on_result:
+                on_result(name, results[name])
+    meta = metadata(requests, warmup)
+    meta.update(server='asgi' if asgi else 'wsgi', async_views=settings.ASYNC_VIEWS, db_latency_ms=db_latency)
+    return {'meta': meta, 'results': results}
+
+
+def metadata(requests, warmup):
+    return {
+        'created': timezone.now().isoformat(),
+        'requests': requests,
+        'warmup': warmup,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'rows': {
+            model._meta.model_name: model.objects.count()
+            for model in (Location, Hotel, FlightTicket, Tour, CarTransfer, Booking)
+        },
+    }
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    # [(endpoint, p50 change, p95 change, query change, verdict)] for endpoints in both runs
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        p50 = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        p95 = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        query_change = result['queries'] - before['queries']
+        if query_change > 0 or p50 > threshold:
+            verdict = 'slower'
+        elif query_change < 0 or p50 < -threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        rows.append((name, p50, p95, query_change, verdict))
+    return rows
@@ -0,0 +1,274 @@
+import functools
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from .routers import read_alias
+
+PREFIX = 'catalog'
+
+# XFetch: the longer an entry took to build, the earlier before expiry it gets rebuilt
+EARLY_REFRESH_BETA = 1.0
+# How long a miss waits for the process that is already building the same entry
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.02
+
+# value, unix time it expires at, seconds it took to build
+Entry = namedtuple('Entry', 'value expires delta')
+
+_lock = threading.Lock()
+_lru = OrderedDict()   # key -> Entry, least recently used first
+_versions = {}         # model label -> (version, monotonic time read from the shared cache)
+_flights = {}          # key -> _Flight of the thread building it
+_stats = {}            # cache name -> counters
+
+COUNTERS = ('local_hits', 'shared_hits', 'misses', 'coalesced', 'early_refreshes')
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+def is_enabled():
+    return getattr(settings, 'CATALOG_CACHE', True)
+
+
+def shared():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def _count(name, counter):
+    with _lock:
+        stats = _stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+        stats[counter] += 1
+
+
+def _version_key(label):
+    return f'{PREFIX}:v:{label}'
+
+
+def versions(labels):
+    # Read from the shared cache at most every CATALOG_CACHE_VERSION_TTL seconds per process
+    now = time.monotonic()
+    ttl = getattr(settings, 'CATALOG_CACHE_VERSION_TTL', 1)
+    known = {}
+    missing = []
+    for label in labels:
+        version = _versions.get(label)
+        if version is not None and now - version[1] < ttl:
+            known[label] = version[0]
+        else:
+            missing.append(label)
+    if missing:
+        found = shared().get_many([_version_key(label) for label in missing])
+        for label in missing:
+            version = found.get(_version_key(label))
+            if version is None:
+                # Never bumped, or evicted: any fresh value works, entries under an old one stay unreachable
+                version = time.time_ns()
+                if not shared().add(_version_key(label), version, None):
+                    version = shared().get(_version_key(label), version)
+            _versions[label] = (version, now)
+            known[label] = version
+    return [known[label] for label in labels]
+
+
+def _bump(labels):
+    # A new value rather than incr(): two processes bumping at once still both change it
+    now = time.monotonic()
+    for label in labels:
+        version = time.time_ns()
+        shared().set(_version_key(label), version, None)
+        _versions[label] = (version, now)
+
+
+def _bump_now_and_on_commit(labels):
+    _bump(labels)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(labels))
+
+
+def _scope_label(scope):
+    return f'scope:{scope}'
+
+
+def bump(*models):
+    """
+    Makes every entry that depends on these models unreachable. Called at
+    once, so this process does not read its own old entries, and again on
+    commit, so no process keeps an entry built from the uncommitted state.
+    """
+    _bump_now_and_on_commit([model._meta.label_lower for model in models])
+
+
+def bump_scope(*scopes):
+    # Like bump(), for the entries that named one of these scopes, e.g. one flight route
+    _bump_now_and_on_commit([_scope_label(scope) for scope in scopes])
+
+
+def _key(name, labels, key):
+    # The read alias is part of it: a visitor pinned to the primary after a write must not
+    # be served an entry built from a replica that has not caught up yet
+    digest = hashlib.md5(repr((versions(labels), read_alias(), key)).encode(), usedforsecurity=False).hexdigest()
+    return f'{PREFIX}:{name}:{digest}'
+
+
+def _local_get(key):
+    with _lock:
+        entry = _lru.get(key)
+        if entry is not None:
+            _lru.move_to_end(key)
+        return entry
+
+
+def _local_set(key, entry):
+    with _lock:
+        _lru[key] = entry
+        _lru.move_to_end(key)
+        while len(_lru) > getattr(settings, 'CATALOG_CACHE_LOCAL_ENTRIES', 1000):
+            _lru.popitem(last=False)
+
+
+def _refresh_early(entry, now):
+    return now - entry.delta * EARLY_REFRESH_BETA * math.log(1 - random.random()) >= entry.expires
+
+
+def _build(key, loader, timeout):
+    started = time.time()
+    value = loader()
+    finished = time.time()
+    entry = Entry(value, finished + timeout, finished - started)
+    shared().set(key, entry, timeout)
+    _local_set(key, entry)
+    return entry
+
+
+def _single_flight(name, key, loader, timeout):
+    # One build per key and process; other processes wait while the lock key is held
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(LOCK_WAIT)
+        if flight.entry is not None:
+            _count(name, 'coalesced')
+            return flight.entry.value
+        return loader()
+
+    lock_key = f'{key}:lock'
+    locked = False
+    try:
+        locked = shared().add(lock_key, 1, int(LOCK_WAIT) + 1)
+        if not locked:
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL)
+                entry = shared().get(key)
+                if entry is not None:
+                    _local_set(key, entry)
+                    flight.entry = entry
+                    _count(name, 'coalesced')
+                    return entry.value
+        _count(name, 'misses')
+        flight.entry = _build(key, loader, timeout)
+        return flight.entry.value
+    finally:
+        if locked:
+            shared().delete(lock_key)
+        flight.done.set()
+        with _lock:
+            _flights.pop(key, None)
+
+
+def get_or_set(name, loader, models=(), key=(), timeout=None, scopes=()):
+    """
+    loader() through the per-process LRU and the shared cache. `name` and
+    `key` (any repr()-stable value, such as the arguments) identify the
+    entry; the versions of `models` are part of it, so saving one of them
+    retires the entry, and so are those of `scopes`, narrower names that
+    bump_scope() retires without touching the rest of a model's entries.
+    Concurrent misses of one entry build it once, and an entry is rebuilt by
+    a single caller shortly before it expires. The value is shared between
+    requests and threads and must not be modified.
+    """
+    if not is_enabled():
+        return loader()
+    timeout = _timeout() if timeout is None else timeout
+    labels = [model._meta.label_lower for model in models] + [_scope_label(scope) for scope in scopes]
+    key = _key(name, labels, key)
+    now = time.time()
+    entry = _local_get(key)
+    tier = 'local_hits'
+    if entry is None or entry.expires <= now:
+        entry = shared().get(key)
+        tier = 'shared_hits'
+        if entry is not None:
+            _local_set(key, entry)
+    if entry is None or entry.expires <= now:
+        return _single_flight(name, key, loader, timeout)
+
+    if _refresh_early(entry, now) and key not in _flights and shared().add(f'{key}:lock', 1, int(LOCK_WAIT) + 1):
+        # Everyone else keeps getting the current value meanwhile
+        _count(name, 'early_refreshes')
+        try:
+            return _build(key, loader, timeout).value
+        finally:
+            shared().delete(f'{key}:lock')
+    _count(name, tier)
+    return entry.value
+
+
+def cached(name=None, models=(), timeout=None):
+    """
+    get_or_set() as a decorator; the call's arguments are part of the key.
+
+        @catalog_cache.cached(models=(Hotel, Location))
+        def featured_hotels(limit):
+            ...
+    """
+    def decorate(func):
+        cache_name = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return get_or_set(
+                cache_name, lambda: func(*args, **kwargs), models,
+                key=(args, sorted(kwargs.items())), timeout=timeout,
+            )
+        return wrapper
+    return decorate
+
+
+def stats():
+    # [{name, hits, misses, hit_ratio, ...counters}] of this process since start or reset()
+    with _lock:
+        rows = [dict(counters, name=name) for name, counters in sorted(_stats.items())]
+    for row in rows:
+        row['hits'] = row['local_hits'] + row['shared_hits'] + row['coalesced']
+        requests = row['hits'] + row['misses'] + row['early_refreshes']
+        row['hit_ratio'] = row['hits'] / requests if requests else 0.0
+    return rows
+
+
+def clear():
+    # Drops both tiers, with everything else in the shared cache's alias, and the statistics
+    with _lock:
+        _lru.clear()
+        _versions.clear()
+        _stats.clear()
+    shared().clear()
@@ -0,0 +1,48 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from . import profiler
+
+
+def run_serially(loads):
+    # {name: zero-argument callable} -> {name: result}, one after the other
+    return {name: load() for name, load in loads.items()}
+
+
+def _run_in_worker(load):
+    with profiler.attached():
+        try:
+            return load()
+        finally:
+            # Worker threads never see request_finished; CONN_MAX_AGE decides here instead
+            close_old_connections()
+
+
+async def gather(loads):
+    """
+    Like run_serially(), but every load runs at the same time in a thread of
+    its own, on that thread's own database connection. Django's async ORM
+    methods (afirst(), aaggregate(), ...) would all queue for the one
+    thread-sensitive worker, so they are not used for this. Loads must only
+    read: they run outside the request's transaction.
+    """
+    names = list(loads)
+    results = await asyncio.gather(
+        *(sync_to_async(_run_in_worker, thread_sensitive=False)(loads[name]) for name in names)
+    )
+    return dict(zip(names, results))
+
+
+def respond(prepare, *args):
+    # prepare(*args) -> (loads, respond(data)); the synchronous view path
+    loads, finish = prepare(*args)
+    return finish(run_serially(loads))
+
+
+async def arespond(prepare, *args):
+    # The same page from an async view: loads gathered, then rendered on the sync thread
+    loads, finish = prepare(*args)
+    data = await gather(loads)
+    return await sync_to_async(finish)(data)
@@ -0,0 +1,142 @@
+import csv
+import json
+from datetime import date, datetime, time as dt_time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, CharField, F, IntegerField, Value, When
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .models import Booking
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+
+CHUNK_SIZE = 2000
+
+# Responses are written in pieces of about this many bytes instead of a line at a time
+BUFFER_SIZE = 64 * 1024
+
+# Output column -> values() lookup, in export order
+COLUMNS = {
+    'id': 'id',
+    'booking_date': 'booking_date',
+    'status': 'status',
+    'booking_type': 'booking_type',
+    'user_id': 'user_id',
+    'username': 'user__username',
+    'email': 'user__email',
+    'item_id': 'item_id',
+    'item_name': 'item_name',
+    'room': 'room__name',
+    'check_in_date': 'check_in_date',
+    'check_out_date': 'check_out_date',
+    'number_of_guests': 'number_of_guests',
+    'promotion_code': 'promotion__promo_code',
+    'promotion_title': 'promotion__title',
+    'total_price': 'total_price',
+    'special_requests': 'special_requests',
+}
+
+
+def _item_columns():
+    # Same names BookingAdmin.get_item_name shows, computed by the join instead of per row
+    item_id = Case(
+        When(booking_type='hotel', then=F('hotel_id')),
+        When(booking_type='flight', then=F('flight_id')),
+        When(booking_type='tour', then=F('tour_id')),
+        When(booking_type='car', then=F('car_id')),
+        output_field=IntegerField(),
+    )
+    item_name = Case(
+        When(booking_type='hotel', then=F('hotel__name')),
+        When(booking_type='flight', then=Concat(
+            F('flight__flight_number'), Value(' ('), F('flight__origin__name'),
+            Value(' to '), F('flight__destination__name'), Value(')'),
+            output_field=CharField(),
+        )),
+        When(booking_type='tour', then=F('tour__name')),
+        When(booking_type='car', then=F('car__name')),
+        output_field=CharField(),
+    )
+    return {'item_id': item_id, 'item_name': item_name}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, dt_time.min))
+
+
+def bookings(start=None, end=None, statuses=None, booking_type=None):
+    """
+    Flat booking rows as dicts, one query for all of them. `start` and `end`
+    are inclusive dates of booking_date.
+    """
+    queryset = Booking.objects.all()
+    if start:
+        queryset = queryset.filter(booking_date__gte=_day_start(start))
+    if end:
+        queryset = queryset.filter(booking_date__lt=_day_start(end + timedelta(days=1)))
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if booking_type:
+        queryset = queryset.filter(booking_type=booking_type)
+    return queryset.annotate(**_item_columns()).order_by('id').values(*COLUMNS.values())
+
+
+def rows(queryset, chunk_size=CHUNK_SIZE):
+    # iterator() skips the result cache and uses a server-side cursor where the backend has one
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield {column: row[lookup] for column, lookup in COLUMNS.items()}
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back instead of storing it
+    def write(self, value):
+        return value
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Names and special requests are typed by customers; the quote makes the cell plain text
+        return "'" + value
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(COLUMNS))
+    for row in rows:
+        yield writer.writerow([_text(value) for value in row.values()])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def lines(rows, file_format):
+    return csv_lines(rows) if file_format == 'csv' else jsonl_lines(rows)
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,63 @@
+from datetime import datetime, time as dt_time, timedelta
+
+from django.db.models import Count, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import catalog_cache
+from .models import FlightTicket
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 90
+
+
+def _window(start, days):
+    begin = timezone.make_aware(datetime.combine(start, dt_time.min))
+    return begin, begin + timedelta(days=days)
+
+
+def _load(origin_id, destination_id, seat_class, start, days):
+    begin, end = _window(start, days)
+    flights = FlightTicket.objects.filter(
+        origin_id=origin_id,
+        destination_id=destination_id,
+        departure_time__gte=begin,
+        departure_time__lt=end,
+    )
+    if seat_class:
+        flights = flights.filter(seat_class=seat_class)
+
+    # One grouped query for the whole window; sold-out flights do not set the price
+    rows = flights.annotate(day=TruncDate('departure_time')).values('day').annotate(
+        min_price=Min('price', filter=Q(available_seats__gt=0)),
+        available_seats=Sum('available_seats'),
+        flights=Count('id'),
+    ).order_by()
+    by_day = {row['day']: row for row in rows}
+
+    calendar = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = by_day.get(day)
+        calendar.append({
+            'date': day,
+            'min_price': row['min_price'] if row else None,
+            'available_seats': row['available_seats'] if row else 0,
+            'flights': row['flights'] if row else 0,
+        })
+    return calendar
+
+
+def route_scope(origin_id, destination_id):
+    return f'flight-route:{origin_id}-{destination_id}'
+
+
+def fares(origin_id, destination_id, seat_class='', start=None, days=DEFAULT_DAYS):
+    # A flight save, in any process, retires every calendar; a seat sale only those of its route
+    start = start or timezone.now().date()
+    days = max(1, min(days, MAX_DAYS))
+    return catalog_cache.get_or_set(
+        'fare_calendar', lambda: _load(origin_id, destination_id, seat_class, start, days),
+        models=(FlightTicket,), scopes=(route_scope(origin_id, destination_id),),
+        key=(origin_id, destination_id, seat_class, start, days),
+    )
@@ -0,0 +1,323 @@
+import math
+
+from django.db import connection, connections, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Sum, Value, When
+from django.db.models.functions import Floor
+
+from .models import Hotel, Location
+from .routers import read_alias
+
+GEO_MODELS = {
+    'hotel': Hotel,
+    'location': Location,
+}
+
+TABLES = {kind: f'home_geo_{kind}' for kind in GEO_MODELS}
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Web Mercator, as map tiles use it: 256 px per tile, 2**zoom tiles around the world
+TILE_SIZE = 256
+MAX_ZOOM = 22
+# Markers closer than this on screen are merged into one cluster
+CLUSTER_PIXELS = 60
+# Beyond the poles Mercator has no y
+MAX_LATITUDE = 85.05112878
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def create_sql(kind):
+    return f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLES[kind]} USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+
+
+def kind_for(obj):
+    for kind, model in GEO_MODELS.items():
+        if isinstance(obj, model):
+            return kind
+    return None
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # Haversine on a sphere of the mean earth radius; within 0.5% of the ellipsoid
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lng, radius_km):
+    """
+    (south, west, north, east) around the circle. west > east when it
+    crosses the antimeridian; a circle around a pole spans every longitude.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    angle = math.sin(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    if south == -90.0 or north == 90.0 or angle >= cos_lat:
+        return south, -180.0, north, 180.0
+    dlng = math.degrees(math.asin(angle / cos_lat))
+    west, east = lng - dlng, lng + dlng
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def _boxes(south, west, north, east):
+    # Longitude ranges without wrap-around
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def points_in_bbox(kind, south, west, north, east):
+    """
+    [(id, lat, lng)] of the kind inside the box. On SQLite this reads the
+    R*Tree, whose 32-bit coordinates are within a metre of the stored ones.
+    """
+    points = []
+    if is_enabled():
+        sql = (
+            f"SELECT id, (min_lat + max_lat) / 2, (min_lng + max_lng) / 2 FROM {TABLES[kind]} "
+            "WHERE max_lat >= %s AND min_lat <= %s AND max_lng >= %s AND min_lng <= %s"
+        )
+        with connections[read_alias()].cursor() as cursor:
+            for s, w, n, e in _boxes(south, west, north, east):
+                cursor.execute(sql, [s, n, w, e])
+                points.extend(cursor.fetchall())
+        return points
+    for s, w, n, e in _boxes(south, west, north, east):
+        points.extend(
+            GEO_MODELS[kind].objects.filter(latitude__range=(s, n), longitude__range=(w, e))
+            .values_list('id', 'latitude', 'longitude')
+        )
+    return points
+
+
+def within_radius(kind, lat, lng, radius_km):
+    # [(distance in km, id)], nearest first
+    found = []
+    for pk, point_lat, point_lng in points_in_bbox(kind, *radius_bbox(lat, lng, radius_km)):
+        distance = distance_km(lat, lng, point_lat, point_lng)
+        if distance <= radius_km:
+            found.append((distance, pk))
+    found.sort()
+    return found
+
+
+def listing_queryset(kind):
+    if kind == 'hotel':
+        return Hotel.objects.for_listing()
+    return Location.objects.all()
+
+
+def nearby(kind, lat, lng, radius_km, limit=None, queryset=None):
+    # Objects within radius_km, nearest first, each with a distance_km attribute
+    found = within_radius(kind, lat, lng, radius_km)[:limit]
+    objects = (queryset if queryset is not None else listing_queryset(kind)).in_bulk([pk for _, pk in found])
+    result = []
+    for _, pk in found:
+        obj = objects.get(pk)
+        if obj is not None:
+            obj.distance_km = distance_km(lat, lng, obj.latitude, obj.longitude)
+            result.append(obj)
+    return result
+
+
+def _delete_rows(cursor, kind, ids):
+    cursor.executemany(f"DELETE FROM {TABLES[kind]} WHERE id = %s", [(pk,) for pk in ids])
+
+
+def _insert_rows(cursor, kind, objs):
+    cursor.executemany(
+        f"INSERT INTO {TABLES[kind]} (id, min_lat, max_lat, min_lng, max_lng) VALUES (%s, %s, %s, %s, %s)",
+        [
+            (obj.pk, obj.latitude, obj.latitude, obj.longitude, obj.longitude)
+            for obj in objs if obj.latitude is not None and obj.longitude is not None
+        ],
+    )
+
+
+def index_objects(objs):
+    if not is_enabled():
+        return
+    by_kind = {}
+    for obj in objs:
+        by_kind.setdefault(kind_for(obj), []).append(obj)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for kind, group in by_kind.items():
+            _delete_rows(cursor, kind, [obj.pk for obj in group])
+            _insert_rows(cursor, kind, group)
+
+
+def remove_object(obj):
+    if not is_enabled():
+        return
+    with connection.cursor() as cursor:
+        _delete_rows(cursor, kind_for(obj), [obj.pk])
+
+
+def rebuild(batch_size=2000, stdout=None):
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        for kind, model in GEO_MODELS.items():
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLES[kind]}")
+            cursor.execute(create_sql(kind))
+            queryset = model.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+                'id', 'latitude', 'longitude',
+            )
+            batch = []
+            counts[kind] = 0
+            for obj in queryset.iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    _insert_rows(cursor, kind, batch)
+                    counts[kind] += len(batch)
+                    batch = []
+            if batch:
+                _insert_rows(cursor, kind, batch)
+                counts[kind] += len(batch)
+            if stdout:
+                stdout.write(f"Indexed {counts[kind]} {kind} coordinates")
+    return counts
+
+
+def world_size(zoom):
+    return TILE_SIZE * 2 ** zoom
+
+
+def to_pixels(lat, lng, zoom):
+    # Web Mercator pixel of a point; y grows southwards
+    size = world_size(zoom)
+    sin_lat = math.sin(math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))))
+    x = (lng + 180) / 360 * size
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * size
+    return x, y
+
+
+def to_lat_lng(x, y, zoom):
+    size = world_size(zoom)
+    lng = x / size * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+    return lat, lng
+
+
+def grid_cells(south, west, north, east, zoom):
+    """
+    (first column, first row, last column, last row) of the clustering grid
+    covering the box; the last column is smaller than the first when the
+    box crosses the antimeridian. The grid is fixed to the world, so the
+    clusters of a cell stay put while the map pans.
+    """
+    columns = math.ceil(world_size(zoom) / CLUSTER_PIXELS)
+
+    def cell(pixel):
+        return max(0, min(columns - 1, int(pixel // CLUSTER_PIXELS)))
+    x0, y0 = to_pixels(north, west, zoom)
+    x1, y1 = to_pixels(south, east, zoom)
+    return cell(x0), cell(y0), cell(x1), cell(y1)
+
+
+def cell_count(cells, zoom):
+    first_column, first_row, last_column, last_row = cells
+    columns = last_column - first_column + 1
+    if columns <= 0:
+        columns += math.ceil(world_size(zoom) / CLUSTER_PIXELS)
+    return columns * (last_row - first_row + 1)
+
+
+def _row_band(row, zoom):
+    # (south, north) latitudes of one grid row; a point on the north edge belongs to it, like to_pixels() rounds
+    north, _ = to_lat_lng(0, row * CLUSTER_PIXELS, zoom)
+    south, _ = to_lat_lng(0, min(world_size(zoom), (row + 1) * CLUSTER_PIXELS), zoom)
+    return south, north
+
+
+def _column_range(cells, zoom):
+    # (west, east) of the grid columns
+    first_column, _, last_column, _ = cells
+    _, west = to_lat_lng(first_column * CLUSTER_PIXELS, 0, zoom)
+    _, east = to_lat_lng(min(world_size(zoom), (last_column + 1) * CLUSTER_PIXELS), 0, zoom)
+    return west, east
+
+
+def _aggregate(kind, bands, west, east, zoom):
+    """
+    (row, column, count, sum lat, sum lng, south, west, north, east, lowest
+    id) per grid cell of the bands, [(row, south, north)] from north to
+    south. Columns are linear in longitude and rows are picked by a CASE over
+    the band edges, so the database groups every cell of a box in one query;
+    only the band edges need Mercator in Python.
+    """
+    scale = world_size(zoom) / 360 / CLUSTER_PIXELS
+    south, north = bands[-1][1], bands[0][2]
+    boxes = _boxes(south, west, north, east)
+    # A point belongs to the first band, going south, whose south edge it is above
+    edges = [(band_south, row) for row, band_south, _ in bands[:-1]]
+    last_row = bands[-1][0]
+    if is_enabled():
+        lat, lng = '(min_lat + max_lat) / 2', '(min_lng + max_lng) / 2'
+        case = 'CASE ' + ''.join(f'WHEN {lat} > %s THEN %s ' for _ in edges) + 'ELSE %s END' if edges else '%s'
+        sql = (
+            f"SELECT {case} AS grid_row, CAST(({lng} + 180) * %s AS INTEGER) AS col, COUNT(*), "
+            f"SUM({lat}), SUM({lng}), MIN({lat}), MIN({lng}), MAX({lat}), MAX({lng}), MIN(id) "
+            f"FROM {TABLES[kind]} "
+            f"WHERE max_lat > %s AND min_lat <= %s AND max_lng >= %s AND min_lng <= %s "
+            f"AND {lat} > %s AND {lat} <= %s GROUP BY grid_row, col"
+        )
+        case_params = [value for edge in edges for value in edge] + [last_row]
+        rows = []
+        with connections[read_alias()].cursor() as cursor:
+            for s, w, n, e in boxes:
+                cursor.execute(sql, case_params + [scale, s, n, w, e, s, n])
+                rows.extend(cursor.fetchall())
+        return rows
+    grid_row = Case(
+        *[When(latitude__gt=band_south, then=Value(row)) for band_south, row in edges],
+        default=Value(last_row), output_field=IntegerField(),
+    )
+    rows = []
+    for s, w, n, e in boxes:
+        rows.extend(
+            GEO_MODELS[kind].objects
+            .filter(latitude__gt=s, latitude__lte=n, longitude__range=(w, e))
+            .annotate(grid_row=grid_row, col=Floor((F('longitude') + 180) * scale)).values('grid_row', 'col')
+            .annotate(
+                count=Count('id'), lat_sum=Sum('latitude'), lng_sum=Sum('longitude'),
+                south=Min('latitude'), west=Min('longitude'), north=Max('latitude'), east=Max('longitude'),
+                first=Min('id'),
+            ).order_by()
+            .values_list('grid_row', 'col', 'count', 'lat_sum', 'lng_sum', 'south', 'west', 'north', 'east', 'first')
+        )
+    return rows
+
+
+def clusters(kind, cells, zoom):
+    """
+    Points of the grid cells, merged per cell: {'clusters': [{lat, lng,
+    count, bounds}], 'markers': [(id, lat, lng)]}. A cluster sits at the
+    mean of its points and `bounds` (south, west, north, east) is what to
+    zoom to; a cell with a single point is a marker.
+    """
+    _, first_row, _, last_row = cells
+    west, east = _column_range(cells, zoom)
+    bands = [(row, *_row_band(row, zoom)) for row in range(first_row, last_row + 1)]
+    result = {'clusters': [], 'markers': []}
+    for _, _, count, lat_sum, lng_sum, s, w, n, e, pk in sorted(
+        _aggregate(kind, bands, west, east, zoom), key=lambda cell: (cell[0], cell[1]),
+    ):
+        if count == 1:
+            result['markers'].append((pk, lat_sum, lng_sum))
+        else:
+            result['clusters'].append({
+                'lat': lat_sum / count,
+                'lng': lng_sum / count,
+                'count': count,
+                'bounds': [s, w, n, e],
+            })
+    return result
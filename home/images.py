@@ -0,0 +1,143 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import CarTransfer, HotelImage, Location, RoomImage, TourImage, UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Largest width of each derivative; heights keep the aspect ratio
+VARIANTS = (
+    ('thumb', 160),
+    ('card', 640),
+    ('hero', 1600),
+)
+
+FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+
+QUALITY = 80
+
+IMAGE_FIELDS = {
+    Location: 'image',
+    HotelImage: 'image',
+    RoomImage: 'image',
+    TourImage: 'image',
+    CarTransfer: 'image',
+    UserProfile: 'profile_picture',
+}
+
+WORKERS = 2
+
+_lock = threading.Lock()
+_executor = None
+
+
+def variants_field(model):
+    return f'{IMAGE_FIELDS[model]}_variants'
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=QUALITY, optimize=image_format == 'JPEG')
+    return ContentFile(buffer.getvalue())
+
+
+def build(source, storage=default_storage):
+    with storage.open(source, 'rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+    original = original.convert('RGB')
+    width, height = original.size
+
+    variants = []
+    for name, max_width in VARIANTS:
+        # Never upscale; a small upload only gets the variants it can fill
+        target_width = min(max_width, width)
+        if variants and variants[-1]['width'] >= target_width:
+            continue
+        target_height = max(1, round(height * target_width / width))
+        resized = original.resize((target_width, target_height), Image.LANCZOS)
+        variant = {'name': name, 'width': target_width, 'height': target_height}
+        for extension, image_format in FORMATS:
+            # The storage names the file after its content; only the extension of the hint is kept.
+            # Rows keep the returned name, which is all later lookups and cleanup go by.
+            variant[extension] = storage.save(f'derivatives/{name}.{extension}', _encode(resized, image_format))
+        variants.append(variant)
+    return {'source': source, 'width': width, 'height': height, 'variants': variants}
+
+
+def needs_build(model, instance):
+    source = getattr(instance, IMAGE_FIELDS[model]).name
+    return (getattr(instance, variants_field(model)) or {}).get('source') != (source or None)
+
+
+def stored_paths(data):
+    return {variant[extension] for variant in (data or {}).get('variants', []) for extension, _ in FORMATS}
+
+
+def generate(model, pk, storage=default_storage):
+    field = IMAGE_FIELDS[model]
+    row = model.objects.filter(pk=pk).values_list(field, variants_field(model)).first()
+    if row is None:
+        return None
+    source, previous = row
+    data = build(source, storage) if source else {}
+    # Guarded on the source so a newer upload is never overwritten with stale variants
+    current = Q(**{field: source}) if source else Q(**{field: ''}) | Q(**{f'{field}__isnull': True})
+    if model.objects.filter(current, pk=pk).update(**{variants_field(model): data}):
+        # Derivatives no longer referenced by this row; hashed files are left to collect_media
+        for path in stored_paths(previous) - stored_paths(data):
+            storage.delete(path)
+    return data
+
+
+def delete_derivatives(data, storage=default_storage):
+    for path in stored_paths(data):
+        storage.delete(path)
+
+
+def _run(model, pk):
+    close_old_connections()
+    try:
+        generate(model, pk)
+    except Exception:
+        logger.exception('Could not build image derivatives for %s %s', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image-derivatives')
+        return _executor
+
+
+def schedule(model, pk):
+    # After commit, so the worker's own connection can see the new upload
+    transaction.on_commit(lambda: executor().submit(_run, model, pk))
+
+
+def pick(variants, width):
+    # Smallest derivative at least `width` pixels wide, else the largest one
+    candidates = (variants or {}).get('variants') or []
+    for variant in candidates:
+        if variant['width'] >= width:
+            return variant
+    return candidates[-1] if candidates else None
+
+
+def url(image, variants, width):
+    variant = pick(variants, width)
+    return default_storage.url(variant['jpeg']) if variant else image.url
@@ -0,0 +1,235 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import catalog_cache, geo, price_stats, search_index
+from .models import CarTransfer, FlightTicket, Hotel, ImportCheckpoint, Location, Room, Tour
+
+IMPORT_MODELS = {
+    'location': Location,
+    'hotel': Hotel,
+    'room': Room,
+    'flight': FlightTicket,
+    'tour': Tour,
+    'car': CarTransfer,
+}
+
+NATURAL_KEY = 'external_id'
+
+BATCH_SIZE = 5000
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+
+
+class FeedError(Exception):
+    pass
+
+
+class RowError(Exception):
+    pass
+
+
+def fingerprint(path):
+    st = os.stat(path)
+    return f'{st.st_size}-{st.st_mtime_ns}'
+
+
+def read_rows(path, file_format=None):
+    # Streams dicts one at a time; nothing but the current batch is held in memory
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    # A broken line is still a row, so row counts and checkpoints stay in step
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield RowError(f'invalid JSON at line {number}, column {e.colno}: {e.msg}')
+
+
+def natural_key_map(model):
+    return dict(model.objects.exclude(**{f'{NATURAL_KEY}__isnull': True}).values_list(NATURAL_KEY, 'pk'))
+
+
+class FeedImporter:
+    """
+    Upserts one feed into one model. Foreign keys are given as the
+    external_id of the target row (or as <field>_id) and resolved through
+    maps loaded once per feed, so no row costs a lookup query. Values are
+    checked against their field's choices and validators (max_length,
+    max_digits, ...), so a bad row is rejected instead of failing its batch.
+    """
+    def __init__(self, model, columns):
+        self.model = model
+        self.fields = {}
+        self.choices = {}
+        self.foreign_keys = {}
+        self.target_ids = {}
+        for field in model._meta.concrete_fields:
+            if field.primary_key or not field.editable:
+                continue
+            if field.is_relation:
+                if field.name in columns or field.attname in columns:
+                    self.foreign_keys[field] = natural_key_map(field.related_model)
+                if field.attname in columns:
+                    self.target_ids[field] = set(field.related_model.objects.values_list('pk', flat=True))
+            elif field.name in columns:
+                self.fields[field] = self._converter(field)
+                if field.choices:
+                    self.choices[field] = {value for value, _ in field.flatchoices}
+        if NATURAL_KEY not in columns:
+            raise FeedError(f'The feed needs an {NATURAL_KEY} column.')
+
+    def _converter(self, field):
+        if isinstance(field, models.BooleanField):
+            return lambda value: value if isinstance(value, bool) else str(value).strip().lower() in TRUE_VALUES
+        if isinstance(field, models.DateTimeField):
+            # Resolved once per feed; make_aware looks the zone up on every call
+            tz = timezone.get_default_timezone()
+
+            def to_datetime(value):
+                value = field.to_python(value)
+                if value is not None and value.tzinfo is None:
+                    value = value.replace(tzinfo=tz)
+                return value
+            return to_datetime
+        return field.to_python
+
+    @property
+    def update_fields(self):
+        names = [field.name for field in self.fields if field.name != NATURAL_KEY]
+        return names + [field.attname for field in self.foreign_keys]
+
+    def build(self, row):
+        values = {}
+        for field, convert in self.fields.items():
+            value = row.get(field.name)
+            if value == '' and (field.null or not isinstance(field, (models.CharField, models.TextField))):
+                value = None
+            if value is None:
+                if not field.null and not field.has_default():
+                    raise RowError(f'{field.name}: required')
+                values[field.attname] = None if field.null else field.get_default()
+                continue
+            try:
+                value = convert(value)
+                if field in self.choices and value not in self.choices[field]:
+                    raise RowError(f'{field.name}: {value!r} is not a valid choice')
+                field.run_validators(value)
+            except ValidationError as e:
+                raise RowError(f'{field.name}: {"; ".join(e.messages)}')
+            values[field.attname] = value
+        for field, keys in self.foreign_keys.items():
+            if row.get(field.attname) not in (None, ''):
+                # Checked here, or the missing row only shows as an IntegrityError that aborts the import
+                values[field.attname] = int(row[field.attname])
+                if values[field.attname] not in self.target_ids[field]:
+                    target = field.related_model._meta.model_name
+                    raise RowError(f'{field.attname}: no {target} {values[field.attname]}')
+            elif row.get(field.name) in keys:
+                values[field.attname] = keys[row[field.name]]
+            elif field.null and row.get(field.name) in (None, ''):
+                values[field.attname] = None
+            else:
+                raise RowError(f'{field.name}: unknown {NATURAL_KEY} {row.get(field.name)!r}')
+        if not values.get(NATURAL_KEY):
+            raise RowError(f'missing {NATURAL_KEY}')
+        return self.model(**values)
+
+    def save(self, objs):
+        # SQLite and PostgreSQL both turn this into INSERT ... ON CONFLICT DO UPDATE
+        self.model.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=[NATURAL_KEY],
+            update_fields=self.update_fields,
+        )
+
+
+def import_feed(item_type, path, file_format=None, batch_size=BATCH_SIZE, restart=False,
+                on_progress=None, on_error=None):
+    model = IMPORT_MODELS[item_type]
+    path = os.path.abspath(path)
+    checkpoint, _ = ImportCheckpoint.objects.get_or_create(
+        feed=path, defaults={'model': item_type, 'fingerprint': fingerprint(path)},
+    )
+    if restart or checkpoint.fingerprint != fingerprint(path) or checkpoint.model != item_type:
+        checkpoint.model = item_type
+        checkpoint.fingerprint = fingerprint(path)
+        checkpoint.rows_done = 0
+        checkpoint.completed = False
+        checkpoint.save()
+    if checkpoint.completed:
+        return {'skipped': True, 'rows': checkpoint.rows_done, 'imported': 0, 'errors': 0}
+
+    rows = read_rows(path, file_format)
+    # The columns come from the first row that could be read
+    leading = []
+    for row in rows:
+        leading.append(row)
+        if not isinstance(row, RowError):
+            break
+    stats = {'skipped': False, 'rows': checkpoint.rows_done, 'imported': 0, 'errors': 0,
+             'resumed_at': checkpoint.rows_done}
+    if not leading:
+        ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(completed=True)
+        return stats
+    importer = None if isinstance(leading[-1], RowError) else FeedImporter(model, set(leading[-1]))
+
+    def save_batch(batch, done):
+        # The batch and the checkpoint commit together, so a crash resumes at a batch boundary
+        with transaction.atomic():
+            if batch:
+                importer.save(batch)
+            ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(rows_done=done)
+
+    started = time.monotonic()
+    # Keyed by external_id, so a key repeated within one batch is written once, last row wins
+    batch = {}
+    line = 0
+    for line, row in enumerate(itertools.chain(leading, rows), start=1):
+        if line <= checkpoint.rows_done:
+            continue
+        try:
+            if isinstance(row, RowError):
+                raise row
+            obj = importer.build(row)
+            batch[obj.external_id] = obj
+        except (RowError, ValueError, TypeError) as e:
+            stats['errors'] += 1
+            if on_error:
+                on_error(line, e)
+        if len(batch) >= batch_size:
+            save_batch(list(batch.values()), line)
+            stats['imported'] += len(batch)
+            stats['rows'] = line
+            batch = {}
+            if on_progress:
+                on_progress(stats, time.monotonic() - started)
+    save_batch(list(batch.values()), line)
+    stats['imported'] += len(batch)
+    stats['rows'] = max(line, checkpoint.rows_done)
+    ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(completed=True)
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def refresh_derived(item_types):
+    # bulk_create sends no signals, so the derived data is rebuilt once per import
+    catalog_cache.bump(*IMPORT_MODELS.values())
+    for item_type in item_types:
+        if item_type in price_stats.CATEGORY_MODELS:
+            price_stats.refresh(item_type)
+    if search_index.is_enabled():
+        search_index.rebuild()
+    if geo.is_enabled():
+        geo.rebuild()
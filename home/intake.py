@@ -0,0 +1,110 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from . import order_summaries, pricing
+from .inventory import InventoryError
+from .models import Booking, BookingRequest
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+FAILED_MESSAGE = 'Không thể xử lý yêu cầu đặt chỗ, vui lòng thử lại.'
+
+
+def is_queued():
+    # 'sync' books inside the request; 'queued' hands the booking to process_booking_queue
+    return getattr(settings, 'BOOKING_INTAKE', 'sync') == 'queued'
+
+
+def enqueue(user, line):
+    # One small INSERT instead of the reservation, booking and summary writes
+    return BookingRequest.objects.create(user=user, payload=line.to_dict())
+
+
+def status(booking_request):
+    data = {
+        'reference': str(booking_request.reference),
+        'status': booking_request.status,
+        'booking_id': booking_request.booking_id,
+        'error': booking_request.error or None,
+    }
+    if booking_request.status == 'queued':
+        # Counted on the partial queue index
+        data['queued_ahead'] = BookingRequest.objects.filter(
+            status='queued', id__lt=booking_request.id,
+        ).count()
+    if booking_request.booking_id:
+        data['payment_url'] = reverse('home:payment', args=[booking_request.booking_id])
+    return data
+
+
+def _book(booking_request, line):
+    # Returns the unsaved booking, or marks the request failed
+    if line.error:
+        booking_request.status = 'failed'
+        booking_request.error = line.error
+        return None
+    try:
+        # A savepoint per request, so a sold-out line leaves the rest of the batch alone
+        with transaction.atomic():
+            pricing.reserve(line)
+    except (pricing.PricingError, InventoryError) as e:
+        booking_request.status = 'failed'
+        booking_request.error = str(e)
+        return None
+    except Exception:
+        logger.exception('Booking request %s could not be reserved', booking_request.reference)
+        booking_request.status = 'failed'
+        booking_request.error = FAILED_MESSAGE
+        return None
+    return line.booking(booking_request.user)
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """
+    Books up to batch_size queued requests in one transaction and returns how
+    many were handled. The claiming UPDATE is the first statement, so on SQLite
+    the transaction holds the write lock from the start and concurrent workers
+    take turns; a worker that dies mid-batch rolls its claim back with the rest.
+    """
+    with transaction.atomic():
+        waiting = BookingRequest.objects.filter(status='queued').order_by('id').values('id')[:batch_size]
+        claimed = BookingRequest.objects.filter(status='queued', id__in=Subquery(waiting)).update(status='processing')
+        if not claimed:
+            return 0
+        # Rows are only 'processing' inside the transaction that claimed them
+        requests = list(BookingRequest.objects.filter(status='processing').select_related('user').order_by('id'))
+
+        lines = {}
+        for booking_request in requests:
+            try:
+                lines[booking_request.pk] = pricing.Quote.from_dict(booking_request.payload)
+            except pricing.PricingError as e:
+                booking_request.status = 'failed'
+                booking_request.error = str(e)
+        # Prices and promotions are resolved again: the worker's price is the one charged
+        pricing.quote(list(lines.values()), max_items=None)
+
+        booked = []
+        for booking_request in requests:
+            line = lines.get(booking_request.pk)
+            booking = _book(booking_request, line) if line else None
+            if booking:
+                booked.append((booking_request, booking))
+
+        bookings = Booking.objects.bulk_create([booking for _, booking in booked])
+        order_summaries.refresh([booking.pk for booking in bookings])
+        processed_at = timezone.now()
+        for booking_request, booking in booked:
+            booking_request.booking = booking
+            booking_request.status = 'done'
+        for booking_request in requests:
+            booking_request.processed_at = processed_at
+        BookingRequest.objects.bulk_update(requests, ['status', 'booking', 'error', 'processed_at'])
+    return len(requests)
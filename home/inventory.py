@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from . import catalog_cache, fare_calendar, order_summaries
+from .models import Booking, FlightTicket, Hotel, Room, RoomNight
+
+
+class InventoryError(Exception):
+    pass
+
+
+class RoomUnavailable(InventoryError):
+    pass
+
+
+class SeatsUnavailable(InventoryError):
+    pass
+
+
+def stay_nights(check_in, check_out):
+    # Nights of a stay are the half-open range [check_in, check_out)
+    return [check_in + timedelta(days=i) for i in range((check_out - check_in).days)]
+
+
+def allocate_room(room, check_in, check_out, quantity=1):
+    nights = stay_nights(check_in, check_out)
+    if not nights:
+        raise RoomUnavailable('Ngày trả phòng phải sau ngày nhận phòng.')
+
+    with transaction.atomic():
+        # Rows are created lazily with the room's current allotment
+        RoomNight.objects.bulk_create(
+            [RoomNight(room=room, date=night, allotment=room.units) for night in nights],
+            ignore_conflicts=True,
+        )
+        # Conditional increment: only nights with enough free units are touched,
+        # so a short count means at least one night is sold out.
+        updated = RoomNight.objects.filter(
+            room=room,
+            date__in=nights,
+            booked__lte=F('allotment') - quantity,
+        ).update(booked=F('booked') + quantity)
+        if updated != len(nights):
+            raise RoomUnavailable('Phòng đã hết trong khoảng thời gian đã chọn.')
+
+
+def release_room(room, check_in, check_out, quantity=1):
+    nights = stay_nights(check_in, check_out)
+    with transaction.atomic():
+        RoomNight.objects.filter(
+            room=room,
+            date__in=nights,
+            booked__gte=quantity,
+        ).update(booked=F('booked') - quantity)
+
+
+def available_rooms(check_in, check_out, guests=1, quantity=1):
+    sold_out_nights = RoomNight.objects.filter(
+        room=OuterRef('pk'),
+        date__gte=check_in,
+        date__lt=check_out,
+        booked__gt=F('allotment') - quantity,
+    )
+    return Room.objects.filter(
+        is_available=True,
+        capacity__gte=guests,
+        units__gte=quantity,
+    ).filter(~Exists(sold_out_nights))
+
+
+def available_hotels(check_in, check_out, guests=1, hotels=None):
+    rooms = available_rooms(check_in, check_out, guests).filter(hotel=OuterRef('pk'))
+    if hotels is None:
+        hotels = Hotel.objects.all()
+    return hotels.filter(Exists(rooms))
+
+
+def allocate_seats(flight, quantity=1):
+    if quantity < 1:
+        raise SeatsUnavailable('Số hành khách không hợp lệ.')
+    # Single-row conditional decrement; concurrent writers only contend on this flight
+    updated = FlightTicket.objects.filter(
+        pk=flight.pk,
+        available_seats__gte=quantity,
+    ).update(available_seats=F('available_seats') - quantity)
+    if not updated:
+        raise SeatsUnavailable('Chuyến bay không còn đủ chỗ trống.')
+    _retire_route(flight)
+
+
+def release_seats(flight, quantity=1):
+    FlightTicket.objects.filter(pk=flight.pk).update(available_seats=F('available_seats') + quantity)
+    _retire_route(flight)
+
+
+def _retire_route(flight):
+    # update() sends no post_save. Only the fare calendars of this route are retired, as a
+    # sold-out flight changes their cheapest fare; seat counts in cached flight lists expire
+    # with their timeout, so a busy sale does not empty the cache of every other route.
+    catalog_cache.bump_scope(fare_calendar.route_scope(flight.origin_id, flight.destination_id))
+
+
+def cancel_booking(booking):
+    with transaction.atomic():
+        # Flip the status first so a booking is only ever released once. Completed bookings and
+        # stays that have ended are left alone: their nights are past and their history stays.
+        cancellable = Booking.objects.filter(pk=booking.pk, status__in=Booking.CANCELLABLE_STATUSES).exclude(
+            check_out_date__lt=timezone.localdate(),
+        )
+        if not cancellable.update(status='cancelled'):
+            return False
+        booking.status = 'cancelled'
+        order_summaries.refresh([booking.pk])
+        if booking.room_id and booking.check_in_date and booking.check_out_date:
+            release_room(booking.room, booking.check_in_date, booking.check_out_date)
+        if booking.flight_id:
+            release_seats(booking.flight, booking.number_of_guests)
+    return True
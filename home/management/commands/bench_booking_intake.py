@@ -0,0 +1,130 @@
+import logging
+import multiprocessing
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from home import intake
+from home.models import BookingRequest, FlightTicket, Location
+
+USER_PREFIX = 'bench-intake-'
+
+
+def _client(url, session_key, requests):
+    # Runs in a forked process, like one web worker serving one visitor
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+    timings = []
+    failed = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        try:
+            response = client.post(url, {'number_of_guests': 1})
+            if response.status_code != 302:
+                failed += 1
+        except Exception:
+            failed += 1
+        timings.append(time.perf_counter() - started)
+    connection.close()
+    return timings, failed
+
+
+def _drain(stop, batch_size):
+    # Runs in its own process, like process_booking_queue
+    while True:
+        if not intake.process_batch(batch_size):
+            if stop.is_set():
+                break
+            time.sleep(0.05)
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Post flight bookings from concurrent clients in sync and in queued intake mode. '
+        'Creates its own users, locations and flight and deletes them (and their bookings) afterwards; '
+        'run it against a copy of the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=50, help='Bookings posted by each client')
+        parser.add_argument('--batch-size', type=int, default=intake.BATCH_SIZE)
+
+    def _post_all(self, url, sessions):
+        # Forked children must not share the parent's SQLite connection
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(len(sessions)) as pool:
+            started = time.perf_counter()
+            results = pool.starmap(_client, [(url, session_key, self.requests) for session_key in sessions])
+            elapsed = time.perf_counter() - started
+        latencies = [timing for timings, _ in results for timing in timings]
+        return elapsed, latencies, sum(failed for _, failed in results)
+
+    def _report(self, label, elapsed, latencies, errors):
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f"{label:<18} {len(latencies) / elapsed:>8.0f} req/s  "
+            f"p50 {statistics.median(latencies) * 1000:>7.1f} ms  p95 {p95 * 1000:>7.1f} ms  {errors} errors"
+        )
+
+    def handle(self, *args, **options):
+        self.requests = options['requests']
+        self.batch_size = options['batch_size']
+        total = options['clients'] * self.requests
+
+        origin = Location.objects.create(name='Bench origin')
+        destination = Location.objects.create(name='Bench destination')
+        departure = timezone.now() + timedelta(days=30)
+        flight = FlightTicket.objects.create(
+            flight_number='BENCH', origin=origin, destination=destination,
+            departure_time=departure, arrival_time=departure + timedelta(hours=1),
+            price=100, available_seats=total * 2,
+        )
+        users = [User.objects.create(username=f'{USER_PREFIX}{i}') for i in range(options['clients'])]
+        # Logged in up front, so session writes do not compete with the measured bookings
+        sessions = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+        url = reverse('home:booking', args=['flight', flight.id])
+        self.stdout.write(f"{options['clients']} clients x {self.requests} bookings per mode")
+        # Locked-database 500s are counted as errors rather than logged one by one
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], BOOKING_INTAKE='sync'):
+                self._report('sync', *self._post_all(url, sessions))
+
+            with override_settings(ALLOWED_HOSTS=['testserver'], BOOKING_INTAKE='queued'):
+                connections.close_all()
+                context = multiprocessing.get_context('fork')
+                stop = context.Event()
+                worker = context.Process(target=_drain, args=(stop, self.batch_size))
+                worker.start()
+                elapsed, latencies, errors = self._post_all(url, sessions)
+                self._report('queued (intake)', elapsed, latencies, errors)
+                started = time.perf_counter() - elapsed
+                stop.set()
+                worker.join()
+                drained = time.perf_counter() - started
+                done = BookingRequest.objects.filter(user__in=users, status='done').count()
+                self.stdout.write(
+                    f"{'queued (booked)':<18} {done / drained:>8.0f} bookings/s, queue drained "
+                    f"{drained - elapsed:.1f}s after the last request"
+                )
+        finally:
+            User.objects.filter(username__startswith=USER_PREFIX).delete()
+            flight.delete()
+            origin.delete()
+            destination.delete()
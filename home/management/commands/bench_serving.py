@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.views.static import serve
+
+from home import serving
+
+
+def _drain(response):
+    size = sum(len(chunk) for chunk in response) if response.streaming else len(response.content)
+    response.close()
+    return size
+
+
+class Command(BaseCommand):
+    help = 'Compare the production media view with the DEBUG static view on one file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Path under MEDIA_ROOT; the largest file by default')
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def _largest(self):
+        largest = None
+        for directory, _, filenames in os.walk(settings.MEDIA_ROOT):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if largest is None or os.path.getsize(path) > os.path.getsize(largest):
+                    largest = path
+        if largest is None:
+            raise CommandError('MEDIA_ROOT is empty.')
+        return os.path.relpath(largest, settings.MEDIA_ROOT)
+
+    def _run(self, label, view, headers):
+        factory = RequestFactory()
+        started = time.perf_counter()
+        transferred = 0
+        for _ in range(self.requests):
+            transferred += _drain(view(factory.get('/', headers=headers)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:<28} {self.requests / elapsed:>9.0f} req/s {transferred / elapsed / 1024 / 1024:>9.1f} MB/s"
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or self._largest()
+        self.requests = options['requests']
+        root = settings.MEDIA_ROOT
+        etag = serving.serve_file(RequestFactory().get('/'), root, path)['ETag']
+        self.stdout.write(f"{path} ({os.path.getsize(os.path.join(root, path))} bytes), {self.requests} requests each")
+
+        self._run('django.views.static.serve', lambda r: serve(r, path, document_root=root), {})
+        self._run('serve_file', lambda r: serving.serve_file(r, root, path), {})
+        self._run('serve_file If-None-Match', lambda r: serving.serve_file(r, root, path), {'If-None-Match': etag})
+        self._run('serve_file Range 64 KB', lambda r: serving.serve_file(r, root, path), {'Range': 'bytes=0-65535'})
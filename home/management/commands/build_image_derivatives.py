@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from home import images
+
+
+def _generate(model, pk):
+    close_old_connections()
+    try:
+        return images.generate(model, pk)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Build thumb, card and hero derivatives for uploaded images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that are already up to date')
+
+    def handle(self, *args, **options):
+        pending = []
+        for model, field in images.IMAGE_FIELDS.items():
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            for obj in rows.only('pk', field, images.variants_field(model)).iterator():
+                if options['force'] or images.needs_build(model, obj):
+                    pending.append((model, obj.pk))
+
+        started = time.monotonic()
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(_generate, model, pk): (model, pk) for model, pk in pending}
+            for future in as_completed(futures):
+                model, pk = futures[future]
+                try:
+                    future.result()
+                    built += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{model.__name__} {pk}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built derivatives for {built} images in {time.monotonic() - started:.1f}s ({failed} failed)"
+        ))
@@ -0,0 +1,60 @@
+import time
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from home import images
+from home.models import OrderSummary
+from home.storage import ContentAddressedStorage
+
+
+def referenced_names():
+    # Every name held by a FileField or listed in an image's derivatives
+    names = set()
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField):
+                names.update(model._default_manager.values_list(field.name, flat=True))
+    for model in images.IMAGE_FIELDS:
+        for data in model._default_manager.values_list(images.variants_field(model), flat=True):
+            names.update(images.stored_paths(data))
+    # Order summaries copy an item's image, which the orders page keeps showing after the item changes
+    for thumbnail, data in OrderSummary.objects.values_list('thumbnail', 'thumbnail_variants').iterator():
+        names.add(thumbnail)
+        names.update(images.stored_paths(data))
+    return names
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media files that no row references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Keep files younger than this many seconds; their rows may not be committed yet',
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not content-addressed.')
+        # Listed before reading the references, so a file saved in between is never orphaned
+        cutoff = time.time() - options['min_age']
+        stored = [name for name, modified in default_storage.walk() if modified < cutoff]
+        referenced = referenced_names()
+
+        removed = reclaimed = 0
+        for name in stored:
+            if name in referenced:
+                continue
+            reclaimed += default_storage.size(name)
+            removed += 1
+            if not options['dry_run']:
+                default_storage.purge(name)
+
+        action = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {removed} of {len(stored)} files ({reclaimed / 1024 / 1024:.1f} MB)"
+        ))
@@ -0,0 +1,59 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.map')
+
+# Below this size the encoding headers cost more than they save
+MIN_SIZE = 512
+
+
+class Command(BaseCommand):
+    help = 'Write .gz (and .br when brotli is installed) next to collected CSS/JS so they are served precompressed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', default=None, help='Directory to compress; STATIC_ROOT by default')
+
+    def handle(self, *args, **options):
+        root = options['root'] or settings.STATIC_ROOT
+        encoders = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        else:
+            self.stderr.write('brotli is not installed; writing .gz variants only')
+
+        written = saved = 0
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.endswith(EXTENSIONS):
+                    continue
+                path = os.path.join(directory, filename)
+                source_mtime = os.path.getmtime(path)
+                data = None
+                for suffix, compress in encoders:
+                    target = path + suffix
+                    if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                        continue
+                    if data is None:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    if len(data) < MIN_SIZE:
+                        break
+                    compressed = compress(data)
+                    if len(compressed) >= len(data):
+                        continue
+                    with open(target, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+                    saved += len(data) - len(compressed)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} precompressed files, {saved / 1024:.0f} KB smaller than the originals"
+        ))
@@ -0,0 +1,53 @@
+import sys
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import exports
+from home.models import Booking
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'{value} is not a YYYY-MM-DD date')
+
+
+class Command(BaseCommand):
+    help = (
+        'Write bookings joined with their user, item and promotion as CSV or JSONL. '
+        'Rows are streamed from one query, so memory does not grow with the export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First booking date, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last booking date, YYYY-MM-DD (inclusive)')
+        parser.add_argument('--status', action='append', default=[],
+                            choices=[status for status, _ in Booking.BOOKING_STATUS_CHOICES])
+        parser.add_argument('--type', dest='booking_type', choices=['hotel', 'flight', 'tour', 'car'])
+        parser.add_argument('--format', dest='file_format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write; standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        start = _date(options['start']) if options['start'] else None
+        end = _date(options['end']) if options['end'] else None
+        queryset = exports.bookings(start, end, options['status'], options['booking_type'])
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        rows = counted(exports.rows(queryset, options['chunk_size']))
+        chunks = exports.buffered(exports.lines(rows, options['file_format']))
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
+        self.stderr.write(f'Exported {count} bookings')
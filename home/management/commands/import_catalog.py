@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home import importer
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Upsert a CSV or JSONL supplier feed into the catalog by external_id. '
+        'Foreign keys reference the external_id of the target (location, hotel, origin, destination). '
+        'An interrupted import resumes from its last committed batch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help=', '.join(importer.IMPORT_MODELS))
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', help='csv or jsonl; guessed from the extension')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an earlier run')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Leave price statistics and the search and geo indexes stale, e.g. while importing '
+                                 'several feeds; run refresh_price_stats, rebuild_search_index and '
+                                 'rebuild_geo_index afterwards')
+
+    def handle(self, *args, **options):
+        if options['model'] not in importer.IMPORT_MODELS:
+            raise CommandError(f"Unknown model {options['model']}; use one of {', '.join(importer.IMPORT_MODELS)}")
+        if options['file_format'] not in (None, 'csv', 'jsonl'):
+            raise CommandError('--format must be csv or jsonl')
+
+        def on_progress(stats, elapsed):
+            self.stdout.write(f"{stats['rows']} rows, {stats['imported'] / elapsed:.0f} rows/s")
+
+        reported = []
+
+        def on_error(line, error):
+            if len(reported) < MAX_REPORTED_ERRORS:
+                reported.append(line)
+                self.stderr.write(f"line {line}: {error}")
+
+        try:
+            stats = importer.import_feed(
+                options['model'], options['path'],
+                file_format=options['file_format'],
+                batch_size=options['batch_size'],
+                restart=options['restart'],
+                on_progress=on_progress if options['verbosity'] else None,
+                on_error=on_error,
+            )
+        except (importer.FeedError, OSError) as e:
+            raise CommandError(str(e))
+
+        if stats['skipped']:
+            self.stdout.write(f"{options['path']} was already imported ({stats['rows']} rows); use --restart to run it again")
+            return
+        if stats.get('resumed_at'):
+            self.stdout.write(f"Resumed after row {stats['resumed_at']}")
+        seconds = stats.get('seconds') or 0
+        rate = stats['imported'] / seconds if seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Upserted {stats['imported']} {options['model']} rows in {seconds:.1f}s "
+            f"({rate:.0f} rows/s, {stats['errors']} rejected)"
+        ))
+
+        if not options['skip_derived']:
+            importer.refresh_derived([options['model']])
+            self.stdout.write('Refreshed price statistics and the search index')
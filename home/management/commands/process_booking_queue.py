@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+
+from home import intake
+
+
+class Command(BaseCommand):
+    help = (
+        'Book queued booking requests in batched transactions. '
+        'Run one or more of these next to the web workers when BOOKING_INTAKE is "queued".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=intake.BATCH_SIZE)
+        parser.add_argument('--idle-sleep', type=float, default=0.2,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        processed = 0
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    handled = intake.process_batch(options['batch_size'])
+                except OperationalError as e:
+                    # SQLite's writer lock stayed busy past its timeout; the batch was rolled back
+                    self.stderr.write(f"Batch rolled back: {e}")
+                    close_old_connections()
+                    handled = None
+                if handled:
+                    processed += handled
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"{handled} requests, {processed / (time.monotonic() - started):.0f}/s")
+                    continue
+                if options['once'] and handled == 0:
+                    break
+                time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Processed {processed} booking requests in {time.monotonic() - started:.1f}s")
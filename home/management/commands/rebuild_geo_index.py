@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import geo
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the R*Tree index of hotel and location coordinates behind the nearby and map endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not geo.is_enabled():
+            raise CommandError('The coordinate index requires the SQLite backend; other databases are queried directly.')
+        started = time.monotonic()
+        counts = geo.rebuild(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {sum(counts.values())} rows in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import order_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the order summaries shown on the orders page from the bookings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=order_summaries.REBUILD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = order_summaries.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Summarized {count} bookings in {time.monotonic() - started:.1f}s"
+        ))
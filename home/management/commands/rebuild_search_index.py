@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for hotels, flights, tours, cars and locations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search_index.is_enabled():
+            raise CommandError('The full-text search index requires the SQLite backend.')
+        started = time.monotonic()
+        counts = search_index.rebuild(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {sum(counts.values())} rows in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home import price_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized price statistics used by the search price sliders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('categories', nargs='*', help='hotel, tour and/or car; all by default')
+
+    def handle(self, *args, **options):
+        unknown = set(options['categories']) - set(price_stats.CATEGORY_MODELS)
+        if unknown:
+            raise CommandError(f"Unknown categories: {', '.join(sorted(unknown))}")
+        for category in options['categories'] or price_stats.CATEGORY_MODELS:
+            price_stats.refresh(category)
+            statistic = price_stats.get(category)
+            self.stdout.write(f"{category}: {statistic.count} items, {statistic.min_price} - {statistic.max_price}")
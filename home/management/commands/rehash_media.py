@@ -0,0 +1,54 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from home import images
+from home.storage import ContentAddressedStorage, is_hashed
+
+
+class Command(BaseCommand):
+    help = 'Move files uploaded under their original names into content-addressed storage'
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not content-addressed.')
+
+        renamed = {}
+
+        def rehash(name):
+            if name not in renamed:
+                with default_storage.open(name, 'rb') as f:
+                    renamed[name] = default_storage.save(name, f)
+            return renamed[name]
+
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, models.FileField):
+                    continue
+                names = model._default_manager.exclude(**{field.name: ''}).values_list(field.name, flat=True)
+                for name in set(names) - {None}:
+                    if is_hashed(name):
+                        continue
+                    if not default_storage.exists(name):
+                        self.stderr.write(f"{model.__name__}.{field.name}: missing {name}")
+                        continue
+                    model._default_manager.filter(**{field.name: name}).update(**{field.name: rehash(name)})
+
+        # Derivatives keep pointing at their files; only the recorded source and paths change
+        for model in images.IMAGE_FIELDS:
+            field = images.variants_field(model)
+            with transaction.atomic():
+                for pk, data in model._default_manager.exclude(**{field: {}}).values_list('pk', field):
+                    if not data or is_hashed(data.get('source')):
+                        continue
+                    data['source'] = renamed.get(data['source'], data['source'])
+                    for variant in data['variants']:
+                        for extension, _ in images.FORMATS:
+                            if not is_hashed(variant[extension]) and default_storage.exists(variant[extension]):
+                                variant[extension] = rehash(variant[extension])
+                    model._default_manager.filter(pk=pk).update(**{field: data})
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rehashed {len(renamed)} files into {len(set(renamed.values()))} stored copies"
+        ))
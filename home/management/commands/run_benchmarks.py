@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from home import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the main pages through the test client and report p50/p95 latency and query counts. '
+        'Read-only apart from the benchmark login session; seed the database with seed_scale first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', help=', '.join(benchmarks.ENDPOINTS))
+        parser.add_argument('--requests', type=int, default=benchmarks.REQUESTS, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=benchmarks.WARMUP)
+        parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Send the requests through the ASGI handler; set HP10_ASYNC_VIEWS=1 for the async views')
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help='Milliseconds added to every query, to model a database across the network')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'] or benchmarks.ENDPOINTS
+        unknown = set(endpoints) - set(benchmarks.ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints {', '.join(sorted(unknown))}; use {', '.join(benchmarks.ENDPOINTS)}")
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        def on_result(name, result):
+            self.stdout.write(
+                f"{name:<14} p50 {result['p50_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms  "
+                f"{result['queries']:>3} queries  db p50 {result['db_p50_ms']:>7.1f} ms"
+            )
+
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            try:
+                report = benchmarks.run(
+                    endpoints, options['requests'], options['warmup'],
+                    asgi=options['asgi'], db_latency=options['db_latency'], on_result=on_result,
+                )
+            except benchmarks.BenchmarkError as e:
+                raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline:
+            self.stdout.write(f"\nCompared with {options['compare']} ({baseline['meta']['created']}):")
+            for name, p50, p95, queries, verdict in benchmarks.compare(baseline, report):
+                line = f"{name:<14} p50 {p50:>+7.1%}  p95 {p95:>+7.1%}  queries {queries:>+3}  {verdict}"
+                if verdict == 'slower':
+                    line = self.style.ERROR(line)
+                elif verdict == 'faster':
+                    line = self.style.SUCCESS(line)
+                self.stdout.write(line)
@@ -0,0 +1,60 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import scale_data
+
+# Seconds between progress lines of one table
+PROGRESS_EVERY = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Add a deterministic synthetic catalog for benchmarks: by default 500 locations, 100k users, '
+        '20k hotels, 200k rooms, 2M flights, 20k tours, 10k cars and 5M bookings with their order summaries. '
+        'The same --seed and --today give the same rows. Existing rows are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies every default count, e.g. 0.01')
+        for name, count in scale_data.DEFAULT_COUNTS.items():
+            parser.add_argument(f'--{name}', type=int, help=f'Default {count} times --scale')
+        parser.add_argument('--today', help='YYYY-MM-DD the dates are generated around; defaults to today')
+        parser.add_argument('--batch-size', type=int, default=scale_data.BATCH_SIZE)
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Leave price statistics and the search index for a later rebuild')
+
+    def handle(self, *args, **options):
+        counts = scale_data.scaled_counts(
+            options['scale'], **{name: options[name] for name in scale_data.DEFAULT_COUNTS},
+        )
+        if min(counts.values()) < 1:
+            raise CommandError('Every count must be at least 1.')
+        today = None
+        if options['today']:
+            try:
+                today = datetime.strptime(options['today'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--today must be YYYY-MM-DD')
+
+        last_line = {}
+
+        def on_progress(name, done, total, elapsed):
+            if done == total or time.monotonic() - last_line.get(name, 0) >= PROGRESS_EVERY:
+                last_line[name] = time.monotonic()
+                self.stdout.write(f"{name}: {done}/{total}, {done / elapsed:.0f} rows/s")
+
+        seeder = scale_data.ScaleSeeder(
+            seed=options['seed'],
+            counts=counts,
+            batch_size=options['batch_size'],
+            today=today,
+            on_progress=on_progress if options['verbosity'] else None,
+        )
+        started = time.monotonic()
+        seeder.run(derived=not options['skip_derived'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {sum(counts.values())} rows with seed {options['seed']} in {time.monotonic() - started:.0f}s"
+        ))
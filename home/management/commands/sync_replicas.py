@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.routers import replicas
+
+
+class Command(BaseCommand):
+    help = 'Refresh the file-copy SQLite read replicas from the primary database'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('File-copy replicas need the SQLite backend.')
+        if not replicas():
+            raise CommandError('No replicas configured; set HP10_SQLITE_REPLICAS.')
+
+        for alias in replicas():
+            target = str(settings.DATABASES[alias]['NAME'])
+            temporary = f'{target}.tmp'
+            started = time.time()
+            # The backup API copies a consistent snapshot while the primary keeps taking writes
+            source = sqlite3.connect(str(primary['NAME']))
+            destination = sqlite3.connect(temporary)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+                source.close()
+            os.replace(temporary, target)
+            # The router compares this with the visitor's last write, so it must not be later than the snapshot
+            os.utime(target, (started, started))
+            self.stdout.write(f"{alias}: {os.path.getsize(target) / 1024:.0f} KB in {time.time() - started:.2f}s")
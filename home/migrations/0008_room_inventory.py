@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_room_alter_booking_booking_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='room',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='home.room'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='units',
+            field=models.PositiveIntegerField(default=1, help_text='Number of rooms of this type sold per night'),
+        ),
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('allotment', models.PositiveIntegerField(default=1)),
+                ('booked', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='home.room')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='roomnight',
+            constraint=models.UniqueConstraint(fields=('room', 'date'), name='unique_room_night'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0009_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-booking_date', '-id'], name='booking_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartransfer',
+            index=models.Index(fields=['price', 'id'], name='car_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flightticket',
+            index=models.Index(fields=['departure_time', 'id'], name='flight_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['price', 'id'], name='hotel_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['price', 'id'], name='tour_price_idx'),
+        ),
+    ]
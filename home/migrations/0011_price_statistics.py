@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('hotel', 'Hotel'), ('tour', 'Tour'), ('car', 'Car Transfer')], max_length=20)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('histogram', models.JSONField(default=list, help_text='Item count per price bucket')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('location', models.ForeignKey(blank=True, help_text='Empty for the statistics of the whole category', null=True, on_delete=django.db.models.deletion.CASCADE, to='home.location')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pricestatistic',
+            constraint=models.UniqueConstraint(fields=('category', 'location'), name='unique_price_statistic'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_price_statistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flightticket',
+            index=models.Index(fields=['origin', 'destination', 'departure_time'], name='flight_route_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(help_text='Absolute path of the feed file', max_length=500, unique=True)),
+                ('model', models.CharField(max_length=20)),
+                ('fingerprint', models.CharField(help_text='Size and mtime; a changed file starts over', max_length=100)),
+                ('rows_done', models.PositiveBigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cartransfer',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='flightticket',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Supplier key used by import_catalog', max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_catalog_import'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['booking_date'], name='booking_date_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('home', '0015_booking_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='home.booking')),
+                ('booking_type', models.CharField(max_length=20)),
+                ('item_id', models.IntegerField(blank=True, null=True)),
+                ('title', models.CharField(max_length=255)),
+                ('thumbnail', models.CharField(blank=True, max_length=255)),
+                ('thumbnail_variants', models.JSONField(blank=True, default=dict)),
+                ('booking_date', models.DateTimeField()),
+                ('check_in_date', models.DateField(blank=True, null=True)),
+                ('check_out_date', models.DateField(blank=True, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('cancelled', 'Cancelled'), ('completed', 'Completed')], max_length=20)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='order_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-booking_date', '-booking'], name='order_user_date_idx'), models.Index(fields=['user', 'status', '-booking_date', '-booking'], name='order_user_status_idx')],
+            },
+        ),
+    ]
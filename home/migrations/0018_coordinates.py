@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def create_geo_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # One R*Tree per kind; points are stored as boxes of zero size
+    for table in ('home_geo_hotel', 'home_geo_location'):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+        )
+
+
+def drop_geo_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in ('home_geo_hotel', 'home_geo_location'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_booking_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['latitude', 'longitude'], name='hotel_coordinates_idx'),
+        ),
+        migrations.RunPython(create_geo_index, drop_geo_index),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# home.search_index.ROWID_TYPES and ROWID_STRIDE at the time of this migration
+ROWID_SQL = (
+    "item_id * 8 + CASE item_type WHEN 'hotel' THEN 1 WHEN 'flight' THEN 2 WHEN 'tour' THEN 3 "
+    "WHEN 'car' THEN 4 ELSE 5 END"
+)
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE {table} USING fts5("
+    "item_type UNINDEXED, item_id UNINDEXED, title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+
+def copy_rows(schema_editor, rowid):
+    # FTS5 cannot change a rowid in place, so the rows move to a new table
+    schema_editor.execute(CREATE_SQL.format(table='home_search_index_new'))
+    schema_editor.execute(
+        f"INSERT INTO home_search_index_new (rowid, item_type, item_id, title, body) "
+        f"SELECT {rowid}, item_type, item_id, title, body FROM home_search_index "
+        f"WHERE rowid IN (SELECT MAX(rowid) FROM home_search_index GROUP BY item_type, item_id)"
+    )
+    schema_editor.execute("DROP TABLE home_search_index")
+    schema_editor.execute("ALTER TABLE home_search_index_new RENAME TO home_search_index")
+
+
+def key_rows_by_item(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    copy_rows(schema_editor, ROWID_SQL)
+
+
+def unkey_rows(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    copy_rows(schema_editor, 'NULL')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_rows_by_item, unkey_rows),
+    ]
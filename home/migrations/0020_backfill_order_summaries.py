@@ -0,0 +1,86 @@
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+
+def _first_images(model, fk_name, ids):
+    # fk id -> (image, image_variants) of its first image, one query per batch
+    first = {}
+    rows = model.objects.filter(**{f'{fk_name}__in': ids}).order_by('id').values_list(
+        fk_name, 'image', 'image_variants',
+    )
+    for fk_id, image, variants in rows:
+        first.setdefault(fk_id, (image, variants))
+    return first
+
+
+def summarize_bookings(apps, schema_editor):
+    # The orders page reads only OrderSummary, so bookings made before 0016 need a row each.
+    # Historical models only: home.order_summaries follows the current ones, which later
+    # migrations may change. `manage.py rebuild_order_summaries` does the same at any time.
+    Booking = apps.get_model('home', 'Booking')
+    OrderSummary = apps.get_model('home', 'OrderSummary')
+    HotelImage = apps.get_model('home', 'HotelImage')
+    RoomImage = apps.get_model('home', 'RoomImage')
+    TourImage = apps.get_model('home', 'TourImage')
+
+    last_id = 0
+    while True:
+        bookings = list(
+            Booking.objects.filter(pk__gt=last_id).select_related(
+                'hotel', 'room', 'flight__origin', 'flight__destination', 'tour', 'car',
+            ).order_by('pk')[:BATCH_SIZE]
+        )
+        if not bookings:
+            return
+        last_id = bookings[-1].pk
+        room_images = _first_images(RoomImage, 'room', {b.room_id for b in bookings if b.room_id})
+        hotel_images = _first_images(HotelImage, 'hotel', {b.hotel_id for b in bookings if b.hotel_id})
+        tour_images = _first_images(TourImage, 'tour', {b.tour_id for b in bookings if b.tour_id})
+
+        summaries = []
+        for booking in bookings:
+            item_id, title, thumbnail = None, 'N/A', ('', {})
+            if booking.booking_type == 'hotel' and booking.hotel:
+                item_id = booking.hotel_id
+                title = f"{booking.hotel.name} - {booking.room.name}" if booking.room else booking.hotel.name
+                thumbnail = room_images.get(booking.room_id) or hotel_images.get(booking.hotel_id) or thumbnail
+            elif booking.booking_type == 'flight' and booking.flight:
+                flight = booking.flight
+                item_id = flight.pk
+                title = f"{flight.flight_number} ({flight.origin.name} - {flight.destination.name})"
+                thumbnail = (flight.airline_logo.name, {})
+            elif booking.booking_type == 'tour' and booking.tour:
+                item_id = booking.tour_id
+                title = booking.tour.name
+                thumbnail = tour_images.get(booking.tour_id) or thumbnail
+            elif booking.booking_type == 'car' and booking.car:
+                item_id = booking.car_id
+                title = booking.car.name
+                thumbnail = (booking.car.image.name, booking.car.image_variants)
+            summaries.append(OrderSummary(
+                booking_id=booking.pk,
+                user_id=booking.user_id,
+                booking_type=booking.booking_type,
+                item_id=item_id,
+                title=title,
+                thumbnail=thumbnail[0] or '',
+                thumbnail_variants=thumbnail[1] or {},
+                booking_date=booking.booking_date,
+                check_in_date=booking.check_in_date,
+                check_out_date=booking.check_out_date,
+                total_price=booking.total_price,
+                status=booking.status,
+            ))
+        OrderSummary.objects.bulk_create(summaries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0019_search_index_rowid'),
+    ]
+
+    operations = [
+        migrations.RunPython(summarize_bookings, migrations.RunPython.noop),
+    ]
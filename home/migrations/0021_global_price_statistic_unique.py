@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def drop_duplicate_global_rows(apps, schema_editor):
+    # Concurrent refreshes could insert a second category-wide row; keep the newest
+    PriceStatistic = apps.get_model('home', 'PriceStatistic')
+    seen = set()
+    for pk, category in PriceStatistic.objects.filter(location__isnull=True).order_by(
+        '-updated_at', '-pk',
+    ).values_list('pk', 'category'):
+        if category in seen:
+            PriceStatistic.objects.filter(pk=pk).delete()
+        seen.add(category)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_backfill_order_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_global_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pricestatistic',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('location__isnull', True)), fields=('category',),
+                name='unique_global_price_statistic',
+            ),
+        ),
+    ]
@@ -1,13 +1,74 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 import datetime
+import uuid
+
+def first_image_subquery(model, fk_name, field='image', output_field=None):
+    return models.Subquery(
+        model.objects.filter(**{fk_name: models.OuterRef('pk')}).order_by('id').values(field)[:1],
+        output_field=output_field,
+    )
+
+def first_image_variants_subquery(model, fk_name):
+    return first_image_subquery(model, fk_name, 'image_variants', models.JSONField())
+
+class HotelQuerySet(models.QuerySet):
+    def for_listing(self):
+        # One query for the cards plus one for all of their images
+        return self.select_related('location').prefetch_related(
+            models.Prefetch('images', queryset=HotelImage.objects.order_by('id')),
+        ).annotate(
+            first_image=first_image_subquery(HotelImage, 'hotel'),
+            first_image_variants=first_image_variants_subquery(HotelImage, 'hotel'),
+        )
+
+class RoomQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related('hotel__location').prefetch_related(
+            models.Prefetch('images', queryset=RoomImage.objects.order_by('id')),
+        ).annotate(
+            first_image=first_image_subquery(RoomImage, 'room'),
+            first_image_variants=first_image_variants_subquery(RoomImage, 'room'),
+        )
+
+class TourQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related('location').prefetch_related(
+            models.Prefetch('images', queryset=TourImage.objects.order_by('id')),
+        ).annotate(
+            first_image=first_image_subquery(TourImage, 'tour'),
+            first_image_variants=first_image_variants_subquery(TourImage, 'tour'),
+        )
+
+class CarTransferQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related('location')
+
+class FlightTicketQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related('origin', 'destination')
+
+class BookingQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related(
+            'user', 'hotel__location', 'room', 'flight__origin', 'flight__destination',
+            'tour__location', 'car__location', 'promotion',
+        )
 
 class Location(models.Model):
     name = models.CharField(max_length=100)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='locations/', blank=True, null=True)
+    # Derivative sizes and dimensions, filled in by home.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_popular = models.BooleanField(default=False)
+    # WGS84 degrees of the city centre; indexed for map and distance queries by home.geo
+    latitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
 
     def __str__(self):
         return self.name
@@ -21,23 +82,36 @@ class Hotel(models.Model):
         (5, '5 Stars'),
     ]
     name = models.CharField(max_length=200)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='hotels')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Starting price for rooms")
     rating = models.FloatField(default=0)
     stars = models.IntegerField(choices=STAR_CHOICES, default=3)
     address = models.CharField(max_length=255, blank=True)
+    latitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
     amenities = models.TextField(blank=True, help_text="Comma-separated list of amenities")
     is_featured = models.BooleanField(default=False)
 
+    objects = HotelQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='hotel_price_idx'),
+            # Latitude bands for home.geo where the database has no R*Tree
+            models.Index(fields=['latitude', 'longitude'], name='hotel_coordinates_idx'),
+        ]
+
     def get_amenities_list(self):
         return [amenity.strip() for amenity in self.amenities.split(',') if amenity.strip()]
 
     def get_cheapest_room(self):
-        rooms = self.rooms.all()
-        if rooms:
-            return rooms.order_by('price').first()
-        return None
+        # Reuse prefetched rooms when the caller loaded them
+        if 'rooms' in getattr(self, '_prefetched_objects_cache', {}):
+            return min(self.rooms.all(), key=lambda room: room.price, default=None)
+        return self.rooms.order_by('price').first()
 
     def __str__(self):
         return self.name
@@ -62,6 +136,8 @@ class Room(models.Model):
 
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='rooms')
     name = models.CharField(max_length=200)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     room_type = models.CharField(max_length=20, choices=ROOM_TYPE_CHOICES, default='standard')
     bed_type = models.CharField(max_length=20, choices=BED_TYPE_CHOICES, default='single')
     description = models.TextField()
@@ -70,6 +146,9 @@ class Room(models.Model):
     size = models.IntegerField(default=0, help_text="Room size in square meters")
     services = models.TextField(blank=True, help_text="Comma-separated list of services")
     is_available = models.BooleanField(default=True)
+    units = models.PositiveIntegerField(default=1, help_text="Number of rooms of this type sold per night")
+
+    objects = RoomQuerySet.as_manager()
 
     # Basic amenities
     is_non_smoking = models.BooleanField(default=True, help_text="Non-smoking room")
@@ -98,9 +177,24 @@ class Room(models.Model):
     def __str__(self):
         return f"{self.name} - {self.hotel.name}"
 
+class RoomNight(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='nights')
+    date = models.DateField()
+    allotment = models.PositiveIntegerField(default=1)
+    booked = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='unique_room_night'),
+        ]
+
+    def __str__(self):
+        return f"{self.room.name} on {self.date} ({self.booked}/{self.allotment})"
+
 class RoomImage(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='rooms/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.room.name} in {self.room.hotel.name}"
@@ -108,6 +202,7 @@ class RoomImage(models.Model):
 class HotelImage(models.Model):
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='hotels/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.hotel.name}"
@@ -120,6 +215,8 @@ class FlightTicket(models.Model):
         ('first', 'First Class'),
     ]
     flight_number = models.CharField(max_length=50)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     airline = models.CharField(max_length=100, default="Unknown Airline")
     airline_logo = models.ImageField(upload_to='airlines/', blank=True, null=True)
     origin = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='departing_flights')
@@ -132,6 +229,15 @@ class FlightTicket(models.Model):
     seat_class = models.CharField(max_length=20, choices=SEAT_CLASS_CHOICES, default='economy')
     is_featured = models.BooleanField(default=False)
 
+    objects = FlightTicketQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['departure_time', 'id'], name='flight_departure_idx'),
+            # Fare calendar: one route over a range of days
+            models.Index(fields=['origin', 'destination', 'departure_time'], name='flight_route_idx'),
+        ]
+
     def get_duration(self):
         duration = self.arrival_time - self.departure_time
         hours, remainder = divmod(duration.total_seconds(), 3600)
@@ -143,6 +249,8 @@ class FlightTicket(models.Model):
 
 class Tour(models.Model):
     name = models.CharField(max_length=200)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='tours')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -151,6 +259,13 @@ class Tour(models.Model):
     rating = models.FloatField(default=0)
     is_featured = models.BooleanField(default=False)
 
+    objects = TourQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='tour_price_idx'),
+        ]
+
     def get_included_services_list(self):
         return [service.strip() for service in self.included_services.split(',') if service.strip()]
 
@@ -160,6 +275,7 @@ class Tour(models.Model):
 class TourImage(models.Model):
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='tours/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.tour.name}"
@@ -172,14 +288,24 @@ class CarTransfer(models.Model):
         ('luxury', 'Luxury'),
     ]
     name = models.CharField(max_length=200)
+    external_id = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                                   help_text="Supplier key used by import_catalog")
     car_type = models.CharField(max_length=20, choices=CAR_TYPE_CHOICES, default='sedan')
     location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='car_transfers')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     capacity = models.IntegerField(default=4)
     image = models.ImageField(upload_to='cars/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_featured = models.BooleanField(default=False)
 
+    objects = CarTransferQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='car_price_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.car_type}) - {self.location.name}"
 
@@ -220,6 +346,7 @@ class UserProfile(models.Model):
     phone_number = models.CharField(max_length=20, blank=True)
     address = models.CharField(max_length=255, blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Profile for {self.user.username}"
@@ -231,6 +358,8 @@ class Booking(models.Model):
         ('cancelled', 'Cancelled'),
         ('completed', 'Completed'),
     ]
+    # What a visitor may still cancel; completed and cancelled bookings are history
+    CANCELLABLE_STATUSES = ('pending', 'confirmed')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
     booking_type = models.CharField(max_length=20, choices=[
         ('hotel', 'Hotel'), 
@@ -239,6 +368,7 @@ class Booking(models.Model):
         ('car', 'Car Transfer')
     ])
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, blank=True, null=True)
+    room = models.ForeignKey(Room, on_delete=models.SET_NULL, blank=True, null=True)
     flight = models.ForeignKey(FlightTicket, on_delete=models.CASCADE, blank=True, null=True)
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE, blank=True, null=True)
     car = models.ForeignKey(CarTransfer, on_delete=models.CASCADE, blank=True, null=True)
@@ -251,14 +381,121 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=BOOKING_STATUS_CHOICES, default='pending')
 
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-booking_date', '-id'], name='booking_user_date_idx'),
+            # Admin date_hierarchy: Min/Max for the drill-down and the date range filters
+            models.Index(fields=['booking_date'], name='booking_date_idx'),
+        ]
+
     def __str__(self):
-        if self.booking_type == 'hotel' and self.hotel:
-            return f"Booking by {self.user} for hotel {self.hotel.name}"
-        elif self.booking_type == 'flight' and self.flight:
-            return f"Booking by {self.user} for flight {self.flight.flight_number}"
-        elif self.booking_type == 'tour' and self.tour:
-            return f"Booking by {self.user} for tour {self.tour.name}"
-        elif self.booking_type == 'car' and self.car:
-            return f"Booking by {self.user} for car {self.car.name}"
+        # Names only relations that are already loaded, so listing bookings costs no queries
+        user = self.user if Booking.user.is_cached(self) else f"user #{self.user_id}"
+        if self.booking_type == 'hotel' and self.hotel_id:
+            item = f"hotel {self.hotel.name}" if Booking.hotel.is_cached(self) else f"hotel #{self.hotel_id}"
+        elif self.booking_type == 'flight' and self.flight_id:
+            item = f"flight {self.flight.flight_number}" if Booking.flight.is_cached(self) else f"flight #{self.flight_id}"
+        elif self.booking_type == 'tour' and self.tour_id:
+            item = f"tour {self.tour.name}" if Booking.tour.is_cached(self) else f"tour #{self.tour_id}"
+        elif self.booking_type == 'car' and self.car_id:
+            item = f"car {self.car.name}" if Booking.car.is_cached(self) else f"car #{self.car_id}"
         else:
-            return f"Booking by {self.user}"
\ No newline at end of file
+            return f"Booking by {user}"
+        return f"Booking by {user} for {item}"
+
+class BookingRequest(models.Model):
+    # Durable intake queue: a validated booking form waiting for a worker to book it
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    reference = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='booking_requests')
+    payload = models.JSONField(help_text="pricing.Quote.to_dict() of the submitted form")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, blank=True, null=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Only waiting rows are indexed, so the queue index stays small as requests pile up
+            models.Index(fields=['id'], condition=models.Q(status='queued'), name='booking_request_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.reference} ({self.status})"
+
+class OrderSummary(models.Model):
+    # Read model of the orders page, rebuilt by home.order_summaries whenever its booking changes
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    # Covered by the composite indexes below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_summaries', db_index=False)
+    booking_type = models.CharField(max_length=20)
+    item_id = models.IntegerField(blank=True, null=True)
+    title = models.CharField(max_length=255)
+    thumbnail = models.CharField(max_length=255, blank=True)
+    thumbnail_variants = models.JSONField(default=dict, blank=True)
+    booking_date = models.DateTimeField()
+    check_in_date = models.DateField(blank=True, null=True)
+    check_out_date = models.DateField(blank=True, null=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status = models.CharField(max_length=20, choices=Booking.BOOKING_STATUS_CHOICES)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-booking_date', '-booking'], name='order_user_date_idx'),
+            models.Index(fields=['user', 'status', '-booking_date', '-booking'], name='order_user_status_idx'),
+        ]
+
+    def can_cancel(self):
+        # A stay that has ended is history too, whatever its status still says
+        if self.check_out_date and self.check_out_date < timezone.localdate():
+            return False
+        return self.status in Booking.CANCELLABLE_STATUSES
+
+    def __str__(self):
+        return self.title
+
+class PriceStatistic(models.Model):
+    CATEGORY_CHOICES = [
+        ('hotel', 'Hotel'),
+        ('tour', 'Tour'),
+        ('car', 'Car Transfer'),
+    ]
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, blank=True, null=True,
+                                 help_text="Empty for the statistics of the whole category")
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    count = models.IntegerField(default=0)
+    histogram = models.JSONField(default=list, help_text="Item count per price bucket")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'location'], name='unique_price_statistic'),
+            # NULLs never collide in the constraint above, so the category-wide row needs its own
+            models.UniqueConstraint(fields=['category'], condition=models.Q(location__isnull=True),
+                                    name='unique_global_price_statistic'),
+        ]
+
+    def __str__(self):
+        scope = self.location.name if self.location_id else 'all locations'
+        return f"{self.category} prices in {scope}"
+
+class ImportCheckpoint(models.Model):
+    feed = models.CharField(max_length=500, unique=True, help_text="Absolute path of the feed file")
+    model = models.CharField(max_length=20)
+    fingerprint = models.CharField(max_length=100, help_text="Size and mtime; a changed file starts over")
+    rows_done = models.PositiveBigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.model} from {self.feed} ({self.rows_done} rows)"
@@ -0,0 +1,95 @@
+from django.db.models import JSONField, OuterRef, Subquery
+
+from .models import Booking, HotelImage, OrderSummary, RoomImage, TourImage
+
+REBUILD_BATCH_SIZE = 2000
+
+SUMMARY_FIELDS = [
+    'user', 'booking_type', 'item_id', 'title', 'thumbnail', 'thumbnail_variants',
+    'booking_date', 'check_in_date', 'check_out_date', 'total_price', 'status',
+]
+
+
+def _first_image(model, fk_name, field='image', output_field=None):
+    # Like models.first_image_subquery, but for the item a booking points at
+    return Subquery(
+        model.objects.filter(**{fk_name: OuterRef(fk_name)}).order_by('id').values(field)[:1],
+        output_field=output_field,
+    )
+
+
+def _bookings():
+    # Everything a summary shows comes in this one query, first images included
+    return Booking.objects.select_related(
+        'hotel', 'room', 'flight__origin', 'flight__destination', 'tour', 'car',
+    ).annotate(
+        room_image=_first_image(RoomImage, 'room'),
+        room_image_variants=_first_image(RoomImage, 'room', 'image_variants', JSONField()),
+        hotel_image=_first_image(HotelImage, 'hotel'),
+        hotel_image_variants=_first_image(HotelImage, 'hotel', 'image_variants', JSONField()),
+        tour_image=_first_image(TourImage, 'tour'),
+        tour_image_variants=_first_image(TourImage, 'tour', 'image_variants', JSONField()),
+    )
+
+
+def summarize(booking):
+    summary = OrderSummary(
+        booking_id=booking.pk,
+        user_id=booking.user_id,
+        booking_type=booking.booking_type,
+        booking_date=booking.booking_date,
+        check_in_date=booking.check_in_date,
+        check_out_date=booking.check_out_date,
+        total_price=booking.total_price,
+        status=booking.status,
+        title='N/A',
+    )
+    if booking.booking_type == 'hotel' and booking.hotel:
+        summary.item_id = booking.hotel_id
+        summary.title = f"{booking.hotel.name} - {booking.room.name}" if booking.room else booking.hotel.name
+        if booking.room and booking.room_image:
+            summary.thumbnail, summary.thumbnail_variants = booking.room_image, booking.room_image_variants
+        else:
+            summary.thumbnail, summary.thumbnail_variants = booking.hotel_image, booking.hotel_image_variants
+    elif booking.booking_type == 'flight' and booking.flight:
+        flight = booking.flight
+        summary.item_id = flight.pk
+        summary.title = f"{flight.flight_number} ({flight.origin.name} - {flight.destination.name})"
+        summary.thumbnail = flight.airline_logo.name
+    elif booking.booking_type == 'tour' and booking.tour:
+        summary.item_id = booking.tour_id
+        summary.title = booking.tour.name
+        summary.thumbnail, summary.thumbnail_variants = booking.tour_image, booking.tour_image_variants
+    elif booking.booking_type == 'car' and booking.car:
+        summary.item_id = booking.car_id
+        summary.title = booking.car.name
+        summary.thumbnail, summary.thumbnail_variants = booking.car.image.name, booking.car.image_variants
+    summary.thumbnail = summary.thumbnail or ''
+    summary.thumbnail_variants = summary.thumbnail_variants or {}
+    return summary
+
+
+def refresh(booking_ids):
+    # One read and one upsert for any number of bookings
+    summaries = [summarize(booking) for booking in _bookings().filter(pk__in=list(booking_ids))]
+    OrderSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['booking'],
+        update_fields=SUMMARY_FIELDS,
+    )
+    return len(summaries)
+
+
+def rebuild(batch_size=REBUILD_BATCH_SIZE):
+    # Backfills every booking in primary key batches; safe to run again at any time
+    done = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Booking.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return done
+        done += refresh(ids)
+        last_id = ids[-1]
@@ -0,0 +1,81 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+PAGE_SIZE = 20
+
+
+class InvalidCursor(BadRequest):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(token)
+    return values
+
+
+def _after(ordering, values):
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), with the direction per field
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def paginate(queryset, ordering, cursor=None, page_size=PAGE_SIZE):
+    # Keyset pagination: the last row of a page becomes a WHERE bound for the
+    # next one, so every page is an index range scan with no OFFSET.
+    queryset = queryset.order_by(*ordering)
+    try:
+        if cursor:
+            queryset = queryset.filter(_after(ordering, decode_cursor(cursor, len(ordering))))
+        items = list(queryset[:page_size + 1])
+    except (ValidationError, TypeError, ValueError):
+        # A well-formed cursor can still hold values the fields cannot take, e.g. 'abc' for a price
+        if not cursor:
+            raise
+        raise InvalidCursor(cursor)
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return KeysetPage(items, next_cursor)
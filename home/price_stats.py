@@ -0,0 +1,118 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+
+from .models import CarTransfer, Hotel, PriceStatistic, Tour
+
+CATEGORY_MODELS = {
+    'hotel': Hotel,
+    'tour': Tour,
+    'car': CarTransfer,
+}
+
+# Fixed bucket edges (VND) so per-location histograms can be summed into the global one
+BUCKET_EDGES = [
+    Decimal(edge) for edge in (
+        0, 500000, 1000000, 2000000, 3000000, 5000000, 10000000, 20000000, 50000000,
+    )
+]
+
+
+def _bucket_filters():
+    for i, low in enumerate(BUCKET_EDGES):
+        high = BUCKET_EDGES[i + 1] if i + 1 < len(BUCKET_EDGES) else None
+        condition = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        yield f'bucket_{i}', condition
+
+
+def _aggregate(queryset):
+    # min, max, count and every histogram bucket in a single aggregate query
+    aggregates = {'min_price': Min('price'), 'max_price': Max('price'), 'count': Count('id')}
+    aggregates.update({name: Count('id', filter=condition) for name, condition in _bucket_filters()})
+    row = queryset.aggregate(**aggregates)
+    histogram = [row[f'bucket_{i}'] for i in range(len(BUCKET_EDGES))]
+    return row['min_price'], row['max_price'], row['count'], histogram
+
+
+def _store(category, location_id, min_price, max_price, count, histogram):
+    PriceStatistic.objects.update_or_create(
+        category=category,
+        location_id=location_id,
+        defaults={
+            'min_price': min_price,
+            'max_price': max_price,
+            'count': count,
+            'histogram': histogram,
+        },
+    )
+
+
+def _refresh_global(category):
+    # The category-wide row is merged from the per-location rows, never from the item table
+    rows = PriceStatistic.objects.filter(category=category, location__isnull=False, count__gt=0)
+    min_price = max_price = None
+    count = 0
+    histogram = [0] * len(BUCKET_EDGES)
+    for row in rows:
+        min_price = row.min_price if min_price is None else min(min_price, row.min_price)
+        max_price = row.max_price if max_price is None else max(max_price, row.max_price)
+        count += row.count
+        histogram = [total + part for total, part in zip(histogram, row.histogram)]
+    _store(category, None, min_price, max_price, count, histogram)
+
+
+def refresh(category, location_ids=None):
+    model = CATEGORY_MODELS[category]
+    with transaction.atomic():
+        if location_ids is None:
+            location_ids = set(model.objects.values_list('location_id', flat=True).distinct())
+            PriceStatistic.objects.filter(category=category, location__isnull=False).exclude(
+                location_id__in=location_ids,
+            ).delete()
+        for location_id in set(location_ids):
+            min_price, max_price, count, histogram = _aggregate(model.objects.filter(location_id=location_id))
+            if count:
+                _store(category, location_id, min_price, max_price, count, histogram)
+            else:
+                PriceStatistic.objects.filter(category=category, location_id=location_id).delete()
+        _refresh_global(category)
+
+
+def schedule_refresh(category, location_ids):
+    # Deferred to commit so a cascading Location delete never sees a half-deleted location
+    location_ids = {location_id for location_id in location_ids if location_id}
+    transaction.on_commit(lambda: refresh(category, location_ids))
+
+
+def get(category, location_id=None):
+    statistic = PriceStatistic.objects.filter(category=category, location_id=location_id).first()
+    if statistic is None and location_id is None:
+        # First request after a fresh migrate; later lookups hit the stored row. The
+        # primary is checked first, as a replica may have been synced before it existed.
+        primary = PriceStatistic.objects.using('default').filter(category=category, location_id=None)
+        statistic = primary.first()
+        if statistic is None:
+            refresh(category)
+            statistic = primary.first()
+    if statistic is None:
+        # Locations without any items of this category have no stored row
+        statistic = PriceStatistic(category=category, location_id=location_id,
+                                   histogram=[0] * len(BUCKET_EDGES))
+    return statistic
+
+
+def price_range(category, location_id=None):
+    statistic = get(category, location_id)
+    return {'min_price': statistic.min_price, 'max_price': statistic.max_price}
+
+
+def buckets(statistic):
+    result = []
+    for i, count in enumerate(statistic.histogram):
+        result.append({
+            'min_price': BUCKET_EDGES[i],
+            'max_price': BUCKET_EDGES[i + 1] if i + 1 < len(BUCKET_EDGES) else None,
+            'count': count,
+        })
+    return result
@@ -0,0 +1,214 @@
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from . import order_summaries, promo_resolver
+from .inventory import allocate_room, allocate_seats
+from .models import Booking, CarTransfer, FlightTicket, Hotel, Room, Tour
+
+ITEM_TYPES = ('hotel', 'room', 'flight', 'tour', 'car')
+
+# Hotels, flights and tours are charged per guest; a car is charged per vehicle
+PER_GUEST = ('hotel', 'flight', 'tour')
+
+MAX_ITEMS = 50
+
+
+class PricingError(Exception):
+    pass
+
+
+class Quote:
+    def __init__(self, item_type, item_id, check_in=None, check_out=None, number_of_guests=1,
+                 promo_code='', room_id=None, special_requests=''):
+        self.item_type = item_type
+        self.item_id = item_id
+        self.check_in = check_in
+        self.check_out = check_out
+        self.number_of_guests = number_of_guests
+        self.promo_code = promo_code
+        self.room_id = room_id
+        self.special_requests = special_requests
+
+        # Filled in by quote()
+        self.booking_type = 'hotel' if item_type == 'room' else item_type
+        self.item = None
+        self.room = None
+        self.promotion = None
+        self.nights = None
+        self.base_price = None
+        self.discount = None
+        self.total_price = None
+        self.error = None
+        self.promo_error = None
+
+    @classmethod
+    def from_dict(cls, data):
+        item_type = data.get('item_type')
+        if item_type not in ITEM_TYPES:
+            raise PricingError('Loại dịch vụ không hợp lệ.')
+        try:
+            item_id = int(data.get('item_id'))
+            number_of_guests = int(data.get('number_of_guests') or 1)
+            room_id = int(data['room_id']) if data.get('room_id') else None
+            check_in = parse_date(data['check_in_date']) if data.get('check_in_date') else None
+            check_out = parse_date(data['check_out_date']) if data.get('check_out_date') else None
+        except (TypeError, ValueError):
+            raise PricingError('Dữ liệu đặt chỗ không hợp lệ.')
+        if number_of_guests < 1:
+            raise PricingError('Số khách phải lớn hơn 0.')
+        return cls(
+            item_type, item_id, check_in, check_out, number_of_guests,
+            promo_code=(data.get('promo_code') or '').strip(),
+            room_id=room_id,
+            special_requests=data.get('special_requests') or '',
+        )
+
+    def booking(self, user):
+        return Booking(
+            user=user,
+            booking_type=self.booking_type,
+            hotel=self.item if self.booking_type == 'hotel' else None,
+            room=self.room,
+            flight=self.item if self.booking_type == 'flight' else None,
+            tour=self.item if self.booking_type == 'tour' else None,
+            car=self.item if self.booking_type == 'car' else None,
+            check_in_date=self.check_in,
+            check_out_date=self.check_out,
+            number_of_guests=self.number_of_guests,
+            special_requests=self.special_requests,
+            promotion=self.promotion,
+            total_price=self.total_price,
+            status='confirmed',
+        )
+
+    def to_dict(self):
+        # The input from_dict() reads back, e.g. for a queued booking request
+        return {
+            'item_type': self.item_type,
+            'item_id': self.item_id,
+            'room_id': self.room_id,
+            'check_in_date': self.check_in.isoformat() if self.check_in else None,
+            'check_out_date': self.check_out.isoformat() if self.check_out else None,
+            'number_of_guests': self.number_of_guests,
+            'promo_code': self.promo_code,
+            'special_requests': self.special_requests,
+        }
+
+    def as_dict(self):
+        return {
+            'item_type': self.item_type,
+            'item_id': self.item_id,
+            'room_id': self.room.id if self.room else self.room_id,
+            'label': str(self.room or self.item) if self.item else None,
+            'nights': self.nights,
+            'number_of_guests': self.number_of_guests,
+            'base_price': self.base_price,
+            'discount': self.discount,
+            'total_price': self.total_price,
+            'promo_code': self.promotion.promo_code if self.promotion else None,
+            'error': self.error,
+            'promo_error': self.promo_error,
+        }
+
+
+def _querysets():
+    return {
+        'hotel': Hotel.objects.all(),
+        'room': Room.objects.select_related('hotel'),
+        'flight': FlightTicket.objects.select_related('origin', 'destination'),
+        'tour': Tour.objects.select_related('location'),
+        'car': CarTransfer.objects.select_related('location'),
+    }
+
+
+def _load(quotes):
+    # One in_bulk per item model, however many lines the cart has
+    ids = {}
+    for line in quotes:
+        ids.setdefault(line.item_type, set()).add(line.item_id)
+        if line.room_id:
+            ids.setdefault('room', set()).add(line.room_id)
+    querysets = _querysets()
+    return {item_type: querysets[item_type].in_bulk(pks) for item_type, pks in ids.items()}
+
+
+def _resolve(line, items):
+    if line.item_type == 'room':
+        line.room = items['room'].get(line.item_id)
+        line.item = line.room.hotel if line.room else None
+    else:
+        line.item = items[line.item_type].get(line.item_id)
+        if line.item and line.room_id:
+            line.room = items['room'].get(line.room_id)
+            if line.room is None or line.room.hotel_id != line.item.id:
+                line.error = 'Không tìm thấy phòng đã chọn.'
+                return
+    if line.item is None:
+        line.error = 'Không tìm thấy dịch vụ.'
+
+
+def _price(line):
+    if line.check_in and line.check_out:
+        line.nights = (line.check_out - line.check_in).days
+        if line.booking_type == 'hotel' and line.nights < 1:
+            line.error = 'Ngày trả phòng phải sau ngày nhận phòng.'
+            return
+    elif line.room:
+        line.error = 'Vui lòng chọn ngày nhận và trả phòng.'
+        return
+    if line.room and line.number_of_guests > line.room.capacity:
+        line.error = f'Phòng chỉ dành cho tối đa {line.room.capacity} khách.'
+        return
+
+    price = line.room.price if line.room else line.item.price
+    if line.booking_type in PER_GUEST:
+        if line.booking_type == 'hotel':
+            # Without dates a hotel is quoted at its nightly rate
+            if line.nights:
+                price = price * line.nights * line.number_of_guests
+        else:
+            price = price * line.number_of_guests
+    line.base_price = price
+
+    if line.promo_code:
+        line.promotion = promo_resolver.by_code(line.promo_code, line.booking_type)
+        if line.promotion is None:
+            line.promo_error = 'Mã khuyến mãi không hợp lệ hoặc đã hết hạn.'
+    line.discount = promo_resolver.discount_for(line.promotion, price) if line.promotion else 0
+    line.total_price = price - line.discount
+
+
+def quote(quotes, max_items=MAX_ITEMS):
+    if max_items and len(quotes) > max_items:
+        raise PricingError(f'Tối đa {max_items} dịch vụ mỗi lần.')
+    items = _load(quotes)
+    for line in quotes:
+        _resolve(line, items)
+        if not line.error:
+            _price(line)
+    return quotes
+
+
+def reserve(line):
+    # Room nights or seats for one priced line; raises InventoryError when sold out
+    if line.booking_type == 'hotel' and not line.room:
+        # Inventory is kept per room, so a hotel without one could never sell out
+        raise PricingError('Vui lòng chọn phòng.')
+    if line.room:
+        allocate_room(line.room, line.check_in, line.check_out)
+    elif line.booking_type == 'flight':
+        allocate_seats(line.item, line.number_of_guests)
+
+
+def checkout(user, quotes):
+    # Every line is reserved and booked in one transaction, or none is
+    for line in quotes:
+        if line.error:
+            raise PricingError(line.error)
+    with transaction.atomic():
+        for line in quotes:
+            reserve(line)
+        bookings = Booking.objects.bulk_create([line.booking(user) for line in quotes])
+        # bulk_create sends no post_save, so the orders page is updated here
+        order_summaries.refresh([booking.pk for booking in bookings])
+        return bookings
@@ -0,0 +1,298 @@
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+from django.template import base as template_base
+
+# A fingerprint run this many times in one request is reported as a likely N+1
+REPEAT_THRESHOLD = 3
+
+BUCKET_SECONDS = 60
+# Durations kept per endpoint and bucket for the percentiles
+MAX_SAMPLES = 500
+# Repeated fingerprints kept per endpoint and bucket
+MAX_FINGERPRINTS = 20
+
+THIS_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(THIS_FILE)
+
+_current = contextvars.ContextVar('query_profile', default=None)
+_lock = threading.Lock()
+_buckets = deque()     # (bucket start, {endpoint: stats}), oldest first
+_installed = False
+
+_IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+
+
+def sample_rate():
+    return getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 0)
+
+
+def window_seconds():
+    return getattr(settings, 'QUERY_PROFILER_WINDOW', 15 * 60)
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql):
+    # The same statement with other values or another IN list length is the same fingerprint
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _LITERAL.sub('?', sql)
+
+
+def _source():
+    # The innermost template line or module of this app that ran the query
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        elif code.co_filename.startswith(APP_DIR) and code.co_filename != THIS_FILE:
+            return f'{os.path.relpath(code.co_filename, os.path.dirname(APP_DIR))}:{frame.f_lineno} in {code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class Profile:
+    """
+    What one sampled request did. Installed as an execute_wrapper on every
+    connection, so it sees the queries of the ORM and of raw cursors alike.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self.rendering = False
+        self.fingerprints = {}     # fingerprint -> [count, source]
+        # Async views run a request's queries in several threads at once
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            key = fingerprint(sql)
+            with self.lock:
+                self.db_time += elapsed
+                self.queries += 1
+                seen = self.fingerprints.get(key)
+                if seen is None:
+                    self.fingerprints[key] = seen = [0, None]
+                seen[0] += 1
+            if seen[0] > 1 and seen[1] is None:
+                # Looked up only once a statement repeats, from inside the loop that repeats it
+                seen[1] = _source()
+
+    def repeated(self):
+        # [(fingerprint, count, source)] at or over the threshold, most repeated first
+        repeats = [(sql, count, source) for sql, (count, source) in self.fingerprints.items()
+                   if count >= REPEAT_THRESHOLD]
+        return sorted(repeats, key=lambda repeat: -repeat[1])
+
+    def server_timing(self):
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ]
+        repeated = self.repeated()
+        if repeated:
+            _, count, source = repeated[0]
+            extra = sum(count - 1 for _, count, _ in repeated)
+            metrics.append(f'dup;desc="{extra} repeated, worst {count}x at {source or "?"}"')
+        return ', '.join(metrics)
+
+
+@contextlib.contextmanager
+def attached(profile=None):
+    """
+    Counts the queries this thread runs towards `profile`, by default the
+    sampled request's. Worker threads that query on behalf of a request use it
+    too, as execute wrappers belong to the connections of one thread.
+    """
+    profile = profile or _current.get()
+    with contextlib.ExitStack() as stack:
+        if profile is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+        yield profile
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context):
+        profile = _current.get()
+        if profile is None or profile.rendering:
+            # Unsampled, or an {% include %} inside a template already being timed
+            return render(self, context)
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_time += time.perf_counter() - started
+            profile.rendering = False
+    return wrapper
+
+
+def install():
+    # Template render time has no signal outside the test runner, so Template.render is wrapped once
+    global _installed
+    if not _installed:
+        template_base.Template.render = _timed_render(template_base.Template.render)
+        _installed = True
+
+
+def _empty_stats():
+    return {
+        'requests': 0, 'total_time': 0.0, 'max_time': 0.0, 'db_time': 0.0, 'template_time': 0.0,
+        'queries': 0, 'max_queries': 0, 'repeated': 0, 'samples': [], 'fingerprints': {},
+    }
+
+
+def _add(stats, profile):
+    stats['requests'] += 1
+    stats['total_time'] += profile.total_time
+    stats['max_time'] = max(stats['max_time'], profile.total_time)
+    stats['db_time'] += profile.db_time
+    stats['template_time'] += profile.template_time
+    stats['queries'] += profile.queries
+    stats['max_queries'] = max(stats['max_queries'], profile.queries)
+    # Reservoir sample, so a busy endpoint keeps an unbiased spread of durations
+    samples = stats['samples']
+    if len(samples) < MAX_SAMPLES:
+        samples.append(profile.total_time)
+    else:
+        slot = random.randrange(stats['requests'])
+        if slot < MAX_SAMPLES:
+            samples[slot] = profile.total_time
+    for sql, count, source in profile.repeated():
+        stats['repeated'] += count - 1
+        seen = stats['fingerprints'].get(sql)
+        if seen is None:
+            if len(stats['fingerprints']) >= MAX_FINGERPRINTS:
+                continue
+            seen = stats['fingerprints'][sql] = {'requests': 0, 'max_count': 0, 'source': source}
+        seen['requests'] += 1
+        seen['max_count'] = max(seen['max_count'], count)
+
+
+def record(endpoint, profile, now=None):
+    now = time.time() if now is None else now
+    start = now - now % BUCKET_SECONDS
+    with _lock:
+        if not _buckets or _buckets[-1][0] != start:
+            _buckets.append((start, {}))
+        while _buckets and _buckets[0][0] <= now - window_seconds() - BUCKET_SECONDS:
+            _buckets.popleft()
+        endpoints = _buckets[-1][1]
+        _add(endpoints.setdefault(endpoint, _empty_stats()), profile)
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(now=None):
+    """
+    Per-endpoint totals over the rolling window, as plain dicts with
+    milliseconds. Each worker process keeps its own window.
+    """
+    now = time.time() if now is None else now
+    merged = {}
+    with _lock:
+        for start, endpoints in _buckets:
+            if start <= now - window_seconds() - BUCKET_SECONDS:
+                continue
+            for endpoint, stats in endpoints.items():
+                total = merged.setdefault(endpoint, _empty_stats())
+                for key in ('requests', 'total_time', 'db_time', 'template_time', 'queries', 'repeated'):
+                    total[key] += stats[key]
+                total['max_time'] = max(total['max_time'], stats['max_time'])
+                total['max_queries'] = max(total['max_queries'], stats['max_queries'])
+                total['samples'].extend(stats['samples'])
+                for sql, seen in stats['fingerprints'].items():
+                    into = total['fingerprints'].setdefault(sql, {'requests': 0, 'max_count': 0, 'source': seen['source']})
+                    into['requests'] += seen['requests']
+                    into['max_count'] = max(into['max_count'], seen['max_count'])
+
+    rows = []
+    for endpoint, stats in merged.items():
+        requests = stats['requests']
+        fingerprints = sorted(stats['fingerprints'].items(), key=lambda item: -item[1]['max_count'] * item[1]['requests'])
+        rows.append({
+            'endpoint': endpoint,
+            'requests': requests,
+            'total_ms': stats['total_time'] * 1000,
+            'avg_ms': stats['total_time'] * 1000 / requests,
+            'p50_ms': _percentile(stats['samples'], 0.50) * 1000,
+            'p95_ms': _percentile(stats['samples'], 0.95) * 1000,
+            'max_ms': stats['max_time'] * 1000,
+            'avg_db_ms': stats['db_time'] * 1000 / requests,
+            'avg_template_ms': stats['template_time'] * 1000 / requests,
+            'avg_queries': stats['queries'] / requests,
+            'max_queries': stats['max_queries'],
+            'repeated_per_request': stats['repeated'] / requests,
+            'fingerprints': [dict(seen, sql=sql) for sql, seen in fingerprints],
+        })
+    return rows
+
+
+def reset():
+    with _lock:
+        _buckets.clear()
+
+
+def endpoint_name(request):
+    match = request.resolver_match
+    return f"{request.method} {match.view_name if match else '(unresolved)'}"
+
+
+class QueryProfilerMiddleware:
+    """
+    Samples QUERY_PROFILER_SAMPLE_RATE of the requests: their query count,
+    DB time, repeated SQL fingerprints and template time go out as a
+    Server-Timing header and into the window /_perf/ shows. Unsampled
+    requests cost one random() call. Queries a streaming response runs after
+    the view has returned are not counted.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        rate = sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        profile = Profile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with attached(profile):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        profile.total_time = time.perf_counter() - started
+        response['Server-Timing'] = profile.server_timing()
+        record(endpoint_name(request), profile)
+        return response
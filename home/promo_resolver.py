@@ -0,0 +1,87 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Promotion
+
+# Saves in other worker processes are picked up after at most this many seconds
+MAX_AGE = 300
+
+_lock = threading.Lock()
+_index = None
+
+
+class PromotionIndex:
+    def __init__(self, now):
+        self.by_type = {}
+        self.by_code = {}
+        self.built_at = time.monotonic()
+        # The index is exact until the next start_date or end_date boundary
+        self.expires = None
+
+        upcoming = Promotion.objects.filter(is_active=True, end_date__gte=now).order_by('end_date', 'id')
+        for promotion in upcoming:
+            if promotion.start_date > now:
+                boundary = promotion.start_date
+            else:
+                boundary = promotion.end_date
+                self.by_type.setdefault(promotion.promotion_type, []).append(promotion)
+                if promotion.promo_code:
+                    self.by_code[promotion.promo_code] = promotion
+            if self.expires is None or boundary < self.expires:
+                self.expires = boundary
+
+    def is_fresh(self, now):
+        if time.monotonic() - self.built_at > MAX_AGE:
+            return False
+        return self.expires is None or now < self.expires
+
+
+def _current():
+    global _index
+    now = timezone.now()
+    index = _index
+    if index is None or not index.is_fresh(now):
+        with _lock:
+            index = _index
+            if index is None or not index.is_fresh(now):
+                index = _index = PromotionIndex(now)
+    return index
+
+
+def invalidate():
+    global _index
+    _index = None
+
+
+def active(item_type=None, limit=None):
+    index = _current()
+    if item_type is None:
+        promotions = [promotion for group in index.by_type.values() for promotion in group]
+    else:
+        promotions = index.by_type.get(item_type, []) + index.by_type.get('general', [])
+    promotions = sorted(promotions, key=lambda promotion: (promotion.end_date, promotion.id))
+    return promotions[:limit] if limit else promotions
+
+
+def by_code(promo_code, item_type=None):
+    promotion = _current().by_code.get(promo_code)
+    if promotion is None:
+        return None
+    if item_type and promotion.promotion_type not in (item_type, 'general'):
+        return None
+    return promotion
+
+
+def discount_for(promotion, price):
+    price = Decimal(price)
+    if promotion.discount_percent > 0:
+        discount = price * Decimal(promotion.discount_percent) / 100
+    elif promotion.discount_amount > 0:
+        discount = promotion.discount_amount
+    else:
+        discount = Decimal(0)
+    # Never more than the price, and never a surcharge
+    return max(Decimal(0), min(discount, price))
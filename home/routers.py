@@ -0,0 +1,106 @@
+import contextvars
+import os
+import random
+import time
+
+from django.conf import settings
+
+# Read-only catalog pages whose queries may be answered by a replica
+READ_VIEWS = {
+    'home', 'search', 'autocomplete', 'detail', 'room_detail',
+    'hotel_search', 'flight_search', 'fare_calendar', 'tour_search', 'car_search',
+    'nearby', 'map',
+}
+
+# Catalog tables; users, bookings and sessions are always read from the primary
+CATALOG_MODELS = {
+    'location', 'hotel', 'hotelimage', 'room', 'roomimage', 'roomnight',
+    'flightticket', 'tour', 'tourimage', 'cartransfer', 'promotion', 'pricestatistic',
+}
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Unix time of the visitor's last write
+COOKIE_NAME = 'last_write'
+COOKIE_MAX_AGE = 24 * 60 * 60
+
+_replica = contextvars.ContextVar('replica', default=None)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+
+def replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def read_alias():
+    # For raw SQL that should follow the same routing as the ORM
+    return _replica.get() or 'default'
+
+
+def is_caught_up(alias, last_write):
+    if last_write is None:
+        return True
+    database = settings.DATABASES[alias]
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        # File copies are usable once they were taken after the visitor's last write
+        try:
+            return os.path.getmtime(database['NAME']) > last_write
+        except OSError:
+            return False
+    return time.time() - last_write > settings.REPLICA_STICKY_SECONDS
+
+
+def choose_replica(last_write=None):
+    candidates = [alias for alias in replicas() if is_caught_up(alias, last_write)]
+    return random.choice(candidates) if candidates else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias and model._meta.app_label == 'home' and model._meta.model_name in CATALOG_MODELS:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sends the catalog queries of READ_VIEWS to a replica. A visitor who wrote
+    something is kept on the primary until a replica has caught up with it.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica_token = _replica.set(None)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() or request.method not in SAFE_METHODS:
+                response.set_cookie(COOKIE_NAME, f'{time.time():.3f}', max_age=COOKIE_MAX_AGE,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            _replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS or request.resolver_match.url_name not in READ_VIEWS:
+            return None
+        try:
+            last_write = float(request.COOKIES[COOKIE_NAME])
+        except (KeyError, ValueError):
+            last_write = None
+        _replica.set(choose_replica(last_write))
+        return None
@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the suite with admission control off and a store file of its own.
+    ADMISSION_DB is otherwise shared by every process of the host, so limits
+    used up by a server or an earlier run would leak into the tests. The
+    admission tests turn it back on with override_settings.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._admission_dir = tempfile.mkdtemp(prefix='hp10-admission-')
+        self._admission_settings = override_settings(
+            ADMISSION_CONTROL=False,
+            ADMISSION_DB=os.path.join(self._admission_dir, 'admission.sqlite3'),
+        )
+        self._admission_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._admission_settings.disable()
+        shutil.rmtree(self._admission_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,395 @@
+import contextlib
+import random
+import time
+from array import array
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import order_summaries
+from .importer import refresh_derived
+from .models import Booking, CarTransfer, FlightTicket, Hotel, Location, Room, Tour
+
+# The catalog of a large agency; --scale multiplies every count
+DEFAULT_COUNTS = {
+    'locations': 500,
+    'users': 100000,
+    'hotels': 20000,
+    'rooms': 200000,
+    'flights': 2000000,
+    'tours': 20000,
+    'cars': 10000,
+    'bookings': 5000000,
+}
+
+BATCH_SIZE = 5000
+
+CITIES = [
+    'Hà Nội', 'Hồ Chí Minh', 'Đà Nẵng', 'Hội An', 'Huế', 'Nha Trang', 'Đà Lạt', 'Phú Quốc',
+    'Hạ Long', 'Sa Pa', 'Cần Thơ', 'Vũng Tàu', 'Quy Nhơn', 'Hải Phòng', 'Ninh Bình', 'Mũi Né',
+    'Côn Đảo', 'Buôn Ma Thuột', 'Pleiku', 'Vinh', 'Bangkok', 'Singapore', 'Kuala Lumpur', 'Seoul',
+    'Tokyo', 'Osaka', 'Đài Bắc', 'Hồng Kông', 'Bali', 'Siem Reap', 'Luang Prabang', 'Manila',
+]
+# (latitude, longitude) of CITIES, in the same order
+CITY_COORDINATES = [
+    (21.0285, 105.8542), (10.7769, 106.7009), (16.0544, 108.2022), (15.8801, 108.3380),
+    (16.4637, 107.5909), (12.2388, 109.1967), (11.9404, 108.4583), (10.2899, 103.9840),
+    (20.9517, 107.0806), (22.3364, 103.8438), (10.0452, 105.7469), (10.3460, 107.0843),
+    (13.7830, 109.2197), (20.8449, 106.6881), (20.2506, 105.9745), (10.9333, 108.2833),
+    (8.6833, 106.6000), (12.6667, 108.0500), (13.9833, 108.0000), (18.6796, 105.6813),
+    (13.7563, 100.5018), (1.3521, 103.8198), (3.1390, 101.6869), (37.5665, 126.9780),
+    (35.6762, 139.6503), (34.6937, 135.5023), (25.0330, 121.5654), (22.3193, 114.1694),
+    (-8.3405, 115.0920), (13.3671, 103.8448), (19.8856, 102.1347), (14.5995, 120.9842),
+]
+AIRLINES = [('VN', 'Vietnam Airlines'), ('VJ', 'Vietjet Air'), ('QH', 'Bamboo Airways'), ('BL', 'Pacific Airlines')]
+HOTEL_WORDS = ['Grand', 'Riverside', 'Golden', 'Lotus', 'Ocean', 'Central', 'Palace', 'Sunrise', 'Pearl', 'Garden']
+HOTEL_KINDS = ['Hotel', 'Resort', 'Boutique Hotel', 'Homestay', 'Villa', 'Hostel']
+AMENITIES = ['Wifi', 'Hồ bơi', 'Spa', 'Phòng gym', 'Nhà hàng', 'Bãi đỗ xe', 'Đưa đón sân bay', 'Quầy bar']
+ROOM_SERVICES = ['Bữa sáng', 'Dọn phòng', 'Giặt ủi', 'Minibar', 'Két sắt']
+TOUR_KINDS = ['Khám phá', 'Ẩm thực', 'Trekking', 'Du thuyền', 'Văn hóa', 'Biển đảo']
+TOUR_SERVICES = ['Hướng dẫn viên', 'Vé tham quan', 'Bữa trưa', 'Xe đưa đón', 'Bảo hiểm']
+CAR_MODELS = {
+    'sedan': ['Toyota Vios', 'Honda City', 'Mazda 3'],
+    'suv': ['Toyota Fortuner', 'Ford Everest', 'Hyundai Santa Fe'],
+    'van': ['Ford Transit', 'Hyundai Solati'],
+    'luxury': ['Mercedes E-Class', 'BMW 5 Series', 'Lexus ES'],
+}
+
+# (value, weight); booking types and statuses as a busy site sees them
+BOOKING_TYPES = [('hotel', 40), ('flight', 35), ('tour', 15), ('car', 10)]
+BOOKING_STATUSES = [('confirmed', 55), ('completed', 25), ('pending', 12), ('cancelled', 8)]
+SEAT_CLASSES = [('economy', 70), ('premium_economy', 12), ('business', 15), ('first', 3)]
+
+# Bookings are spread over this many days up to today, flights over as many ahead
+BOOKING_DAYS = 730
+FLIGHT_DAYS = 365
+
+
+def scaled_counts(scale=1.0, **overrides):
+    counts = {name: max(1, int(count * scale)) for name, count in DEFAULT_COUNTS.items()}
+    counts.update({name: count for name, count in overrides.items() if count is not None})
+    return counts
+
+
+def _rng(seed, table):
+    # One stream per table, so changing the size of one table leaves the others as they were
+    return random.Random(f'{seed}:{table}')
+
+
+def _choice(rng, weighted):
+    return rng.choices([value for value, _ in weighted], [weight for _, weight in weighted])[0]
+
+
+def _skewed(rng, count):
+    # Low indexes are picked far more often, like popular cities and best-selling hotels
+    return int(count * rng.random() ** 2)
+
+
+def _price(rng, low, high, step=1000):
+    return rng.randrange(low // step, high // step) * step
+
+
+def _next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+@contextlib.contextmanager
+def _keep_booking_dates():
+    # auto_now_add would stamp every generated booking with the time of the run
+    field = Booking._meta.get_field('booking_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class ScaleSeeder:
+    """
+    Builds a synthetic catalog with bulk inserts. Every row comes from a
+    random stream seeded with `seed` and the table name, and its primary key
+    is assigned here, so the same seed and start date give the same rows and
+    foreign keys never need to be read back. Existing rows are left alone;
+    new ones are numbered after them.
+    """
+    def __init__(self, seed=1, counts=None, batch_size=BATCH_SIZE, today=None, on_progress=None):
+        self.seed = seed
+        self.counts = counts or scaled_counts()
+        self.batch_size = batch_size
+        self.today = today or timezone.localdate()
+        self.midnight = timezone.make_aware(datetime.combine(self.today, dt_time.min))
+        self.on_progress = on_progress
+        self.first_pk = {}
+        # Prices by index, so bookings are priced without reading the catalog back
+        self.prices = {}
+        # Flat (lat, lng) pairs by index, so hotels are placed around their location
+        self.coordinates = {}
+
+    def run(self, derived=True):
+        self.locations()
+        self.users()
+        self.hotels()
+        self.rooms()
+        self.flights()
+        self.tours()
+        self.cars()
+        self.bookings()
+        if derived:
+            refresh_derived(['hotel', 'tour', 'car'])
+
+    def _insert(self, name, model, rows, after_batch=None):
+        self.first_pk[name] = _next_pk(model)
+        total = self.counts[name]
+        started = time.monotonic()
+        batch = []
+        done = 0
+        for index, values in enumerate(rows):
+            batch.append(model(pk=self.first_pk[name] + index, **values))
+            if len(batch) >= self.batch_size or index == total - 1:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                    if after_batch:
+                        after_batch(batch)
+                done += len(batch)
+                batch = []
+                if self.on_progress:
+                    self.on_progress(name, done, total, time.monotonic() - started)
+
+    def _pk(self, name, index):
+        return self.first_pk[name] + index
+
+    def locations(self):
+        rng = _rng(self.seed, 'locations')
+        # A stream of its own, so the other columns are the same as before coordinates existed
+        geo_rng = _rng(self.seed, 'locations:geo')
+        coordinates = self.coordinates['locations'] = array('d')
+
+        def rows():
+            for i in range(self.counts['locations']):
+                city = CITIES[i % len(CITIES)]
+                name = city if i < len(CITIES) else f'{city} {i // len(CITIES) + 1}'
+                lat, lng = CITY_COORDINATES[i % len(CITIES)]
+                if i >= len(CITIES):
+                    # Numbered districts lie around the city they are named after
+                    lat = round(lat + geo_rng.uniform(-0.3, 0.3), 6)
+                    lng = round(lng + geo_rng.uniform(-0.3, 0.3), 6)
+                coordinates.extend((lat, lng))
+                yield {
+                    'name': name,
+                    'description': f'Điểm đến {name} với {rng.randrange(5, 200)} điểm tham quan.',
+                    'is_popular': i < 20,
+                    'latitude': lat,
+                    'longitude': lng,
+                }
+        self._insert('locations', Location, rows())
+
+    def _location(self, rng):
+        return self._pk('locations', _skewed(rng, self.counts['locations']))
+
+    def users(self):
+        joined = self.midnight - timedelta(days=BOOKING_DAYS)
+
+        def rows():
+            for i in range(self.counts['users']):
+                # '!' marks an unusable password without hashing a random one
+                yield {
+                    'username': f'scale{self._pk("users", i)}',
+                    'email': f'scale{self._pk("users", i)}@example.com',
+                    'password': '!',
+                    'date_joined': joined,
+                }
+        self._insert('users', User, rows())
+
+    def hotels(self):
+        rng = _rng(self.seed, 'hotels')
+        geo_rng = _rng(self.seed, 'hotels:geo')
+        prices = self.prices['hotels'] = array('q')
+        centres = self.coordinates['locations']
+
+        def rows():
+            for i in range(self.counts['hotels']):
+                stars = rng.randint(1, 5)
+                price = _price(rng, 200000 * stars, 1000000 * stars)
+                prices.append(price)
+                name = f'{rng.choice(HOTEL_WORDS)} {rng.choice(HOTEL_KINDS)} {i + 1}'
+                location_id = self._location(rng)
+                index = location_id - self.first_pk['locations']
+                # Mostly within a few km of the centre, like a real city's hotels
+                lat = centres[2 * index] + geo_rng.gauss(0, 0.03)
+                lng = centres[2 * index + 1] + geo_rng.gauss(0, 0.03)
+                yield {
+                    'name': name,
+                    'location_id': location_id,
+                    'latitude': round(lat, 6),
+                    'longitude': round(lng, 6),
+                    'description': f'Khách sạn {stars} sao, cách trung tâm {rng.randrange(1, 30)} km.',
+                    'price': Decimal(price),
+                    'rating': round(rng.uniform(6, 10), 1),
+                    'stars': stars,
+                    'address': f'{rng.randrange(1, 500)} Đường số {rng.randrange(1, 100)}',
+                    'amenities': ', '.join(rng.sample(AMENITIES, rng.randint(2, 6))),
+                    'is_featured': rng.random() < 0.01,
+                }
+        self._insert('hotels', Hotel, rows())
+
+    def _rooms_of(self, hotel_index):
+        # Room i belongs to hotel i % hotels
+        rooms, hotels = self.counts['rooms'], self.counts['hotels']
+        return rooms // hotels + (1 if hotel_index < rooms % hotels else 0)
+
+    def rooms(self):
+        rng = _rng(self.seed, 'rooms')
+        hotels = self.counts['hotels']
+        prices = self.prices['rooms'] = array('q')
+        room_types = [value for value, _ in Room.ROOM_TYPE_CHOICES]
+        bed_types = [value for value, _ in Room.BED_TYPE_CHOICES]
+
+        def rows():
+            for i in range(self.counts['rooms']):
+                room_type = rng.choice(room_types)
+                price = int(self.prices['hotels'][i % hotels] * rng.uniform(1, 1.5)) // 1000 * 1000
+                prices.append(price)
+                yield {
+                    'hotel_id': self._pk('hotels', i % hotels),
+                    'name': f'{room_type.title()} {i // hotels + 1}',
+                    'room_type': room_type,
+                    'bed_type': rng.choice(bed_types),
+                    'description': f'Phòng {rng.randrange(18, 120)} m².',
+                    'price': Decimal(price),
+                    'capacity': rng.randint(1, 6),
+                    'size': rng.randrange(18, 120),
+                    'services': ', '.join(rng.sample(ROOM_SERVICES, rng.randint(1, 4))),
+                    'units': rng.randint(1, 20),
+                    'has_mini_bar': rng.random() < 0.5,
+                    'has_bathtub': rng.random() < 0.3,
+                }
+        self._insert('rooms', Room, rows())
+
+    def flights(self):
+        rng = _rng(self.seed, 'flights')
+        locations = self.counts['locations']
+        prices = self.prices['flights'] = array('q')
+        span = FLIGHT_DAYS * 24 * 60
+
+        def rows():
+            for i in range(self.counts['flights']):
+                origin = _skewed(rng, locations)
+                destination = _skewed(rng, locations)
+                if destination == origin:
+                    destination = (origin + 1) % locations
+                code, airline = rng.choice(AIRLINES)
+                seat_class = _choice(rng, SEAT_CLASSES)
+                # Departures in time order, so the ids follow the schedule as they would in a feed
+                departure = self.midnight + timedelta(minutes=(i + rng.random()) * span / self.counts['flights'])
+                price = _price(rng, 500000, 5000000)
+                if seat_class in ('business', 'first'):
+                    price *= 3
+                prices.append(price)
+                yield {
+                    'flight_number': f'{code}{rng.randrange(100, 9999)}',
+                    'airline': airline,
+                    'origin_id': self._pk('locations', origin),
+                    'destination_id': self._pk('locations', destination),
+                    'departure_time': departure,
+                    'arrival_time': departure + timedelta(minutes=rng.randrange(50, 600)),
+                    'price': Decimal(price),
+                    'rating': round(rng.uniform(6, 10), 1),
+                    'available_seats': rng.randrange(0, 300),
+                    'seat_class': seat_class,
+                    'is_featured': rng.random() < 0.0001,
+                }
+        self._insert('flights', FlightTicket, rows())
+
+    def tours(self):
+        rng = _rng(self.seed, 'tours')
+        prices = self.prices['tours'] = array('q')
+
+        def rows():
+            for i in range(self.counts['tours']):
+                days = rng.randint(1, 7)
+                price = _price(rng, 300000 * days, 2000000 * days)
+                prices.append(price)
+                yield {
+                    'name': f'Tour {rng.choice(TOUR_KINDS)} {i + 1}',
+                    'location_id': self._location(rng),
+                    'description': f'Hành trình {days} ngày cho nhóm tối đa {rng.randrange(4, 40)} khách.',
+                    'price': Decimal(price),
+                    'duration': f'{days} ngày, {days - 1} đêm' if days > 1 else '1 ngày',
+                    'included_services': ', '.join(rng.sample(TOUR_SERVICES, rng.randint(1, 5))),
+                    'rating': round(rng.uniform(6, 10), 1),
+                    'is_featured': rng.random() < 0.01,
+                }
+        self._insert('tours', Tour, rows())
+
+    def cars(self):
+        rng = _rng(self.seed, 'cars')
+        prices = self.prices['cars'] = array('q')
+        car_types = list(CAR_MODELS)
+
+        def rows():
+            for i in range(self.counts['cars']):
+                car_type = rng.choice(car_types)
+                price = _price(rng, 300000, 3000000)
+                prices.append(price)
+                yield {
+                    'name': f'{rng.choice(CAR_MODELS[car_type])} #{i + 1}',
+                    'car_type': car_type,
+                    'location_id': self._location(rng),
+                    'description': 'Xe đưa đón có tài xế.',
+                    'price': Decimal(price),
+                    'capacity': {'sedan': 4, 'suv': 7, 'van': 16, 'luxury': 4}[car_type],
+                    'is_featured': rng.random() < 0.01,
+                }
+        self._insert('cars', CarTransfer, rows())
+
+    def _booked_item(self, rng, booking_type, booking_date):
+        # (booking fields, price of one unit)
+        if booking_type == 'hotel':
+            hotel = _skewed(rng, self.counts['hotels'])
+            values = {'hotel_id': self._pk('hotels', hotel)}
+            price = self.prices['hotels'][hotel]
+            rooms = self._rooms_of(hotel)
+            if rooms:
+                room = hotel + self.counts['hotels'] * rng.randrange(rooms)
+                values['room_id'] = self._pk('rooms', room)
+                price = self.prices['rooms'][room]
+            check_in = booking_date.date() + timedelta(days=rng.randrange(1, 90))
+            nights = rng.randint(1, 5)
+            values.update(check_in_date=check_in, check_out_date=check_in + timedelta(days=nights))
+            return values, price * nights
+        name = {'flight': 'flights', 'tour': 'tours', 'car': 'cars'}[booking_type]
+        index = _skewed(rng, self.counts[name])
+        return {f'{booking_type}_id': self._pk(name, index)}, self.prices[name][index]
+
+    def bookings(self):
+        rng = _rng(self.seed, 'bookings')
+        total = self.counts['bookings']
+        start = self.midnight - timedelta(days=BOOKING_DAYS)
+        span = BOOKING_DAYS * 24 * 60 * 60
+
+        def rows():
+            for i in range(total):
+                booking_type = _choice(rng, BOOKING_TYPES)
+                # In time order, like ids handed out as bookings come in
+                booking_date = start + timedelta(seconds=(i + rng.random()) * span / total)
+                values, price = self._booked_item(rng, booking_type, booking_date)
+                # Hotel stays are short and small, so totals stay inside Booking.total_price's 10 digits
+                guests = rng.randint(1, 2 if booking_type == 'hotel' else 4)
+                values.update(
+                    user_id=self._pk('users', _skewed(rng, self.counts['users'])),
+                    booking_type=booking_type,
+                    booking_date=booking_date,
+                    number_of_guests=guests,
+                    total_price=Decimal(price * (1 if booking_type == 'car' else guests)),
+                    status=_choice(rng, BOOKING_STATUSES),
+                )
+                yield values
+
+        # bulk_create sends no post_save, so each batch fills its order summaries itself
+        with _keep_booking_dates():
+            self._insert('bookings', Booking, rows(),
+                         after_batch=lambda batch: order_summaries.refresh([booking.pk for booking in batch]))
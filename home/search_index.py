@@ -0,0 +1,209 @@
+import re
+import unicodedata
+
+from django.db import connection, connections, transaction
+
+from .models import CarTransfer, FlightTicket, Hotel, Location, Tour
+from .pagination import PAGE_SIZE, KeysetPage, decode_cursor, encode_cursor
+from .routers import read_alias
+
+TABLE = 'home_search_index'
+
+INDEXED_MODELS = {
+    'hotel': Hotel,
+    'flight': FlightTicket,
+    'tour': Tour,
+    'car': CarTransfer,
+    'location': Location,
+}
+
+# The rowid is derived from (item_type, item_id): the UNINDEXED columns can only be scanned,
+# while a rowid is a B-tree lookup. Migration 0019 uses the same codes.
+ROWID_TYPES = {
+    'hotel': 1,
+    'flight': 2,
+    'tour': 3,
+    'car': 4,
+    'location': 5,
+}
+ROWID_STRIDE = 8
+
+# item_type and item_id are UNINDEXED, so only title and body carry weight
+BM25_WEIGHTS = '0.0, 0.0, 10.0, 1.0'
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "item_type UNINDEXED, item_id UNINDEXED, title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_SQL = f"DROP TABLE IF EXISTS {TABLE}"
+
+
+def fold(text):
+    # 'Đà Nẵng' -> 'da nang'; đ has no decomposition so it is mapped by hand
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return text.lower()
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def document_for(obj):
+    if isinstance(obj, Hotel):
+        title = obj.name
+        body = [obj.location.name, obj.address, obj.amenities, obj.description]
+    elif isinstance(obj, FlightTicket):
+        title = f"{obj.flight_number} {obj.airline}"
+        body = [obj.origin.name, obj.destination.name, obj.get_seat_class_display()]
+    elif isinstance(obj, Tour):
+        title = obj.name
+        body = [obj.location.name, obj.included_services, obj.description]
+    elif isinstance(obj, CarTransfer):
+        title = obj.name
+        body = [obj.location.name, obj.get_car_type_display(), obj.description]
+    else:
+        title = obj.name
+        body = [obj.description]
+    return fold(title), fold(' '.join(part for part in body if part))
+
+
+def item_type_for(obj):
+    for item_type, model in INDEXED_MODELS.items():
+        if isinstance(obj, model):
+            return item_type
+    return None
+
+
+def rowid_for(item_type, pk):
+    return pk * ROWID_STRIDE + ROWID_TYPES[item_type]
+
+
+def _delete_rows(cursor, item_type, ids):
+    cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(rowid_for(item_type, pk),) for pk in ids])
+
+
+def _insert_rows(cursor, item_type, objs):
+    cursor.executemany(
+        f"INSERT INTO {TABLE} (rowid, item_type, item_id, title, body) VALUES (%s, %s, %s, %s, %s)",
+        [(rowid_for(item_type, obj.pk), item_type, obj.pk, *document_for(obj)) for obj in objs],
+    )
+
+
+def index_objects(objs):
+    if not is_enabled():
+        return
+    by_type = {}
+    for obj in objs:
+        by_type.setdefault(item_type_for(obj), []).append(obj)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for item_type, group in by_type.items():
+            _delete_rows(cursor, item_type, [obj.pk for obj in group])
+            _insert_rows(cursor, item_type, group)
+
+
+def remove_object(obj):
+    if not is_enabled():
+        return
+    with connection.cursor() as cursor:
+        _delete_rows(cursor, item_type_for(obj), [obj.pk])
+
+
+def indexed_queryset(item_type):
+    model = INDEXED_MODELS[item_type]
+    if item_type == 'flight':
+        return model.objects.select_related('origin', 'destination')
+    if item_type == 'location':
+        return model.objects.all()
+    return model.objects.select_related('location')
+
+
+def listing_queryset(item_type):
+    model = INDEXED_MODELS[item_type]
+    if item_type == 'location':
+        return model.objects.all()
+    return model.objects.for_listing()
+
+
+def dependents_of(location, batch_size=2000):
+    # Documents that embed the location name and must follow a rename, streamed
+    for queryset in (
+        indexed_queryset('hotel').filter(location=location),
+        indexed_queryset('tour').filter(location=location),
+        indexed_queryset('car').filter(location=location),
+        indexed_queryset('flight').filter(origin=location),
+        indexed_queryset('flight').filter(destination=location).exclude(origin=location),
+    ):
+        yield from queryset.iterator(chunk_size=batch_size)
+
+
+def index_dependents(location, batch_size=2000):
+    # Re-indexes a renamed location's documents a batch at a time, so memory stays flat
+    batch = []
+    for obj in dependents_of(location, batch_size):
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            index_objects(batch)
+            batch = []
+    if batch:
+        index_objects(batch)
+
+
+def rebuild(batch_size=2000, stdout=None):
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        for item_type in INDEXED_MODELS:
+            batch = []
+            counts[item_type] = 0
+            for obj in indexed_queryset(item_type).iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    _insert_rows(cursor, item_type, batch)
+                    counts[item_type] += len(batch)
+                    batch = []
+            if batch:
+                _insert_rows(cursor, item_type, batch)
+                counts[item_type] += len(batch)
+            if stdout:
+                stdout.write(f"Indexed {counts[item_type]} {item_type} rows")
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+    return counts
+
+
+def match_expression(query):
+    # Every term must match, each as a prefix so typeahead-style input works
+    terms = re.findall(r'\w+', fold(query))
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_page(query, item_type, cursor=None, page_size=PAGE_SIZE):
+    # Keyset over (bm25 score, item_id) instead of OFFSET. FTS5 auxiliary
+    # functions cannot appear in WHERE, so the bound is applied one level up.
+    expression = match_expression(query)
+    if not expression:
+        return KeysetPage([], None)
+    sql = (
+        f"SELECT item_id, score FROM (SELECT item_id, bm25({TABLE}, {BM25_WEIGHTS}) AS score "
+        f"FROM {TABLE} WHERE {TABLE} MATCH %s AND item_type = %s)"
+    )
+    params = [expression, item_type]
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, 2)
+        sql += " WHERE score > %s OR (score = %s AND item_id > %s)"
+        params += [last_score, last_score, last_id]
+    sql += " ORDER BY score, item_id LIMIT %s"
+    params.append(page_size + 1)
+    with connections[read_alias()].cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([rows[-1][1], rows[-1][0]])
+    objects = listing_queryset(item_type).in_bulk([pk for pk, _ in rows])
+    return KeysetPage([objects[pk] for pk, _ in rows if pk in objects], next_cursor)
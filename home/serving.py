@@ -0,0 +1,190 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_hashed
+
+# Precompressed siblings written by the compress_static command, best first
+ENCODINGS = (
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """
+    Read-limited view of an open file starting at `start`. fileno() is kept so
+    WSGI servers with a sendfile-capable file_wrapper (gunicorn) still send
+    the range zero-copy from the current offset, bounded by Content-Length.
+    """
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _resolve(document_root, path):
+    # safe_join rejects paths that escape the root with a 400
+    full_path = safe_join(document_root, path)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise Http404(path)
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404(path)
+    return full_path, st
+
+
+def _etag(path, st):
+    # Hashed names already are a strong validator
+    if is_hashed(path):
+        return f'"{os.path.splitext(os.path.basename(path))[0]}"'
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _not_modified(request, etag, st):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return modified_since is not None and int(st.st_mtime) <= modified_since
+
+
+def _byte_range(request, etag, size):
+    # Only a single range is served; anything else falls back to the whole file
+    header = request.headers.get('Range')
+    if not header or request.headers.get('If-Range', etag) != etag:
+        return None
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _accepted_encodings(header):
+    # 'br;q=0, gzip;q=0.8, *' -> {'br': 0.0, 'gzip': 0.8, '*': 1.0}
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+                if not 0 <= q <= 1:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def _precompressed(request, full_path, content_type):
+    if not content_type or not content_type.startswith(COMPRESSIBLE_TYPES):
+        return None
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+
+    def quality(encoding):
+        return accepted.get(encoding, accepted.get('*', 0))
+
+    # Highest q-value first; ties keep the order of ENCODINGS. q=0 means "not this one"
+    for encoding, suffix in sorted(ENCODINGS, key=lambda item: -quality(item[0])):
+        if quality(encoding) <= 0:
+            continue
+        try:
+            st = os.stat(full_path + suffix)
+        except OSError:
+            continue
+        return encoding, full_path + suffix, st
+    return None
+
+
+def serve_file(request, document_root, path, cache_control=None):
+    full_path, st = _resolve(document_root, path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if cache_control is None:
+        cache_control = IMMUTABLE if is_hashed(path) else REVALIDATE
+
+    content_encoding = encoding
+    variant = None if encoding else _precompressed(request, full_path, content_type)
+    if variant:
+        content_encoding, full_path, st = variant
+
+    etag = _etag(path, st)
+    if variant:
+        # Each encoding is a different representation with its own validator
+        etag = f'{etag[:-1]}-{content_encoding}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    if content_type.startswith(COMPRESSIBLE_TYPES):
+        headers['Vary'] = 'Accept-Encoding'
+
+    if _not_modified(request, etag, st):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    byte_range = _byte_range(request, etag, st.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+
+    file = open(full_path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = st.st_size
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,134 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog_cache, geo, images, order_summaries, price_stats, promo_resolver, search_index, typeahead
+from .models import Booking, CarTransfer, FlightTicket, Hotel, HotelImage, Location, Promotion, Room, Tour, TourImage
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=FlightTicket)
+@receiver(post_save, sender=Tour)
+@receiver(post_save, sender=CarTransfer)
+def index_catalog_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.index_objects([instance])
+        if sender is Hotel:
+            typeahead.update('hotel', instance)
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=Location)
+def index_coordinates(sender, instance, raw=False, **kwargs):
+    if not raw:
+        geo.index_objects([instance])
+
+
+@receiver(post_delete, sender=Hotel)
+@receiver(post_delete, sender=Location)
+def unindex_coordinates(sender, instance, **kwargs):
+    geo.remove_object(instance)
+
+
+@receiver(pre_save, sender=Location)
+def remember_location_name(sender, instance, raw=False, **kwargs):
+    # Hotels, tours, cars and flights embed the name in their documents; other edits leave them be
+    instance._previous_name = None
+    if not raw and instance.pk:
+        instance._previous_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Location)
+def index_location(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    search_index.index_objects([instance])
+    typeahead.update('location', instance)
+    if not created and getattr(instance, '_previous_name', None) != instance.name:
+        search_index.index_dependents(instance)
+
+
+@receiver(post_delete, sender=Hotel)
+@receiver(post_delete, sender=FlightTicket)
+@receiver(post_delete, sender=Tour)
+@receiver(post_delete, sender=CarTransfer)
+@receiver(post_delete, sender=Location)
+def unindex_catalog_item(sender, instance, **kwargs):
+    search_index.remove_object(instance)
+    if sender in (Hotel, Location):
+        typeahead.remove(search_index.item_type_for(instance), instance.pk)
+
+
+PRICED_MODELS = {Hotel: 'hotel', Tour: 'tour', CarTransfer: 'car'}
+
+
+@receiver(pre_save, sender=Hotel)
+@receiver(pre_save, sender=Tour)
+@receiver(pre_save, sender=CarTransfer)
+def remember_price_location(sender, instance, raw=False, **kwargs):
+    # A move to another location changes the statistics of the old one too
+    instance._previous_location_id = None
+    if not raw and instance.pk:
+        instance._previous_location_id = (
+            sender.objects.filter(pk=instance.pk).values_list('location_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=Tour)
+@receiver(post_save, sender=CarTransfer)
+def refresh_price_statistics(sender, instance, raw=False, **kwargs):
+    if not raw:
+        price_stats.schedule_refresh(
+            PRICED_MODELS[sender],
+            [instance.location_id, getattr(instance, '_previous_location_id', None)],
+        )
+
+
+@receiver(post_delete, sender=Hotel)
+@receiver(post_delete, sender=Tour)
+@receiver(post_delete, sender=CarTransfer)
+def refresh_price_statistics_after_delete(sender, instance, **kwargs):
+    price_stats.schedule_refresh(PRICED_MODELS[sender], [instance.location_id])
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def invalidate_promotions(sender, **kwargs):
+    promo_resolver.invalidate()
+
+
+# Cached catalog reads (home/catalog_cache.py) name the models they depend on
+CACHED_MODELS = (Location, Hotel, HotelImage, Room, Tour, TourImage, CarTransfer, FlightTicket, Promotion)
+
+
+def retire_cached_reads(sender, **kwargs):
+    # Raw saves too: fixtures change what the cached reads would return just the same
+    catalog_cache.bump(sender)
+
+
+for cached_model in CACHED_MODELS:
+    post_save.connect(retire_cached_reads, sender=cached_model)
+    post_delete.connect(retire_cached_reads, sender=cached_model)
+
+
+@receiver(post_save, sender=Booking)
+def refresh_order_summary(sender, instance, raw=False, **kwargs):
+    if not raw:
+        order_summaries.refresh([instance.pk])
+
+
+def build_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_build(sender, instance):
+        images.schedule(sender, instance.pk)
+
+
+def delete_image_derivatives(sender, instance, **kwargs):
+    data = getattr(instance, images.variants_field(sender))
+    if data:
+        transaction.on_commit(lambda: images.delete_derivatives(data))
+
+
+for image_model in images.IMAGE_FIELDS:
+    post_save.connect(build_image_derivatives, sender=image_model)
+    post_delete.connect(delete_image_derivatives, sender=image_model)
@@ -0,0 +1,12 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Reload the changelist filtered by the picked row, back on the first page
+    $(document).on('change', '.autocomplete-filter', function() {
+        const params = new URLSearchParams(window.location.search);
+        params.set(this.dataset.lookup, this.value);
+        params.delete('p');
+        window.location.search = params.toString();
+    });
+}
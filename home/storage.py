@@ -0,0 +1,89 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# cas/ab/ab12...ef.jpg: the name is the SHA-256 of the content, so it never changes meaning
+HASHED_NAME = re.compile(r'^cas/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+# Uploads are written under this prefix next to their final name, then renamed into place
+TEMPORARY_PREFIX = '.upload-'
+
+
+def is_hashed(name):
+    return bool(name and HASHED_NAME.match(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file under the hash of its content. Identical uploads to
+    any FileField share one file, and a name is never reused for different
+    bytes, so URLs can be cached forever.
+
+    Because a file may be shared, delete() leaves hashed files in place;
+    the collect_media command removes the ones no row references.
+    """
+    prefix = 'cas'
+
+    def hashed_name(self, content, name):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        extension = os.path.splitext(name or '')[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]+', extension):
+            extension = ''
+        hexdigest = digest.hexdigest()
+        return f'{self.prefix}/{hexdigest[:2]}/{hexdigest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(content, name)
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        # Write to a temporary file and rename, so concurrent uploads of the
+        # same bytes both succeed and nobody ever reads a partial file
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def delete(self, name):
+        if not is_hashed(name):
+            super().delete(name)
+
+    def purge(self, name):
+        super().delete(name)
+
+    def walk(self):
+        # Every stored hashed name, with its modification time
+        root = self.path(self.prefix)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                name = os.path.relpath(full_path, self.location).replace(os.sep, '/')
+                if is_hashed(name):
+                    yield name, os.path.getmtime(full_path)
+
@@ -0,0 +1,99 @@
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+register = template.Library()
+
+
+def _truncate(day, kind):
+    if kind == 'year':
+        return day.replace(month=1, day=1)
+    if kind == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next(day, kind):
+    if kind == 'year':
+        return day.replace(year=day.year + 1)
+    if kind == 'month':
+        return (day + datetime.timedelta(days=32)).replace(day=1)
+    return day + datetime.timedelta(days=1)
+
+
+class IndexedDates:
+    """
+    Stands in for cl.queryset inside Django's date_hierarchy. dates() and
+    datetimes() truncate and DISTINCT every row, a full scan; here each
+    candidate year, month or day between the indexed Min and Max is one
+    EXISTS range probe on the same index.
+    """
+    def __init__(self, queryset, field_name):
+        self.queryset = queryset
+        self.field_name = field_name
+
+    @cached_property
+    def bounds(self):
+        # Two ordered LIMIT 1 reads from the ends of the index; SQLite scans the
+        # whole table for MIN and MAX in one query
+        values = self.queryset.values_list(self.field_name, flat=True)
+        return {
+            'first': values.order_by(self.field_name).first(),
+            'last': values.order_by(f'-{self.field_name}').first(),
+        }
+
+    def aggregate(self, **kwargs):
+        # date_hierarchy only asks for these bounds, to pick its starting level
+        return self.bounds
+
+    def _periods(self, kind, aware):
+        first, last = self.bounds['first'], self.bounds['last']
+        if first is None:
+            return []
+        if aware:
+            first, last = timezone.localtime(first).date(), timezone.localtime(last).date()
+        periods = []
+        day = _truncate(first, kind)
+        while day <= last:
+            start, end = day, _next(day, kind)
+            if aware:
+                start = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min))
+                end = timezone.make_aware(datetime.datetime.combine(end, datetime.time.min))
+            if self.queryset.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end}).exists():
+                periods.append(start)
+            day = _next(day, kind)
+        return periods
+
+    def dates(self, field_name, kind, **kwargs):
+        return self._periods(kind, aware=False)
+
+    def datetimes(self, field_name, kind, **kwargs):
+        return self._periods(kind, aware=True)
+
+
+class _IndexedChangeList:
+    def __init__(self, cl):
+        self._cl = cl
+        self.queryset = IndexedDates(cl.queryset, cl.date_hierarchy)
+
+    def __getattr__(self, name):
+        return getattr(self._cl, name)
+
+
+def indexed_date_hierarchy(cl):
+    return date_hierarchy(_IndexedChangeList(cl))
+
+
+@register.tag(name='indexed_date_hierarchy')
+def indexed_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser,
+        token,
+        func=indexed_date_hierarchy,
+        template_name='date_hierarchy.html',
+        takes_context=False,
+    )
@@ -0,0 +1,48 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from ..images import pick
+
+register = template.Library()
+
+
+@register.filter
+def media_url(name):
+    # Turns an annotated image path (e.g. first_image) into a URL without loading the image row
+    if not name:
+        return ''
+    return default_storage.url(name)
+
+
+@register.filter
+def srcset(variants, extension='jpeg'):
+    # "url 160w, url 640w, ..." from an image's stored derivatives
+    return ', '.join(
+        f"{default_storage.url(variant[extension])} {variant['width']}w"
+        for variant in (variants or {}).get('variants', [])
+    )
+
+
+@register.simple_tag
+def picture(image, variants, width, sizes=None, **attrs):
+    """
+    <picture> with a WebP source and a JPEG fallback for an image rendered
+    `width` CSS pixels wide. The <img> gets the smallest derivative that
+    fits, and its dimensions come from the stored metadata, not the file.
+    """
+    name = getattr(image, 'name', image)
+    variant = pick(variants, int(width))
+    if variant is None:
+        return format_html(
+            '<img src="{}"{}>', media_url(name), format_html_join('', ' {}="{}"', attrs.items()),
+        )
+    sizes = sizes or f'{width}px'
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" loading="lazy"{}></picture>',
+        srcset(variants, 'webp'), sizes,
+        default_storage.url(variant['jpeg']), srcset(variants, 'jpeg'), sizes,
+        variant['width'], variant['height'],
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
@@ -1,3 +1,1620 @@
-from django.test import TestCase
+import csv
+import hashlib
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, close_old_connections, connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    admission, benchmarks, catalog_cache, concurrency, exports, fare_calendar, geo, images, importer, intake,
+    order_summaries, price_stats, pricing, profiler, promo_resolver, routers, scale_data, search_index, typeahead,
+    views,
+)
+from .inventory import (
+    RoomUnavailable, SeatsUnavailable, allocate_room, allocate_seats, available_hotels, cancel_booking, release_room,
+)
+from .management.commands.collect_media import referenced_names
+from .models import (
+    Booking, BookingRequest, CarTransfer, FlightTicket, Hotel, HotelImage, ImportCheckpoint, Location, OrderSummary,
+    PriceStatistic, Promotion, Room, RoomImage, RoomNight, Tour,
+)
+from .pagination import PAGE_SIZE, InvalidCursor, encode_cursor, paginate
+from .storage import is_hashed
+
+
+class FlightSeatContentionTests(TransactionTestCase):
+    seats = 50
+    threads = 8
+    attempts_per_thread = 20
+
+    def setUp(self):
+        origin = Location.objects.create(name='Hà Nội')
+        destination = Location.objects.create(name='Đà Nẵng')
+        departure = timezone.now() + timedelta(days=7)
+        self.flight = FlightTicket.objects.create(
+            flight_number='VN123', origin=origin, destination=destination,
+            departure_time=departure, arrival_time=departure + timedelta(hours=1),
+            price=1000000, available_seats=self.seats,
+        )
+        self.users = [User.objects.create(username=f'user{i}') for i in range(self.threads)]
+
+    def book(self, user, results):
+        close_old_connections()
+        try:
+            for _ in range(self.attempts_per_thread):
+                while True:
+                    try:
+                        with transaction.atomic():
+                            allocate_seats(self.flight)
+                            Booking.objects.create(
+                                user=user, booking_type='flight', flight=self.flight,
+                                total_price=self.flight.price, status='confirmed',
+                            )
+                        results.append('booked')
+                        break
+                    except SeatsUnavailable:
+                        results.append('refused')
+                        break
+                    except OperationalError:
+                        # SQLite reports writer contention instead of blocking; retry
+                        time.sleep(0.001)
+        finally:
+            connection.close()
+
+    def test_concurrent_bookings_never_oversell(self):
+        results = []
+        workers = [threading.Thread(target=self.book, args=(user, results)) for user in self.users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        booked = results.count('booked')
+        self.flight.refresh_from_db()
+        self.assertEqual(booked, self.seats)
+        self.assertEqual(Booking.objects.filter(flight=self.flight).count(), self.seats)
+        self.assertEqual(self.flight.available_seats, 0)
+        self.assertEqual(results.count('refused'), self.threads * self.attempts_per_thread - self.seats)
+
+    def test_cancel_releases_seats(self):
+        with transaction.atomic():
+            allocate_seats(self.flight, 2)
+            booking = Booking.objects.create(
+                user=self.users[0], booking_type='flight', flight=self.flight, number_of_guests=2,
+            )
+        self.assertTrue(cancel_booking(booking))
+        self.assertFalse(cancel_booking(booking))
+        self.flight.refresh_from_db()
+        self.assertEqual(self.flight.available_seats, self.seats)
+
+
+class RoomInventoryTests(TestCase):
+    def setUp(self):
+        location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+        self.room = Room.objects.create(hotel=self.hotel, name='Deluxe', price=100, capacity=2, units=1)
+        self.check_in = date(2030, 5, 1)
+        self.check_out = date(2030, 5, 4)
+        self.user = User.objects.create_user('guest', password='secret')
+        self.client.force_login(self.user)
+
+    def book(self, item_type='room', item_id=None, **data):
+        data = {'check_in_date': self.check_in, 'check_out_date': self.check_out, 'number_of_guests': 1, **data}
+        return self.client.post(f'/booking/{item_type}/{item_id or self.room.pk}/', data)
+
+    def test_allocate_refuses_a_sold_out_night_and_release_frees_it(self):
+        allocate_room(self.room, self.check_in, self.check_out)
+        self.assertEqual(RoomNight.objects.filter(room=self.room, booked=1).count(), 3)
+        # One overlapping night is enough to refuse, and nothing is booked then
+        with self.assertRaises(RoomUnavailable):
+            allocate_room(self.room, self.check_out - timedelta(days=1), self.check_out + timedelta(days=2))
+        self.assertFalse(RoomNight.objects.filter(date__gte=self.check_out).exclude(booked=0).exists())
+        self.assertFalse(available_hotels(self.check_in, self.check_out).exists())
+        # check_out is not a night of the stay
+        self.assertTrue(available_hotels(self.check_out, self.check_out + timedelta(days=1)).exists())
+
+        release_room(self.room, self.check_in, self.check_out)
+        self.assertFalse(RoomNight.objects.exclude(booked=0).exists())
+        self.assertTrue(available_hotels(self.check_in, self.check_out).exists())
+
+    def test_booking_a_room_twice_is_refused(self):
+        self.assertEqual(self.book().status_code, 302)
+        booking = Booking.objects.get()
+        self.assertEqual((booking.room, booking.hotel, booking.total_price), (self.room, self.hotel, 300))
+        self.assertRedirects(self.book(), f'/booking/room/{self.room.pk}/', fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 1)
+
+        self.assertTrue(cancel_booking(booking))
+        self.assertEqual(self.book().status_code, 302)
+        self.assertEqual(Booking.objects.filter(status='confirmed').count(), 1)
+
+    def test_a_cancelled_booking_cannot_be_paid(self):
+        self.book()
+        booking = Booking.objects.get()
+        self.assertTrue(cancel_booking(booking))
+        self.client.post(f'/payment/{booking.pk}/', {'payment_method': 'card'})
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'cancelled')
+        self.assertEqual(OrderSummary.objects.get(booking=booking).status, 'cancelled')
+        # The released night goes to the next guest, and only once
+        self.assertEqual(self.book().status_code, 302)
+        self.assertEqual(Booking.objects.filter(status='confirmed').count(), 1)
+        self.assertEqual(RoomNight.objects.filter(booked=1).count(), 3)
+
+    def test_completed_bookings_and_ended_stays_cannot_be_cancelled(self):
+        self.book()
+        booking = Booking.objects.get()
+        allocate_room(self.room, date(2020, 5, 1), date(2020, 5, 3))
+        ended = Booking.objects.create(
+            user=self.user, booking_type='hotel', hotel=self.hotel, room=self.room, status='confirmed',
+            check_in_date=date(2020, 5, 1), check_out_date=date(2020, 5, 3),
+        )
+        Booking.objects.filter(pk=booking.pk).update(status='completed')
+        order_summaries.refresh([booking.pk])
+        self.assertNotContains(self.client.get('/orders/'), 'cancel/')
+
+        for stale in (booking, ended):
+            response = self.client.post(f'/orders/{stale.pk}/cancel/')
+            self.assertRedirects(response, '/orders/', fetch_redirect_response=False)
+            stale.refresh_from_db()
+            self.assertNotEqual(stale.status, 'cancelled')
+        # Neither the finished nor the past nights went back on sale
+        self.assertEqual(RoomNight.objects.filter(booked=1).count(), 5)
+
+        Booking.objects.filter(pk=booking.pk).update(status='confirmed')
+        order_summaries.refresh([booking.pk])
+        self.assertContains(self.client.get('/orders/'), f'/orders/{booking.pk}/cancel/')
+
+    def test_hotel_booking_without_a_room_is_refused(self):
+        for _ in range(3):
+            self.book('hotel', self.hotel.pk)
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(RoomNight.objects.exists())
+        self.book('hotel', self.hotel.pk, room_id=self.room.pk)
+        self.assertEqual(Booking.objects.get().room, self.room)
+
+    def test_more_guests_than_the_room_takes_are_refused(self):
+        self.book(number_of_guests=9)
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(RoomNight.objects.exists())
+        [line] = pricing.quote([pricing.Quote('room', self.room.pk, self.check_in, self.check_out, 3)])
+        self.assertIsNotNone(line.error)
+        with self.assertRaises(pricing.PricingError):
+            pricing.checkout(self.user, [line])
+
+
+@override_settings(BOOKING_INTAKE='queued')
+class BookingIntakeTests(TestCase):
+    def setUp(self):
+        location = Location.objects.create(name='Đà Nẵng')
+        hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+        self.room = Room.objects.create(hotel=hotel, name='Deluxe', price=100, capacity=2, units=1)
+        self.user = User.objects.create_user('guest', password='secret')
+        self.client.force_login(self.user)
+
+    def request_booking(self, **data):
+        data = {'check_in_date': date(2030, 5, 1), 'check_out_date': date(2030, 5, 4), 'number_of_guests': 1, **data}
+        response = self.client.post(f'/booking/room/{self.room.pk}/', data)
+        booking_request = BookingRequest.objects.latest('id')
+        self.assertRedirects(
+            response, f'/booking/requests/{booking_request.reference}/', fetch_redirect_response=False,
+        )
+        return booking_request
+
+    def poll(self, booking_request):
+        return self.client.get(f'/booking/requests/{booking_request.reference}/', {'format': 'json'}).json()
+
+    def test_requests_wait_in_the_queue_until_a_worker_books_them(self):
+        first = self.request_booking()
+        second = self.request_booking()
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.poll(second), {
+            'reference': str(second.reference), 'status': 'queued', 'booking_id': None, 'error': None,
+            'queued_ahead': 1,
+        })
+
+        self.assertEqual(intake.process_batch(), 2)
+        booking = Booking.objects.get()
+        self.assertEqual((booking.user, booking.room, booking.total_price), (self.user, self.room, 300))
+        self.assertEqual(OrderSummary.objects.get(booking=booking).status, booking.status)
+        data = self.poll(first)
+        self.assertEqual(
+            (data['status'], data['booking_id'], data['payment_url']), ('done', booking.pk, f'/payment/{booking.pk}/'),
+        )
+        # The room had one unit; the later request fails on its own without undoing the first
+        data = self.poll(second)
+        self.assertEqual((data['status'], data['booking_id']), ('failed', None))
+        self.assertTrue(data['error'])
+        self.assertEqual(intake.process_batch(), 0)
+
+    def test_batches_take_the_oldest_requests(self):
+        requests = [self.request_booking(check_in_date=date(2030, 5, day), check_out_date=date(2030, 5, day + 1))
+                    for day in range(1, 6)]
+        self.assertEqual(intake.process_batch(batch_size=2), 2)
+        self.assertEqual(
+            [booking_request.status for booking_request in BookingRequest.objects.order_by('id')],
+            ['done', 'done', 'queued', 'queued', 'queued'],
+        )
+        call_command('process_booking_queue', once=True, batch_size=2, stdout=io.StringIO())
+        self.assertEqual(Booking.objects.count(), len(requests))
+
+    def test_other_visitors_cannot_see_a_request(self):
+        booking_request = self.request_booking()
+        self.client.force_login(User.objects.create_user('other', password='secret'))
+        self.assertEqual(self.client.get(f'/booking/requests/{booking_request.reference}/').status_code, 404)
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Nẵng Plaza', location=self.location, description='', price=100)
+        typeahead.rebuild()
+
+    def labels(self, query, kinds=typeahead.KINDS):
+        return [row['label'] for row in typeahead.suggest(query, kinds)]
+
+    def test_any_word_starts_a_match_and_locations_come_first(self):
+        self.assertEqual(self.labels('nang'), ['Đà Nẵng', 'Nẵng Plaza'])
+        self.assertEqual(self.labels('Pla'), ['Nẵng Plaza'])
+        self.assertEqual(self.labels('nang', ['hotel']), ['Nẵng Plaza'])
+        response = self.client.get('/autocomplete/', {'q': 'da n', 'type': 'location'})
+        self.assertEqual(
+            response.json()['results'], [{'type': 'location', 'id': self.location.pk, 'label': 'Đà Nẵng'}],
+        )
+
+    def test_saves_and_deletes_edit_the_index_in_place(self):
+        entries = typeahead._entries['hotel']
+        self.hotel.name = 'Sông Hàn'
+        self.hotel.save()
+        self.assertIs(typeahead._entries['hotel'], entries)
+        self.assertEqual(self.labels('plaza'), [])
+        self.assertEqual(self.labels('han'), ['Sông Hàn'])
+        self.hotel.delete()
+        self.assertEqual(self.labels('song'), [])
+        self.assertEqual(typeahead._entries['hotel'], [])
+
+    def test_a_stale_index_is_reloaded_once_in_the_background(self):
+        release = threading.Event()
+        loads = []
+
+        def slow_load():
+            loads.append(1)
+            release.wait(5)
+            return {'location': [], 'hotel': [('moi', self.hotel.pk)]}, {('hotel', self.hotel.pk): {'label': 'Mới'}}
+
+        typeahead._built_at -= typeahead.REBUILD_INTERVAL + 1
+        with mock.patch('home.typeahead._load', slow_load):
+            # Callers keep answering from the current index while one thread loads
+            results = [self.labels('plaza') for _ in range(5)]
+            self.assertEqual(results, [['Nẵng Plaza']] * 5)
+            # An edit made meanwhile survives the reload
+            self.hotel.name = 'Nẵng Plaza Mới'
+            self.hotel.save()
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'typeahead-rebuild':
+                    thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(self.labels('plaza'), ['Nẵng Plaza Mới'])
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=self.location, description='', price=100)
+
+    def found(self, query, item_type='hotel'):
+        return [obj.pk for obj in search_index.search_page(query, item_type)]
+
+    def test_diacritics_are_folded_and_terms_match_as_prefixes(self):
+        self.assertEqual(self.found('da nang'), [self.hotel.pk])
+        self.assertEqual(self.found('Bien Xa'), [self.hotel.pk])
+        self.assertEqual(self.found('hue'), [])
+        self.assertEqual(self.found('da nang', 'location'), [self.location.pk])
+
+    def test_index_follows_saves_renames_and_deletes(self):
+        self.hotel.name = 'Sông Hàn'
+        self.hotel.save()
+        self.assertEqual(self.found('bien'), [])
+        self.assertEqual(self.found('song han'), [self.hotel.pk])
+        # A rename rewrites the documents of everything at the location
+        self.location.name = 'Hội An'
+        self.location.save()
+        self.assertEqual(self.found('da nang'), [])
+        self.assertEqual(self.found('hoi an'), [self.hotel.pk])
+        self.hotel.delete()
+        self.assertEqual(self.found('song han'), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid, item_type, item_id FROM {search_index.TABLE}")
+            row = (search_index.rowid_for('location', self.location.pk), 'location', self.location.pk)
+            self.assertEqual(cursor.fetchall(), [row])
+
+    def test_only_a_rename_rewrites_the_documents_at_a_location(self):
+        for i in range(4):
+            Hotel.objects.create(name=f'Hotel {i}', location=self.location, description='', price=100)
+        self.location.description = 'Thành phố biển'
+        with mock.patch.object(search_index, 'index_dependents') as index_dependents:
+            self.location.save()
+        index_dependents.assert_not_called()
+
+        self.location.name = 'Hội An'
+        with mock.patch.object(search_index, 'index_objects', wraps=search_index.index_objects) as index_objects:
+            search_index.index_dependents(self.location, batch_size=2)
+        self.assertEqual([len(call.args[0]) for call in index_objects.call_args_list], [2, 2, 1])
+        self.location.save()
+        self.assertEqual(len(self.found('hoi an')), 5)
+
+    def test_the_same_id_of_another_type_is_another_row(self):
+        tour = Tour.objects.create(
+            pk=self.hotel.pk, name='Biển Xanh', location=self.location, description='', price=50, duration='1 day',
+        )
+        search_index.rebuild()
+        search_index.remove_object(self.hotel)
+        self.assertEqual(self.found('bien'), [])
+        self.assertEqual(self.found('bien', 'tour'), [tour.pk])
+
+
+class PromotionTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.percent = Promotion.objects.create(
+            title='Hè', description='', promo_code='HE10', discount_percent=10, promotion_type='hotel',
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        self.amount = Promotion.objects.create(
+            title='Giảm', description='', promo_code='GIAM500', discount_amount=500,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        self.upcoming = Promotion.objects.create(
+            title='Tết', description='', promo_code='TET', discount_percent=20,
+            start_date=now + timedelta(days=3), end_date=now + timedelta(days=9),
+        )
+
+    def apply(self, promo_code, **data):
+        return self.client.post('/apply-promotion/', dict(data, promo_code=promo_code))
+
+    def test_index_holds_running_promotions_until_the_next_boundary(self):
+        self.assertEqual(promo_resolver.active('hotel'), [self.percent, self.amount])
+        self.assertEqual(promo_resolver.active('flight'), [self.amount])
+        self.assertIsNone(promo_resolver.by_code('HE10', 'flight'))
+        self.assertIsNone(promo_resolver.by_code('TET'))
+        index = promo_resolver._current()
+        self.assertEqual(index.expires, self.percent.end_date)
+        self.assertFalse(index.is_fresh(self.percent.end_date))
+        # Saving a promotion rebuilds the index
+        self.upcoming.start_date = timezone.now() - timedelta(minutes=1)
+        self.upcoming.save()
+        self.assertEqual(promo_resolver.by_code('TET'), self.upcoming)
+
+    def test_discount_never_exceeds_the_price(self):
+        self.assertEqual(promo_resolver.discount_for(self.percent, 1000), 100)
+        self.assertEqual(promo_resolver.discount_for(self.amount, 300), 300)
+        self.assertEqual(promo_resolver.discount_for(self.amount, -500), 0)
+
+    def test_apply_promotion_prices_the_item_on_the_server(self):
+        location = Location.objects.create(name='Đà Nẵng')
+        hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+        room = Room.objects.create(hotel=hotel, name='Deluxe', price=1000, capacity=4)
+        stay = {'item_type': 'room', 'item_id': room.pk, 'check_in_date': '2030-05-01', 'check_out_date': '2030-05-03'}
+        # Two nights for three guests; whatever price the client sends is ignored
+        data = self.apply('HE10', number_of_guests=3, item_price='NaN', **stay).json()
+        self.assertEqual(
+            [Decimal(data[key]) for key in ('base_price', 'discount', 'new_price')], [6000, 600, 5400],
+        )
+        [line] = pricing.quote([pricing.Quote.from_dict(dict(stay, number_of_guests=3, promo_code='HE10'))])
+        self.assertEqual(Decimal(data['new_price']), line.total_price)
+        # The booking page quotes its summary the same way
+        self.client.force_login(User.objects.create_user('guest'))
+        response = self.client.get(f'/booking/room/{room.pk}/')
+        self.assertContains(response, f'{{"item_type": "room", "item_id": {room.pk}}}')
+
+        self.assertEqual(
+            self.apply('HE10', item_type='flight', item_id=1).json()['message'], 'Không tìm thấy dịch vụ.',
+        )
+        self.assertFalse(self.apply('NOPE', **stay).json()['success'])
+        for data in ({'item_type': 'room', 'item_id': 'x'}, {'item_type': 'boat', 'item_id': 1}):
+            with self.subTest(data=data):
+                response = self.apply('HE10', **data)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+
+class OrderSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='secret')
+        location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+        self.room = Room.objects.create(hotel=self.hotel, name='Deluxe', price=100)
+        self.booking = Booking.objects.create(
+            user=self.user, booking_type='hotel', hotel=self.hotel, room=self.room, total_price=200,
+            check_in_date=date(2030, 5, 1), check_out_date=date(2030, 5, 3), status='confirmed',
+        )
+        self.client.force_login(self.user)
+
+    def test_summary_follows_saves_and_cancellation(self):
+        summary = OrderSummary.objects.get()
+        self.assertEqual(
+            (summary.title, summary.status, summary.total_price), ('Biển Xanh - Deluxe', 'confirmed', 200),
+        )
+        self.assertTrue(cancel_booking(self.booking))
+        self.assertEqual(OrderSummary.objects.get().status, 'cancelled')
+        response = self.client.get('/orders/?status=cancelled')
+        self.assertContains(response, 'Biển Xanh - Deluxe')
+        self.assertNotContains(self.client.get('/orders/?status=confirmed'), 'Biển Xanh - Deluxe')
+
+    def test_orders_page_is_one_query_on_the_summaries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/orders/')
+        self.assertFalse([q for q in queries if 'home_booking' in q['sql']])
+
+    def test_migration_backfills_existing_bookings(self):
+        RoomImage.objects.create(room=self.room, image='rooms/a.jpg', image_variants={'source': 'rooms/a.jpg'})
+        order_summaries.refresh([self.booking.pk])
+        fields = [field.attname for field in OrderSummary._meta.concrete_fields]
+        expected = OrderSummary.objects.values_list(*fields).get()
+        OrderSummary.objects.all().delete()
+        self.assertNotContains(self.client.get('/orders/'), 'Biển Xanh - Deluxe')
+
+        # Run against the models as they were at that migration, as migrate does
+        state = MigrationLoader(connection).project_state(('home', '0020_backfill_order_summaries'))
+        migration = importlib.import_module('home.migrations.0020_backfill_order_summaries')
+        migration.summarize_bookings(state.apps, None)
+        self.assertEqual(OrderSummary.objects.values_list(*fields).get(), expected)
+        self.assertContains(self.client.get('/orders/'), 'Biển Xanh - Deluxe')
+
+    def test_media_collection_keeps_summary_thumbnails(self):
+        variants = {'variants': [{'webp': 'cas/aa/old.webp', 'jpeg': 'cas/aa/old.jpg'}]}
+        OrderSummary.objects.update(thumbnail='cas/aa/old.png', thumbnail_variants=variants)
+        self.assertLessEqual({'cas/aa/old.png', 'cas/aa/old.webp', 'cas/aa/old.jpg'}, referenced_names())
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Đà Nẵng')
+        # Repeated prices, so the id has to break ties between pages
+        self.hotels = [
+            Hotel.objects.create(name=f'Hotel {i}', location=self.location, description='', price=100 + i % 3 * 50)
+            for i in range(25)
+        ]
+
+    def walk(self, ordering, page_size):
+        seen, cursor = [], None
+        while True:
+            page = paginate(Hotel.objects.all(), ordering, cursor, page_size=page_size)
+            seen.append([hotel.pk for hotel in page])
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for ordering in [('price', 'id'), ('-price', '-id'), ('-price', 'id')]:
+            with self.subTest(ordering):
+                pages = self.walk(ordering, page_size=4)
+                self.assertEqual([len(page) for page in pages], [4] * 6 + [1])
+                expected = Hotel.objects.order_by(*ordering).values_list('pk', flat=True)
+                self.assertEqual(sum(pages, []), list(expected))
+
+    def test_later_pages_are_bounded_by_the_cursor_not_an_offset(self):
+        first = paginate(Hotel.objects.all(), ('price', 'id'), page_size=4)
+        with CaptureQueriesContext(connection) as queries:
+            list(paginate(Hotel.objects.all(), ('price', 'id'), first.next_cursor, page_size=4))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+        self.assertIn('LIMIT 5', queries[0]['sql'])
+
+    def test_broken_cursors_are_rejected(self):
+        for cursor in [
+            'not base64!', encode_cursor([100]), encode_cursor({'price': 100}),
+            # Well-formed, but the values do not fit the fields
+            encode_cursor(['abc', 'x']), encode_cursor([100, {'id': 1}]), encode_cursor([None, None]),
+        ]:
+            with self.subTest(cursor), self.assertRaises(InvalidCursor):
+                paginate(Hotel.objects.all(), ('price', 'id'), cursor)
+        self.assertEqual(self.client.get('/hotels/', {'cursor': 'bm9wZQ'}).status_code, 400)
+        self.assertEqual(self.client.get('/hotels/', {'cursor': encode_cursor(['abc', 'x'])}).status_code, 400)
+        self.assertEqual(
+            self.client.get('/flights/', {'cursor': encode_cursor(['tomorrow', 1])}).status_code, 400,
+        )
+
+    def test_infinite_scroll_fetches_rendered_pages(self):
+        def names(data):
+            return set(re.findall(r'Hotel \d+', data['html']))
+
+        listed = Hotel.objects.order_by('price', 'id').values_list('name', flat=True)
+        data = self.client.get('/hotels/', {'format': 'json'}).json()
+        self.assertEqual(names(data), set(listed[:PAGE_SIZE]))
+        data = self.client.get('/hotels/', {'format': 'json', 'cursor': data['next_cursor']}).json()
+        self.assertEqual(names(data), set(listed[PAGE_SIZE:]))
+        self.assertIsNone(data['next_cursor'])
+
+
+class PriceStatisticsTests(TestCase):
+    def setUp(self):
+        self.hanoi = Location.objects.create(name='Hà Nội')
+        self.danang = Location.objects.create(name='Đà Nẵng')
+
+    def hotel(self, location, price):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Hotel.objects.create(name='Hotel', location=location, description='', price=price)
+
+    def summary(self, location=None):
+        statistic = price_stats.get('hotel', location and location.pk)
+        return statistic.min_price, statistic.max_price, statistic.count
+
+    def test_saves_keep_location_and_category_rows_current(self):
+        cheap = self.hotel(self.hanoi, 400000)
+        self.hotel(self.hanoi, 1500000)
+        self.hotel(self.danang, 6000000)
+        self.assertEqual(self.summary(self.hanoi), (400000, 1500000, 2))
+        self.assertEqual(self.summary(), (400000, 6000000, 3))
+        self.assertEqual(price_stats.get('hotel').histogram, [1, 0, 1, 0, 0, 1, 0, 0, 0])
+
+        # A move changes the statistics of the old location as well as the new one
+        cheap.location = self.danang
+        with self.captureOnCommitCallbacks(execute=True):
+            cheap.save()
+        self.assertEqual(self.summary(self.hanoi), (1500000, 1500000, 1))
+        self.assertEqual(self.summary(self.danang), (400000, 6000000, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Hotel.objects.filter(location=self.hanoi).get().delete()
+        self.assertEqual(self.summary(self.hanoi), (None, None, 0))
+        self.assertEqual(self.summary(), (400000, 6000000, 2))
+
+    def test_there_is_one_category_wide_row(self):
+        self.hotel(self.hanoi, 400000)
+        self.assertEqual(PriceStatistic.objects.filter(category='hotel', location=None).count(), 1)
+        # The per-location constraint treats NULL locations as distinct; this one does not
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PriceStatistic.objects.create(category='hotel', location=None, histogram=[])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PriceStatistic.objects.create(category='hotel', location=self.hanoi, histogram=[])
+        PriceStatistic.objects.create(category='tour', location=None, histogram=[])
+        price_stats.refresh('hotel')
+        self.assertEqual(self.summary(), (400000, 400000, 1))
+
+    def test_lookups_are_one_query(self):
+        self.hotel(self.hanoi, 400000)
+        price_stats.get('hotel')
+        with self.assertNumQueries(1):
+            price_stats.get('hotel', self.hanoi.pk)
+        with self.assertNumQueries(1):
+            price_stats.get('hotel')
+
+    def test_bulk_changes_are_picked_up_by_a_full_refresh(self):
+        self.hotel(self.hanoi, 400000)
+        Hotel.objects.bulk_create([
+            Hotel(name='Imported', location=self.danang, description='', price=price) for price in (900000, 2500000)
+        ])
+        Hotel.objects.filter(location=self.hanoi).update(location=self.danang)
+        price_stats.refresh('hotel')
+        self.assertEqual(self.summary(self.hanoi), (None, None, 0))
+        self.assertEqual(self.summary(), (400000, 2500000, 3))
+        self.assertEqual(
+            [bucket['count'] for bucket in price_stats.buckets(price_stats.get('hotel', self.danang.pk))],
+            [1, 1, 0, 1, 0, 0, 0, 0, 0],
+        )
+
+
+class HotelListingTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Đà Nẵng')
+
+    def add_hotels(self, count):
+        for i in range(count):
+            hotel = Hotel.objects.create(name=f'Hotel {i}', location=self.location, description='', price=100)
+            HotelImage.objects.create(hotel=hotel, image=f'hotels/{i}-a.jpg')
+            HotelImage.objects.create(hotel=hotel, image=f'hotels/{i}-b.jpg')
+
+    def render_cards(self):
+        with CaptureQueriesContext(connection) as queries:
+            cards = [
+                (hotel.location.name, hotel.first_image, [image.image.name for image in hotel.images.all()])
+                for hotel in Hotel.objects.for_listing()
+            ]
+        return cards, len(queries)
+
+    def test_cards_cost_the_same_queries_for_any_number_of_hotels(self):
+        self.add_hotels(1)
+        cards, one = self.render_cards()
+        self.assertEqual(cards, [('Đà Nẵng', 'hotels/0-a.jpg', ['hotels/0-a.jpg', 'hotels/0-b.jpg'])])
+        self.add_hotels(5)
+        cards, six = self.render_cards()
+        self.assertEqual((len(cards), one, six), (6, 2, 2))
+
+    def test_listing_does_not_read_rooms(self):
+        self.add_hotels(1)
+        self.assertNotIn('home_room', str(Hotel.objects.for_listing().query))
+
+
+class FareCalendarTests(TestCase):
+    def setUp(self):
+        catalog_cache.clear()
+        self.origin = Location.objects.create(name='Hà Nội')
+        self.destination = Location.objects.create(name='Đà Nẵng')
+        self.start = timezone.localdate() + timedelta(days=1)
+        self.cheap = self.flight('VN1', 0, 900, seats=1)
+        self.flight('VN2', 0, 1200)
+        self.flight('VN3', 2, 1500)
+
+    def flight(self, number, day, price, seats=10):
+        departure = timezone.make_aware(datetime.combine(self.start + timedelta(days=day), datetime.min.time()))
+        return FlightTicket.objects.create(
+            flight_number=number, origin=self.origin, destination=self.destination, price=price,
+            departure_time=departure + timedelta(hours=9), arrival_time=departure + timedelta(hours=10),
+            available_seats=seats,
+        )
+
+    def calendar(self):
+        response = self.client.get('/flights/calendar/', {
+            'origin': self.origin.pk, 'destination': self.destination.pk, 'start': self.start, 'days': 3,
+        })
+        return [
+            (day['min_price'] and Decimal(day['min_price']), day['flights']) for day in response.json()['days']
+        ]
+
+    def test_cheapest_bookable_fare_per_day(self):
+        self.assertEqual(self.calendar(), [(900, 2), (None, 0), (1500, 1)])
+        with self.assertNumQueries(0):
+            fare_calendar.fares(self.origin.pk, self.destination.pk, start=self.start, days=3)
+        self.assertEqual(self.client.get('/flights/calendar/', {'origin': 'x'}).status_code, 400)
+
+    def test_seat_sales_and_saves_retire_the_cached_calendar(self):
+        self.calendar()
+        # The last seat goes through update(), which sends no post_save
+        allocate_seats(self.cheap)
+        self.assertEqual(self.calendar(), [(1200, 2), (None, 0), (1500, 1)])
+        # A save in another process, such as import_catalog, bumps the shared version;
+        # this one reads it once its own copy is older than CATALOG_CACHE_VERSION_TTL
+        FlightTicket.objects.filter(flight_number='VN3').update(price=700)
+        catalog_cache.shared().set(catalog_cache._version_key('home.flightticket'), time.time_ns(), None)
+        catalog_cache._versions.clear()
+        self.assertEqual(self.calendar(), [(1200, 2), (None, 0), (700, 1)])
+
+    def test_seat_sales_only_retire_the_calendars_of_their_route(self):
+        other = Location.objects.create(name='Huế')
+        back = FlightTicket.objects.create(
+            flight_number='VN9', origin=self.destination, destination=other, price=500,
+            departure_time=self.cheap.departure_time, arrival_time=self.cheap.arrival_time, available_seats=5,
+        )
+        self.calendar()
+        fare_calendar.fares(back.origin_id, back.destination_id, start=self.start, days=3)
+        featured = views._featured_flights(6)
+
+        allocate_seats(back)
+        with self.assertNumQueries(0):
+            self.calendar()
+            self.assertIs(views._featured_flights(6), featured)
+        with self.assertNumQueries(1):
+            fare_calendar.fares(back.origin_id, back.destination_id, start=self.start, days=3)
+
+
+class CatalogImportTests(TestCase):
+    columns = ['external_id', 'name', 'location', 'location_id', 'description', 'price', 'stars']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'hotels.csv')
+        self.location = Location.objects.create(name='Đà Nẵng', external_id='loc-dn')
+
+    def write(self, rows):
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, self.columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def hotel(self, external_id, **values):
+        return dict({'external_id': external_id, 'name': external_id, 'location': 'loc-dn', 'description': '',
+                     'price': '100', 'stars': '4'}, **values)
+
+    def run_import(self, **kwargs):
+        errors = []
+        stats = importer.import_feed('hotel', self.path, on_error=lambda line, e: errors.append(line), **kwargs)
+        return stats, errors
+
+    def test_rows_are_upserted_by_external_id(self):
+        self.write([self.hotel('h1'), self.hotel('h2', price='250')])
+        stats, _ = self.run_import()
+        self.assertEqual((stats['imported'], stats['errors']), (2, 0))
+        self.write([self.hotel('h2', price='300', name='Biển Xanh'), self.hotel('h3')])
+        self.run_import()
+        self.assertEqual(
+            list(Hotel.objects.order_by('external_id').values_list('external_id', 'name', 'price')),
+            [('h1', 'h1', 100), ('h2', 'Biển Xanh', 300), ('h3', 'h3', 100)],
+        )
+        self.assertEqual(self.run_import()[0]['skipped'], True)
+
+    def test_bad_rows_are_rejected_and_the_rest_imported(self):
+        self.write([
+            self.hotel('ok', location='', location_id=self.location.pk),
+            self.hotel('missing-location', location='', location_id=self.location.pk + 100),
+            self.hotel('unknown-location', location='loc-hue'),
+            self.hotel('bad-stars', stars='9'),
+            self.hotel('long-name', name='x' * 201),
+            self.hotel('bad-price', price='12345678901'),
+            self.hotel('not-a-number', price='abc'),
+        ])
+        stats, errors = self.run_import()
+        self.assertEqual((stats['imported'], stats['errors']), (1, 6))
+        self.assertEqual(errors, [2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(Hotel.objects.values_list('external_id', flat=True)), ['ok'])
+
+    def test_malformed_json_lines_are_row_errors(self):
+        self.path = self.path.replace('.csv', '.jsonl')
+        hotels = [json.dumps(self.hotel(f'h{i}')) for i in range(3)]
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(['{"external_id": "h', hotels[0], '', hotels[1], '{"name": }', hotels[2]]) + '\n')
+        reported = []
+        stats = importer.import_feed('hotel', self.path, on_error=lambda line, e: reported.append((line, str(e))))
+        self.assertEqual((stats['imported'], stats['errors'], stats['rows']), (3, 2, 5))
+        self.assertEqual([line for line, _ in reported], [1, 4])
+        self.assertIn('invalid JSON at line 5, column 10', reported[1][1])
+        self.assertEqual(Hotel.objects.count(), 3)
+        self.assertTrue(ImportCheckpoint.objects.get(feed=self.path).completed)
+
+    def test_an_interrupted_import_resumes_after_its_last_batch(self):
+        self.write([self.hotel(f'h{i}') for i in range(5)])
+        calls = []
+        build = importer.FeedImporter.build
+
+        def crash_on_fourth(feed, row):
+            calls.append(row['external_id'])
+            if len(calls) == 4:
+                raise KeyboardInterrupt
+            return build(feed, row)
+
+        with mock.patch.object(importer.FeedImporter, 'build', crash_on_fourth):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import(batch_size=2)
+        self.assertEqual(Hotel.objects.count(), 2)
+        stats, _ = self.run_import(batch_size=2)
+        self.assertEqual((stats['resumed_at'], stats['imported'], Hotel.objects.count()), (2, 3, 5))
+
+
+class BookingExportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.guest = User.objects.create(username='=HYPERLINK("http://example.com")')
+        location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+        self.tour = Tour.objects.create(name='@Hội An', location=location, description='', price=50, duration='1 day')
+
+    def book(self, **values):
+        return Booking.objects.create(user=self.guest, **values)
+
+    def export(self, **params):
+        response = self.client.get('/exports/bookings/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_rows_are_joined_with_user_and_item(self):
+        booking = self.book(booking_type='hotel', hotel=self.hotel, special_requests='-1+1', total_price=Decimal('-5'))
+        rows = list(csv.DictReader(self.export().splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], str(booking.pk))
+        self.assertEqual(rows[0]['item_name'], 'Biển Xanh')
+        # Customer-typed text cannot run as a formula; numbers are left alone
+        self.assertEqual(rows[0]['username'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(rows[0]['special_requests'], "'-1+1")
+        self.assertEqual(rows[0]['total_price'], '-5.00')
+
+    def test_filters_by_status_and_type(self):
+        self.book(booking_type='hotel', hotel=self.hotel, status='cancelled')
+        tour = self.book(booking_type='tour', tour=self.tour, status='confirmed')
+        lines = self.export(format='jsonl', status='confirmed').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [tour.pk])
+        # JSONL is not opened by spreadsheets and keeps the value as stored
+        self.assertEqual(json.loads(lines[0])['item_name'], '@Hội An')
+        self.assertEqual(self.export(type='flight').splitlines()[1:], [])
+
+    def test_rows_come_from_one_query(self):
+        for _ in range(5):
+            self.book(booking_type='hotel', hotel=self.hotel)
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(exports.rows(exports.bookings(), chunk_size=2))
+        self.assertEqual((len(rows), len(queries)), (5, 1))
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/exports/bookings/', {'format': 'xlsx'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/bookings/', {'start': '18/10/2026'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/bookings/', {'status': 'lost'}).status_code, 400)
+
+
+class FileServingTests(TestCase):
+    hashed = 'cas/ab/' + 'ab' * 32 + '.css'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.body = b'body { color: red; }' * 10
+        self.write(self.hashed, self.body)
+        self.write(self.hashed + '.gz', b'gzip bytes')
+        self.write(self.hashed + '.br', b'brotli bytes')
+        settings = override_settings(MEDIA_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def get(self, name, **headers):
+        response = self.client.get(f'/media/{name}', headers=headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_hashed_files_are_immutable_and_revalidate_by_etag(self):
+        response, content = self.get(self.hashed)
+        self.assertEqual((response.status_code, content), (200, self.body))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], '"' + 'ab' * 32 + '"')
+        response, content = self.get(self.hashed, if_none_match=response['ETag'])
+        self.assertEqual((response.status_code, content), (304, b''))
+
+    def test_byte_ranges(self):
+        response, content = self.get(self.hashed, range='bytes=5-9')
+        self.assertEqual((response.status_code, content), (206, self.body[5:10]))
+        self.assertEqual(response['Content-Range'], f'bytes 5-9/{len(self.body)}')
+        response, content = self.get(self.hashed, range='bytes=-4')
+        self.assertEqual(content, self.body[-4:])
+        response, _ = self.get(self.hashed, range=f'bytes={len(self.body)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.body)}'))
+        # A range of a representation the client no longer has is answered with all of it
+        response, content = self.get(self.hashed, range='bytes=5-9', if_range='"stale"')
+        self.assertEqual((response.status_code, content), (200, self.body))
+
+    def test_precompressed_variants_follow_accept_encoding(self):
+        cases = [
+            ('gzip, deflate, br', 'br', b'brotli bytes'),
+            ('br;q=0, gzip', 'gzip', b'gzip bytes'),
+            ('br;q=0.5, gzip;q=0.8', 'gzip', b'gzip bytes'),
+            ('*;q=0.1, br;q=0', 'gzip', b'gzip bytes'),
+            ('gzip;q=0, br;q=0', None, self.body),
+            ('identity', None, self.body),
+            ('', None, self.body),
+        ]
+        for accept_encoding, encoding, body in cases:
+            with self.subTest(accept_encoding):
+                response, content = self.get(self.hashed, accept_encoding=accept_encoding)
+                self.assertEqual((response.get('Content-Encoding'), content), (encoding, body))
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_missing_and_temporary_files_are_not_found(self):
+        self.write('cas/ab/.upload-x1y2z3', b'half an upload')
+        self.assertEqual(self.get('cas/ab/.upload-x1y2z3')[0].status_code, 404)
+        self.assertEqual(self.get('cas/ab/missing.css')[0].status_code, 404)
+        self.assertEqual(self.get('cas/ab')[0].status_code, 404)
+
+
+def image_upload(name, size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=location, description='', price=100)
+
+    def upload(self, size):
+        # The worker pool is left out; generate() is what it runs
+        with self.captureOnCommitCallbacks(execute=False):
+            image = HotelImage.objects.create(hotel=self.hotel, image=image_upload('beach.jpg', size))
+        data = images.generate(HotelImage, image.pk)
+        image.refresh_from_db()
+        return image, data
+
+    def test_variants_are_stored_with_their_dimensions(self):
+        image, data = self.upload((2400, 1200))
+        self.assertEqual(image.image_variants, data)
+        self.assertEqual((data['source'], data['width'], data['height']), (image.image.name, 2400, 1200))
+        self.assertEqual(
+            [(variant['name'], variant['width'], variant['height']) for variant in data['variants']],
+            [('thumb', 160, 80), ('card', 640, 320), ('hero', 1600, 800)],
+        )
+        for variant in data['variants']:
+            for extension, image_format in images.FORMATS:
+                with default_storage.open(variant[extension]) as f:
+                    stored = Image.open(f)
+                    size = (variant['width'], variant['height'])
+                    self.assertEqual((stored.format, stored.size), (image_format, size))
+
+    def test_derivatives_are_known_by_their_stored_names(self):
+        image, data = self.upload((800, 600))
+        names = images.stored_paths(data)
+        self.assertTrue(names and all(is_hashed(name) for name in names))
+        # The same pixels are the same files: rebuilding neither deletes nor renames anything
+        with mock.patch.object(default_storage, 'delete') as delete:
+            self.assertEqual(images.build(image.image.name), data)
+        delete.assert_not_called()
+
+    def test_small_uploads_are_never_upscaled(self):
+        _, data = self.upload((300, 200))
+        self.assertEqual(
+            [(variant['name'], variant['width']) for variant in data['variants']], [('thumb', 160), ('card', 300)],
+        )
+
+    def test_templates_pick_the_smallest_variant_that_fits(self):
+        image, data = self.upload((2400, 1200))
+        thumb, card, hero = data['variants']
+        self.assertEqual(images.pick(data, 80), thumb)
+        self.assertEqual(images.pick(data, 400), card)
+        self.assertEqual(images.pick(data, 4000), hero)
+        html = Template('{% load media %}{% picture image.image image.image_variants 400 alt="Biển" %}').render(
+            Context({'image': image}),
+        )
+        self.assertIn(f'src="{default_storage.url(card["jpeg"])}"', html)
+        self.assertIn('width="640" height="320"', html)
+        self.assertIn(f'{default_storage.url(hero["webp"])} 1600w', html)
+        # Before the worker has run, the original is shown
+        html = Template('{% load media %}{% picture name None 400 %}').render(Context({'name': 'hotels/a.jpg'}))
+        self.assertEqual(html, f'<img src="{default_storage.url("hotels/a.jpg")}">')
+
+    def test_uploads_are_built_after_commit_and_only_once(self):
+        with mock.patch.object(images, 'executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                image = HotelImage.objects.create(hotel=self.hotel, image=image_upload('beach.jpg', (800, 600)))
+            executor.return_value.submit.assert_called_once_with(images._run, HotelImage, image.pk)
+            images.generate(HotelImage, image.pk)
+            image.refresh_from_db()
+            executor.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                image.save()
+            executor.return_value.submit.assert_not_called()
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(MEDIA_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.location = Location.objects.create(name='Đà Nẵng')
+        self.hotel = Hotel.objects.create(name='Biển Xanh', location=self.location, description='', price=100)
+
+    def stored_files(self):
+        return sorted(name for name, _ in default_storage.walk())
+
+    def test_identical_uploads_share_one_hashed_file(self):
+        data = b'the same photo'
+        digest = hashlib.sha256(data).hexdigest()
+        first = HotelImage.objects.create(hotel=self.hotel, image=SimpleUploadedFile('tải xuống.JPG', data))
+        self.location.image = SimpleUploadedFile('other name.jpg', data)
+        self.location.save()
+        self.assertEqual(first.image.name, f'cas/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(self.location.image.name, first.image.name)
+        self.assertEqual(self.stored_files(), [first.image.name])
+        self.assertEqual(first.image.url, f'/media/{first.image.name}')
+
+        # Shared files stay when a row goes; collect_media reclaims them
+        first.delete()
+        self.assertTrue(default_storage.exists(self.location.image.name))
+
+    def test_collect_media_removes_old_unreferenced_files(self):
+        kept = HotelImage.objects.create(hotel=self.hotel, image=SimpleUploadedFile('a.jpg', b'kept')).image.name
+        orphan = default_storage.save('x.jpg', ContentFile(b'orphan'))
+        young = default_storage.save('y.jpg', ContentFile(b'just uploaded'))
+        old = time.time() - 7200
+        for name in (kept, orphan):
+            os.utime(default_storage.path(name), (old, old))
+
+        call_command('collect_media', dry_run=True, stdout=io.StringIO())
+        self.assertEqual(len(self.stored_files()), 3)
+        out = io.StringIO()
+        call_command('collect_media', stdout=out)
+        self.assertIn('Removed 1 of 2 files', out.getvalue())
+        self.assertEqual(self.stored_files(), sorted([kept, young]))
+
+    def test_rehash_media_moves_legacy_uploads(self):
+        legacy = os.path.join(self.root, 'hotels', 'tải_xuống_1.jpg')
+        os.makedirs(os.path.dirname(legacy))
+        with open(legacy, 'wb') as f:
+            f.write(b'legacy photo')
+        image = HotelImage.objects.create(hotel=self.hotel, image='hotels/tải_xuống_1.jpg')
+        call_command('rehash_media', stdout=io.StringIO())
+        image.refresh_from_db()
+        self.assertTrue(is_hashed(image.image.name))
+        with default_storage.open(image.image.name) as f:
+            self.assertEqual(f.read(), b'legacy photo')
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # A file-copy replica synced a minute ago; routing only looks at its modification time
+        self.replica = os.path.join(directory.name, 'db.replica1.sqlite3')
+        open(self.replica, 'wb').close()
+        self.synced_at = time.time() - 60
+        os.utime(self.replica, (self.synced_at, self.synced_at))
+        databases = mock.patch.dict(settings.DATABASES, replica1={
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.replica,
+        })
+        databases.start()
+        self.addCleanup(databases.stop)
+        replicas = override_settings(REPLICA_DATABASES=['replica1'])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    def route(self, path, method='get', last_write=None, write=False):
+        # Runs the middleware around a view that reports where its reads would go
+        request = getattr(RequestFactory(), method)(path)
+        if last_write is not None:
+            request.COOKIES[routers.COOKIE_NAME] = str(last_write)
+        request.resolver_match = resolve(path)
+        router = routers.ReplicaRouter()
+        seen = {}
+
+        def view(request):
+            if write:
+                router.db_for_write(Booking)
+            seen['hotel'] = router.db_for_read(Hotel)
+            seen['booking'] = router.db_for_read(Booking)
+            return HttpResponse()
+
+        def get_response(request):
+            # The handler calls process_view from inside the middleware chain
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = routers.ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return seen, response.cookies.get(routers.COOKIE_NAME)
+
+    def test_catalog_reads_of_browse_pages_go_to_a_replica(self):
+        seen, cookie = self.route('/hotels/')
+        self.assertEqual(seen, {'hotel': 'replica1', 'booking': None})
+        self.assertIsNone(cookie)
+        # Pages outside READ_VIEWS, and anything after the request, stay on the primary
+        self.assertEqual(self.route('/orders/')[0], {'hotel': None, 'booking': None})
+        self.assertEqual(routers.read_alias(), 'default')
+
+    def test_a_visitor_who_wrote_stays_on_the_primary_until_the_next_sync(self):
+        _, cookie = self.route('/checkout/', method='post')
+        last_write = float(cookie.value)
+        self.assertEqual(self.route('/hotels/', last_write=last_write)[0]['hotel'], None)
+        # A write made by a GET counts as well
+        self.assertIsNotNone(self.route('/hotels/', write=True)[1])
+        # Older writes are in the snapshot already
+        self.assertEqual(self.route('/hotels/', last_write=self.synced_at - 1)[0]['hotel'], 'replica1')
+
+        os.utime(self.replica, (last_write + 1, last_write + 1))
+        self.assertEqual(self.route('/hotels/', last_write=last_write)[0]['hotel'], 'replica1')
+
+    def test_replicas_are_never_migrated(self):
+        router = routers.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica1', 'home'))
+        self.assertTrue(router.allow_migrate('default', 'home'))
+
+
+class AdminChangelistQueryTests(TestCase):
+    # Session, user, row estimate, count and the page. date_hierarchy adds its first and
+    # last date and one probe per day listed; all rows here fall on the same day
+    changelists = {
+        'booking': 8,
+        'flightticket': 8,
+        'hotel': 5,
+        'room': 5,
+        'tour': 5,
+        'cartransfer': 5,
+    }
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.origin = Location.objects.create(name='Hà Nội')
+        self.destination = Location.objects.create(name='Đà Nẵng')
+        self.add_catalog(3)
+
+    def add_catalog(self, count):
+        departure = timezone.now() + timedelta(days=7)
+        start = Booking.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username=f'guest{i}')
+            hotel = Hotel.objects.create(name=f'Hotel {i}', location=self.origin, description='', price=100)
+            room = Room.objects.create(hotel=hotel, name=f'Room {i}', price=100, capacity=2)
+            flight = FlightTicket.objects.create(
+                flight_number=f'VN{i}', origin=self.origin, destination=self.destination,
+                departure_time=departure, arrival_time=departure + timedelta(hours=1), price=100,
+            )
+            tour = Tour.objects.create(name=f'Tour {i}', location=self.origin, description='', price=100, duration='1 day')
+            car = CarTransfer.objects.create(name=f'Car {i}', location=self.origin, description='', price=100)
+            Booking.objects.create(user=user, booking_type='hotel', hotel=hotel, room=room)
+            Booking.objects.create(user=user, booking_type='flight', flight=flight)
+            Booking.objects.create(user=user, booking_type='tour', tour=tour)
+            Booking.objects.create(user=user, booking_type='car', car=car)
+
+    def assertChangelistQueries(self, url, expected):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_changelist_query_counts(self):
+        for model, expected in self.changelists.items():
+            with self.subTest(model=model):
+                self.assertChangelistQueries(f'/admin/home/{model}/', expected)
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        self.add_catalog(20)
+        for model, expected in self.changelists.items():
+            with self.subTest(model=model):
+                self.assertChangelistQueries(f'/admin/home/{model}/', expected)
+
+    def test_autocomplete_filter_loads_only_the_selected_row(self):
+        # The selected location's name replaces the row estimate; no other location is loaded
+        response = self.assertChangelistQueries(f'/admin/home/hotel/?location__id__exact={self.origin.pk}', 5)
+        self.assertContains(response, 'data-field-name="location"')
+        self.assertNotContains(response, f'>{self.destination.name}</option>')
+
+    def test_date_hierarchy_probes_the_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/home/booking/')
+        self.assertFalse([q for q in queries if 'DISTINCT' in q['sql']])
+        today = timezone.localdate()
+        self.assertContains(
+            response, f'?booking_date__day={today.day}&amp;booking_date__month={today.month}&amp;booking_date__year={today.year}'
+        )
+
+    def test_large_unfiltered_changelist_uses_estimated_count(self):
+        with mock.patch('home.admin.EXACT_COUNT_LIMIT', 0), CaptureQueriesContext(connection) as queries:
+            self.client.get('/admin/home/booking/')
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+
+        with mock.patch('home.admin.EXACT_COUNT_LIMIT', 0), CaptureQueriesContext(connection) as queries:
+            self.client.get('/admin/home/booking/?status__exact=pending')
+        self.assertTrue([q for q in queries if 'COUNT(' in q['sql']])
+
+    def test_booking_str_does_not_query(self):
+        booking = Booking.objects.filter(booking_type='flight').first()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(booking), f'Booking by user #{booking.user_id} for flight #{booking.flight_id}')
+        booking = Booking.objects.select_related('user', 'flight').get(pk=booking.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(booking), f'Booking by {booking.user} for flight {booking.flight.flight_number}')
+
+
+@override_settings(QUERY_PROFILER_SAMPLE_RATE=1)
+class QueryProfilerTests(TestCase):
+    def setUp(self):
+        profiler.reset()
+        location = Location.objects.create(name='Hà Nội')
+        self.hotels = [
+            Hotel.objects.create(name=f'Hotel {i}', location=location, description='', price=100) for i in range(4)
+        ]
+
+    def test_repeated_fingerprint_points_at_the_loop(self):
+        profile = profiler.Profile()
+        with connection.execute_wrapper(profile):
+            for hotel in self.hotels:
+                Hotel.objects.get(pk=hotel.pk)
+            Hotel.objects.filter(pk__in=[hotel.pk for hotel in self.hotels[:2]]).count()
+            Hotel.objects.filter(pk__in=[hotel.pk for hotel in self.hotels]).count()
+        [(sql, count, source)] = profile.repeated()
+        self.assertEqual(count, 4)
+        self.assertIn('home_hotel', sql)
+        self.assertRegex(source, r'^home/tests\.py:\d+ in test_repeated_fingerprint_points_at_the_loop$')
+        # Different IN list lengths share a fingerprint
+        self.assertEqual(len(profile.fingerprints), 2)
+
+    def test_server_timing_header_and_report(self):
+        response = self.client.get(f'/detail/hotel/{self.hotels[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+')
+        [row] = profiler.report()
+        self.assertEqual(row['endpoint'], 'GET home:detail')
+        self.assertEqual(row['requests'], 1)
+        self.assertGreater(row['avg_template_ms'], 0)
+
+    @override_settings(QUERY_PROFILER_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_left_alone(self):
+        response = self.client.get(f'/detail/hotel/{self.hotels[0].pk}/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(profiler.report(), [])
+
+    def test_perf_page_is_staff_only(self):
+        self.client.get(f'/detail/hotel/{self.hotels[0].pk}/')
+        self.assertEqual(self.client.get('/_perf/').status_code, 302)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.get('/_perf/?format=json')
+        self.assertIn('GET home:detail', [row['endpoint'] for row in response.json()['endpoints']])
+
+
+class ScaleDataTests(TestCase):
+    counts = {
+        'locations': 5, 'users': 4, 'hotels': 6, 'rooms': 14, 'flights': 40,
+        'tours': 3, 'cars': 3, 'bookings': 60,
+    }
+
+    def seed(self, seed):
+        scale_data.ScaleSeeder(seed=seed, counts=self.counts, batch_size=7, today=date(2026, 1, 1)).run(derived=False)
+
+    def rows(self, model, fields, start=0):
+        return list(model.objects.order_by('pk').values_list(*fields))[start:]
+
+    def test_same_seed_gives_the_same_rows(self):
+        hotel_fields = ('name', 'price', 'stars', 'amenities')
+        booking_fields = ('booking_type', 'booking_date', 'total_price', 'status', 'number_of_guests')
+        self.seed(7)
+        hotels, bookings = self.rows(Hotel, hotel_fields), self.rows(Booking, booking_fields)
+        self.seed(7)
+        self.assertEqual(self.rows(Hotel, hotel_fields, start=len(hotels)), hotels)
+        self.assertEqual(self.rows(Booking, booking_fields, start=len(bookings)), bookings)
+        self.seed(8)
+        self.assertNotEqual(self.rows(Hotel, hotel_fields, start=2 * len(hotels)), hotels)
+
+    def test_generated_rows_hang_together(self):
+        self.seed(1)
+        for name, model in (('hotels', Hotel), ('rooms', Room), ('flights', FlightTicket), ('bookings', Booking)):
+            self.assertEqual(model.objects.count(), self.counts[name])
+        # Rooms are booked with their own hotel, and every booking has its order summary
+        self.assertFalse(Booking.objects.filter(room__isnull=False).exclude(room__hotel=F('hotel')).exists())
+        self.assertEqual(OrderSummary.objects.count(), self.counts['bookings'])
+        dates = list(Booking.objects.order_by('pk').values_list('booking_date', flat=True))
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreater(dates[-1] - dates[0], timedelta(days=300))
+
+    def test_benchmark_runner_reports_every_endpoint(self):
+        scale_data.ScaleSeeder(seed=1, counts=self.counts, batch_size=50).run()
+        report = benchmarks.run(requests=3, warmup=1)
+        self.assertEqual(list(report['results']), list(benchmarks.ENDPOINTS))
+        for result in report['results'].values():
+            self.assertGreater(result['p95_ms'], 0)
+            self.assertGreaterEqual(result['p95_ms'], result['p50_ms'])
+            self.assertGreater(result['queries'], 0)
+        [(name, _, _, queries, _)] = benchmarks.compare(
+            {'results': {'home': report['results']['home']}}, report,
+        )
+        self.assertEqual((name, queries), ('home', 0))
+
+
+class AsyncViewTests(TransactionTestCase):
+    # Transactional: the gathered queries run on other threads' connections
+
+    def setUp(self):
+        scale_data.ScaleSeeder(seed=3, counts=ScaleDataTests.counts, batch_size=50).run()
+        self.factory = RequestFactory()
+
+    def test_async_views_render_the_same_pages(self):
+        hotel = Hotel.objects.order_by('pk').first()
+        flight = FlightTicket.objects.order_by('pk').first()
+        location = hotel.location_id
+        pages = [
+            (views.home, views.home_async, '/', ()),
+            (views.detail, views.detail_async, f'/detail/hotel/{hotel.pk}/', ('hotel', hotel.pk)),
+            (views.detail, views.detail_async, f'/detail/flight/{flight.pk}/', ('flight', flight.pk)),
+            (views.hotel_search, views.hotel_search_async, f'/hotels/?location={location}', ()),
+            (views.tour_search, views.tour_search_async, f'/tours/?location={location}', ()),
+            (views.car_search, views.car_search_async, '/cars/', ()),
+            (views.flight_search, views.flight_search_async,
+             f'/flights/?origin={flight.origin_id}&destination={flight.destination_id}', ()),
+        ]
+        for view, async_view, url, args in pages:
+            with self.subTest(url=url):
+                expected = view(self.factory.get(url), *args)
+                actual = async_to_sync(async_view)(self.factory.get(url), *args)
+                self.assertEqual(actual.status_code, 200)
+                self.assertEqual(actual.content, expected.content)
+
+    def test_gather_runs_loads_at_the_same_time(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def load(name):
+            # Both loads have to be waiting at once for the barrier to open
+            barrier.wait()
+            return Hotel.objects.filter(name__startswith=name).count()
+
+        data = async_to_sync(concurrency.gather)({'a': lambda: load('a'), 'b': lambda: load('b')})
+        self.assertEqual(set(data), {'a', 'b'})
+
+
+class AdmissionControlTests(TestCase):
+    rules = {
+        'checkout': {'methods': ['POST'], 'rate': 1, 'burst': 2},
+        'payment': {'methods': ['POST'], 'concurrency': 1},
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            ADMISSION_CONTROL=True, ADMISSION_RULES=self.rules,
+            ADMISSION_DB=os.path.join(directory.name, 'admission.sqlite3'),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def checkout(self, address='10.0.0.1', method='post'):
+        # Anonymous, so the view only redirects to the login page
+        return getattr(self.client, method)('/checkout/', REMOTE_ADDR=address)
+
+    def test_token_bucket_answers_429_with_retry_after(self):
+        started = time.time()
+        self.assertEqual([self.checkout().status_code for _ in range(2)], [302, 302])
+        response = self.checkout()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        # Other addresses and other methods have buckets of their own or none
+        self.assertEqual(self.checkout(address='10.0.0.2').status_code, 302)
+        self.assertEqual(self.checkout(method='get').status_code, 302)
+        # A second later one token is back
+        rule = self.rules['checkout']
+        self.assertEqual(admission.admit('checkout', 'ip:10.0.0.1', rule, now=started + 1.5)[0], admission.ADMITTED)
+
+    def test_concurrency_limit_answers_503_until_the_slot_is_free(self):
+        user = User.objects.create_user('guest', password='secret')
+        booking = Booking.objects.create(user=user, booking_type='hotel', total_price=100)
+        self.client.force_login(user)
+        # Another worker process is busy with a payment
+        _, holder, _ = admission.admit('payment', 'user:other', self.rules['payment'])
+        response = self.client.post(f'/payment/{booking.pk}/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertFalse(response.json()['success'])
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'pending')
+
+        admission.release('payment', holder)
+        self.assertEqual(self.client.post(f'/payment/{booking.pk}/').status_code, 302)
+        # The request gave its slot back; one left behind by a dead process expires
+        _, holder, _ = admission.admit('payment', 'user:other', self.rules['payment'], now=time.time() - 120)
+        self.assertEqual(admission.admit('payment', 'user:other', self.rules['payment'])[0], admission.ADMITTED)
+
+        [row] = admission.stats()
+        self.assertEqual(
+            (row['endpoint'], row['admitted'], row['overloaded'], row['limited'], row['running']),
+            ('payment', 4, 1, 0, 1),
+        )
+        self.assertEqual(row['shed_share'], 0.2)
+
+    def test_forwarded_addresses_are_only_believed_from_trusted_proxies(self):
+        factory = RequestFactory()
+
+        def address(remote_addr, forwarded_for=None):
+            headers = {'HTTP_X_FORWARDED_FOR': forwarded_for} if forwarded_for else {}
+            return admission.client_address(factory.get('/', REMOTE_ADDR=remote_addr, **headers))
+
+        self.assertEqual(address('203.0.113.9', '198.51.100.1'), '203.0.113.9')
+        with override_settings(ADMISSION_TRUSTED_PROXIES=['10.0.0.0/8', '::1']):
+            self.assertEqual(address('10.0.0.5', '198.51.100.1'), '198.51.100.1')
+            # The client can prepend anything; the entries added by the trusted proxies come last
+            self.assertEqual(address('10.0.0.5', '1.2.3.4, 198.51.100.1, 10.1.1.1'), '198.51.100.1')
+            self.assertEqual(address('::1', '10.2.2.2, 10.1.1.1'), '10.2.2.2')
+            self.assertEqual(address('10.0.0.5'), '10.0.0.5')
+            self.assertEqual(address('203.0.113.9', '198.51.100.1'), '203.0.113.9')
+
+            # Visitors behind the proxy get buckets of their own
+            def checkout(forwarded_for):
+                return self.client.post('/checkout/', REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+            self.assertEqual([checkout('198.51.100.1').status_code for _ in range(3)], [302, 302, 429])
+            self.assertEqual(checkout('198.51.100.2').status_code, 302)
+
+    @override_settings(ADMISSION_DB='/nonexistent/admission.sqlite3')
+    def test_requests_pass_when_the_store_is_unavailable(self):
+        with self.assertLogs('home.admission', 'WARNING'):
+            self.assertEqual(self.checkout().status_code, 302)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.clear()
+        self.location = Location.objects.create(name='Đà Nẵng', is_popular=True)
+        self.hotel = Hotel.objects.create(
+            name='Biển Xanh', location=self.location, description='', price=100, is_featured=True,
+        )
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return list(Hotel.objects.values_list('name', flat=True))
+
+    def read(self):
+        return catalog_cache.get_or_set('hotel_names', self.load, models=(Hotel,))
+
+    def test_entries_built_on_a_replica_are_not_served_from_the_primary(self):
+        # A replica that has not caught up yet, read by a browsing visitor
+        token = routers._replica.set('replica1')
+        try:
+            with mock.patch.object(self, 'load', return_value=['Biển Xanh (replica)']):
+                self.assertEqual(self.read(), ['Biển Xanh (replica)'])
+        finally:
+            routers._replica.reset(token)
+        # A visitor pinned to the primary after a write gets an entry of its own
+        self.assertEqual(self.read(), ['Biển Xanh'])
+        self.assertEqual(self.loads, 1)
+
+    def test_tiers_and_version_bumps(self):
+        self.assertEqual(self.read(), ['Biển Xanh'])
+        self.assertEqual(self.read(), ['Biển Xanh'])
+        # Another process has only the shared tier
+        catalog_cache._lru.clear()
+        self.read()
+        self.assertEqual(self.loads, 1)
+        self.hotel.name = 'Biển Xanh Resort'
+        self.hotel.save()
+        self.assertEqual(self.read(), ['Biển Xanh Resort'])
+        # Saving a model the entry does not depend on keeps it
+        Tour.objects.create(name='Bà Nà', location=self.location, description='', price=50, duration=1)
+        self.read()
+        self.assertEqual(self.loads, 2)
+        [row] = catalog_cache.stats()
+        self.assertEqual(
+            (row['local_hits'], row['shared_hits'], row['misses'], row['hit_ratio']), (2, 1, 2, 0.6),
+        )
+
+    def test_concurrent_misses_load_once(self):
+        barrier = threading.Barrier(6, timeout=5)
+
+        def slow_load():
+            self.loads += 1
+            time.sleep(0.2)
+            return 'built'
+
+        def read():
+            barrier.wait()
+            results.append(catalog_cache.get_or_set('slow', slow_load))
+
+        results = []
+        threads = [threading.Thread(target=read) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['built'] * 6)
+        self.assertEqual(self.loads, 1)
+        [row] = catalog_cache.stats()
+        self.assertEqual((row['misses'], row['coalesced']), (1, 5))
+
+    def test_entries_are_refreshed_early_by_one_caller(self):
+        now = time.time()
+        entry = catalog_cache.Entry('value', expires=now + 0.5, delta=1.0)
+        with mock.patch('home.catalog_cache.random.random', return_value=0.5):
+            # -ln(0.5) * 1 s of build time reaches past the expiry
+            self.assertTrue(catalog_cache._refresh_early(entry, now))
+            self.assertFalse(catalog_cache._refresh_early(entry._replace(expires=now + 10), now))
+        self.read()
+        with mock.patch('home.catalog_cache._refresh_early', return_value=True):
+            self.read()
+            # While one caller rebuilds, the others keep the current entry
+            catalog_cache.shared().add(f"{catalog_cache._key('hotel_names', ['home.hotel'], ())}:lock", 1)
+            self.read()
+        self.assertEqual(self.loads, 2)
+        [row] = catalog_cache.stats()
+        self.assertEqual((row['misses'], row['early_refreshes'], row['local_hits']), (1, 1, 1))
+
+    def test_home_page_reads_featured_lists_from_the_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/')
+        self.assertContains(response, 'Biển Xanh')
+        self.assertLess(len(second), len(first) - 4)
+        self.hotel.name = 'Sông Hàn'
+        self.hotel.save()
+        self.assertContains(self.client.get('/'), 'Sông Hàn')
+
+
+class GeoTests(TestCase):
+    centre = (16.0544, 108.2022)
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.location = Location.objects.create(name='Đà Nẵng', latitude=self.centre[0], longitude=self.centre[1])
+        # About 1.1, 4.4 and 11 km north of the centre, and one without coordinates
+        self.hotels = [
+            self.hotel(f'Hotel {i}', self.centre[0] + offset, self.centre[1])
+            for i, offset in enumerate((0.01, 0.04, 0.1))
+        ]
+        self.hotel('Chưa định vị', None, None)
+
+    def hotel(self, name, lat, lng):
+        return Hotel.objects.create(
+            name=name, location=self.location, description='', price=100, latitude=lat, longitude=lng,
+        )
+
+    def nearby(self, **params):
+        params = {'lat': self.centre[0], 'lng': self.centre[1], **params}
+        return self.client.get('/nearby/hotel/', params).json()['results']
+
+    def test_nearby_hotels_are_sorted_by_distance(self):
+        results = self.nearby(radius=5)
+        self.assertEqual([row['id'] for row in results], [self.hotels[0].pk, self.hotels[1].pk])
+        self.assertAlmostEqual(results[0]['distance_km'], 1.112, places=2)
+        self.assertEqual(len(self.nearby(radius=20, limit=1)), 1)
+        self.assertEqual(self.client.get('/nearby/hotel/', {'lat': 'x', 'lng': 1}).status_code, 400)
+        self.assertEqual(self.client.get('/nearby/room/', {'lat': 1, 'lng': 1}).status_code, 404)
+
+    def test_index_follows_saves_and_deletes(self):
+        far = self.hotels[2]
+        far.latitude = self.centre[0] + 0.02
+        far.save()
+        self.hotels[0].delete()
+        self.assertEqual([row['id'] for row in self.nearby(radius=5)], [far.pk, self.hotels[1].pk])
+        geo.rebuild()
+        self.assertEqual(len(self.nearby(radius=5)), 2)
+
+    def test_radius_across_the_antimeridian(self):
+        south, west, north, east = geo.radius_bbox(0, 179.99, 10)
+        self.assertGreater(west, east)
+        east_side = self.hotel('Fiji', 0, -179.99)
+        found = geo.within_radius('hotel', 0, 179.99, 10)
+        self.assertEqual([pk for _, pk in found], [east_side.pk])
+        self.assertAlmostEqual(found[0][0], 2.22, places=2)
+
+    def test_map_clusters_by_zoom(self):
+        bbox = f'{self.centre[1] - 0.01},{self.centre[0] - 0.01},{self.centre[1] + 0.01},{self.centre[0] + 0.12}'
+        far_out = self.client.get('/map/hotel/', {'bbox': bbox, 'zoom': 5}).json()
+        self.assertEqual(far_out['markers'], [])
+        [cluster] = far_out['clusters']
+        self.assertEqual(cluster['count'], 3)
+        self.assertAlmostEqual(cluster['lat'], self.centre[0] + 0.05, places=4)
+
+        close_up = self.client.get('/map/hotel/', {'bbox': bbox, 'zoom': 14}).json()
+        self.assertEqual(close_up['clusters'], [])
+        self.assertEqual(sorted(row['id'] for row in close_up['markers']), [hotel.pk for hotel in self.hotels])
+        self.assertEqual(close_up['markers'][0]['url'], f'/detail/hotel/{close_up["markers"][0]["id"]}/')
+
+        # Other databases group the model table itself, with the same cells
+        cells = geo.grid_cells(self.centre[0] - 0.01, self.centre[1] - 0.01, self.centre[0] + 0.12, self.centre[1] + 0.01, 12)
+        clustered = geo.clusters('hotel', cells, 12)
+        with mock.patch('home.geo.is_enabled', return_value=False):
+            direct = geo.clusters('hotel', cells, 12)
+        # The R*Tree keeps 32-bit floats: within a metre
+        self.assertEqual([pk for pk, _, _ in direct['markers']], [pk for pk, _, _ in clustered['markers']])
+        for (_, *expected), (_, *actual) in zip(direct['markers'], clustered['markers']):
+            for a, b in zip(expected, actual):
+                self.assertAlmostEqual(a, b, delta=1e-5)
+
+        # A whole country at street level would be thousands of cells
+        response = self.client.get('/map/hotel/', {'bbox': '102,8,110,23', 'zoom': 14})
+        self.assertEqual(response.status_code, 400)
+
+    def test_clusters_group_every_row_in_one_query(self):
+        # A tall, narrow view: hundreds of rows of one or two columns each
+        cells = geo.grid_cells(self.centre[0] - 0.01, self.centre[1] - 0.01, self.centre[0] + 0.12, self.centre[1] + 0.01, 16)
+        _, first_row, _, last_row = cells
+        self.assertGreater(last_row - first_row, 100)
+        with self.assertNumQueries(1):
+            clustered = geo.clusters('hotel', cells, 16)
+        self.assertEqual(sorted(pk for pk, _, _ in clustered['markers']), sorted(hotel.pk for hotel in self.hotels))
+        with mock.patch('home.geo.is_enabled', return_value=False), self.assertNumQueries(1):
+            direct = geo.clusters('hotel', cells, 16)
+        self.assertEqual([pk for pk, _, _ in direct['markers']], [pk for pk, _, _ in clustered['markers']])
@@ -0,0 +1,145 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.db import close_old_connections
+
+from .models import Hotel, Location
+from .search_index import fold
+
+# Full rebuild interval; saves in other worker processes are picked up after this
+REBUILD_INTERVAL = 300
+
+KINDS = ('location', 'hotel')
+
+_lock = threading.Lock()           # guards _entries and _labels; held only for lookups and single-row edits
+_rebuild_lock = threading.Lock()   # held by the one thread loading a new index
+_entries = {}      # kind -> sorted (key, id) tuples, one per word suffix of a name
+_labels = {}       # (kind, id) -> display payload
+_built_at = None
+_replay = []       # edits made while a rebuild was loading, applied again to its result
+
+
+def _keys(name):
+    # 'Đà Nẵng Plaza' -> ['da nang plaza', 'nang plaza', 'plaza'] so any word can start a match
+    words = re.findall(r'\w+', fold(name))
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def _payload(kind, obj):
+    if kind == 'hotel':
+        return {'type': 'hotel', 'id': obj.pk, 'label': obj.name, 'location_id': obj.location_id}
+    return {'type': 'location', 'id': obj.pk, 'label': obj.name}
+
+
+def _load():
+    entries = {}
+    labels = {}
+    for kind, queryset in (
+        ('location', Location.objects.only('id', 'name')),
+        ('hotel', Hotel.objects.only('id', 'name', 'location_id')),
+    ):
+        keys = []
+        for obj in queryset.iterator():
+            labels[(kind, obj.pk)] = _payload(kind, obj)
+            keys.extend((key, obj.pk) for key in _keys(obj.name))
+        keys.sort()
+        entries[kind] = keys
+    return entries, labels
+
+
+def _install(entries, labels):
+    global _entries, _labels, _built_at
+    with _lock:
+        _entries, _labels, _built_at = entries, labels, time.monotonic()
+        # The load may have read the rows before these edits were committed
+        for edit, args in _replay:
+            edit(*args)
+        _replay.clear()
+
+
+def rebuild():
+    with _rebuild_lock:
+        _install(*_load())
+
+
+def _rebuild_in_background():
+    close_old_connections()
+    try:
+        _install(*_load())
+    finally:
+        _rebuild_lock.release()
+        close_old_connections()
+
+
+def _ensure_fresh():
+    if _built_at is None:
+        # Nothing to answer from yet: the first caller loads, the others wait for it
+        with _rebuild_lock:
+            if _built_at is None:
+                _install(*_load())
+    elif time.monotonic() - _built_at > REBUILD_INTERVAL and _rebuild_lock.acquire(blocking=False):
+        # One thread reloads in the background; everyone keeps the current index meanwhile
+        threading.Thread(target=_rebuild_in_background, name='typeahead-rebuild', daemon=True).start()
+
+
+def _discard(kind, pk):
+    # Drops the entries of the name the index has for pk: a bisect and a list delete per word
+    label = _labels.pop((kind, pk), None)
+    if label is None:
+        return
+    keys = _entries[kind]
+    for key in _keys(label['label']):
+        i = bisect_left(keys, (key, pk))
+        if i < len(keys) and keys[i] == (key, pk):
+            del keys[i]
+
+
+def _add(kind, obj):
+    _discard(kind, obj.pk)
+    for key in _keys(obj.name):
+        insort(_entries[kind], (key, obj.pk))
+    _labels[(kind, obj.pk)] = _payload(kind, obj)
+
+
+def update(kind, obj):
+    if _built_at is None:
+        return
+    with _lock:
+        _add(kind, obj)
+        if _rebuild_lock.locked():
+            _replay.append((_add, (kind, obj)))
+
+
+def remove(kind, pk):
+    if _built_at is None:
+        return
+    with _lock:
+        _discard(kind, pk)
+        if _rebuild_lock.locked():
+            _replay.append((_discard, (kind, pk)))
+
+
+def suggest(query, kinds=KINDS, limit=10):
+    prefix = ' '.join(re.findall(r'\w+', fold(query)))
+    if not prefix:
+        return []
+    _ensure_fresh()
+
+    # Locations are listed before hotels; within a kind matches come in key order
+    results = []
+    with _lock:
+        for kind in kinds:
+            keys = _entries.get(kind, [])
+            seen = set()
+            i = bisect_left(keys, (prefix,))
+            while i < len(keys) and len(results) < limit:
+                key, pk = keys[i]
+                if not key.startswith(prefix):
+                    break
+                if pk not in seen and (kind, pk) in _labels:
+                    seen.add(pk)
+                    results.append(_labels[(kind, pk)])
+                i += 1
+    return results
@@ -1,14 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'home'
 
+
+def catalog(view_name):
+    # Pages with an async twin that gathers their independent queries; see ASYNC_VIEWS
+    return getattr(views, f'{view_name}_async' if settings.ASYNC_VIEWS else view_name)
+
+
 urlpatterns = [
     # Main pages
-    path('', views.home, name='home'),
+    path('', catalog('home'), name='home'),
     path('search/', views.search, name='search'),
-    path('detail/<str:item_type>/<int:item_id>/', views.detail, name='detail'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('detail/<str:item_type>/<int:item_id>/', catalog('detail'), name='detail'),
     path('booking/<str:item_type>/<int:item_id>/', views.booking, name='booking'),
+    path('booking/requests/<uuid:reference>/', views.booking_request_status, name='booking_request'),
     path('payment/<int:booking_id>/', views.payment, name='payment'),
 
     # Room specific pages
@@ -20,14 +29,28 @@ urlpatterns = [
     path('register/', views.user_register, name='register'),
     path('profile/', views.user_profile, name='profile'),
     path('orders/', views.user_orders, name='orders'),
+    path('orders/<int:booking_id>/cancel/', views.user_cancel_booking, name='cancel_booking'),
 
     # Specialized search pages
-    path('hotels/', views.hotel_search, name='hotel_search'),
-    path('flights/', views.flight_search, name='flight_search'),
-    path('tours/', views.tour_search, name='tour_search'),
-    path('cars/', views.car_search, name='car_search'),
+    path('hotels/', catalog('hotel_search'), name='hotel_search'),
+    path('flights/', catalog('flight_search'), name='flight_search'),
+    path('flights/calendar/', views.fare_calendar_view, name='fare_calendar'),
+    path('tours/', catalog('tour_search'), name='tour_search'),
+    path('cars/', catalog('car_search'), name='car_search'),
+
+    # Distance search and map markers for hotels and locations
+    path('nearby/<str:kind>/', views.nearby, name='nearby'),
+    path('map/<str:kind>/', views.map_markers, name='map'),
 
     # Promotions
     path('promotions/', views.promotions, name='promotions'),
     path('apply-promotion/', views.apply_promotion, name='apply_promotion'),
+
+    # Cart
+    path('quote/', views.quote, name='quote'),
+    path('checkout/', views.checkout, name='checkout'),
+
+    # Reporting
+    path('exports/bookings/', views.export_bookings, name='export_bookings'),
+    path('_perf/', views.perf_report, name='perf'),
 ]
\ No newline at end of file
@@ -1,242 +1,250 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from .models import (
     Location, Hotel, FlightTicket, Booking, Tour, CarTransfer, 
-    Promotion, UserProfile, TourImage, HotelImage, Room, RoomImage
+    Promotion, UserProfile, TourImage, HotelImage, Room, RoomImage, OrderSummary, BookingRequest
 )
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Min, Max, Avg
+from django.db.models import Q, Min, Max, Avg, Subquery
+from django.urls import reverse
 from django.utils import timezone
+import json
+import math
 from datetime import datetime, timedelta
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from . import (
+    admission, catalog_cache, concurrency, exports, fare_calendar, geo, intake, order_summaries, price_stats, pricing,
+    profiler, promo_resolver, search_index, serving, storage, typeahead,
+)
+from .pagination import paginate
+from .inventory import InventoryError, available_hotels, cancel_booking
+
+def listing_response(request, template_name, context, fragment_name, page):
+    # Infinite scroll asks for ?format=json and appends the rendered cards
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'html': render_to_string(fragment_name, context, request=request),
+            'next_cursor': page.next_cursor,
+        })
+    return render(request, template_name, context)
 
 def user_logout(request):
     logout(request)
     return redirect('home:home')
 
+# Catalog reads shared by many requests; saves of the listed models retire them (home/signals.py)
+@catalog_cache.cached(models=(Hotel, HotelImage, Room, Location))
+def _featured_hotels(limit):
+    return list(Hotel.objects.for_listing().filter(is_featured=True)[:limit])
+
+@catalog_cache.cached(models=(FlightTicket, Location))
+def _featured_flights(limit):
+    return list(FlightTicket.objects.for_listing().filter(is_featured=True)[:limit])
+
+@catalog_cache.cached(models=(Tour, TourImage, Location))
+def _featured_tours(limit):
+    return list(Tour.objects.for_listing().filter(is_featured=True)[:limit])
+
+@catalog_cache.cached(models=(CarTransfer, Location))
+def _featured_cars(limit):
+    return list(CarTransfer.objects.for_listing().filter(is_featured=True)[:limit])
+
+@catalog_cache.cached(models=(Location,))
+def _popular_locations(limit=None):
+    return list(Location.objects.filter(is_popular=True)[:limit])
+
+def _home(request):
+    # The featured lists, locations and promotions do not depend on each other
+    loads = {
+        'featured_hotels': lambda: _featured_hotels(6),
+        'featured_flights': lambda: _featured_flights(6),
+        'featured_tours': lambda: _featured_tours(6),
+        'featured_cars': lambda: _featured_cars(6),
+        'popular_locations': lambda: _popular_locations(8),
+        'active_promotions': lambda: promo_resolver.active(limit=4),
+    }
+
+    def respond(data):
+        categories = [
+            {'name': 'Vé máy bay', 'icon': 'fas fa-plane', 'url': 'home:flight_search'},
+            {'name': 'Khách sạn', 'icon': 'fas fa-hotel', 'url': 'home:hotel_search'},
+            {'name': 'Tour', 'icon': 'fas fa-map-marked-alt', 'url': 'home:tour_search'},
+            {'name': 'Xe đưa đón', 'icon': 'fas fa-car', 'url': 'home:car_search'}
+        ]
+        context = dict(data, categories=categories)
+        return render(request, 'home/home.html', context)
+    return loads, respond
+
 def home(request):
-    featured_hotels = Hotel.objects.filter(is_featured=True)[:6]
-    featured_flights = FlightTicket.objects.filter(is_featured=True)[:6]
-    featured_tours = Tour.objects.filter(is_featured=True)[:6]
-    featured_cars = CarTransfer.objects.filter(is_featured=True)[:6]
-    popular_locations = Location.objects.filter(is_popular=True)[:8]
-    active_promotions = Promotion.objects.filter(is_active=True, end_date__gt=timezone.now())[:4]
-
-    categories = [
-        {'name': 'Vé máy bay', 'icon': 'fas fa-plane', 'url': 'home:flight_search'},
-        {'name': 'Khách sạn', 'icon': 'fas fa-hotel', 'url': 'home:hotel_search'},
-        {'name': 'Tour', 'icon': 'fas fa-map-marked-alt', 'url': 'home:tour_search'},
-        {'name': 'Xe đưa đón', 'icon': 'fas fa-car', 'url': 'home:car_search'}
-    ]
+    return concurrency.respond(_home, request)
 
-    context = {
-        'featured_hotels': featured_hotels,
-        'featured_flights': featured_flights,
-        'featured_tours': featured_tours,
-        'featured_cars': featured_cars,
-        'popular_locations': popular_locations,
-        'active_promotions': active_promotions,
-        'categories': categories,
-    }
-    return render(request, 'home/home.html', context)
+async def home_async(request):
+    return await concurrency.arespond(_home, request)
+
+SEARCH_ORDERING = {
+    'hotel': ('price', 'id'),
+    'flight': ('departure_time', 'id'),
+    'tour': ('price', 'id'),
+    'car': ('price', 'id'),
+}
 
 def search(request):
     query = request.GET.get('q', '')
     item_type = request.GET.get('type', 'hotel')  # 'hotel', 'flight', 'tour', or 'car'
-    results = []
-
-    if item_type == 'hotel':
-        results = Hotel.objects.filter(
-            Q(name__icontains=query) | Q(location__name__icontains=query)
-        )
-
+    cursor = request.GET.get('cursor')
+    results = Hotel.objects.none()
 
+    # Ranked full-text lookup with diacritic folding ("Da Nang" finds "Đà Nẵng")
+    if query and search_index.is_enabled() and item_type in search_index.INDEXED_MODELS:
+        page = search_index.search_page(query, item_type, cursor)
 
-    elif item_type == 'flight':
-        results = FlightTicket.objects.filter(
-            Q(flight_number__icontains=query) | 
-            Q(airline__icontains=query) |
-            Q(origin__name__icontains=query) | 
-            Q(destination__name__icontains=query)
-        )
-    elif item_type == 'tour':
-        results = Tour.objects.filter(
-            Q(name__icontains=query) | Q(location__name__icontains=query)
-        )
-    elif item_type == 'car':
-        results = CarTransfer.objects.filter(
-            Q(name__icontains=query) | Q(location__name__icontains=query)
-        )
+    else:
+        if item_type == 'hotel':
+            results = Hotel.objects.for_listing().filter(
+                Q(name__icontains=query) | Q(location__name__icontains=query)
+            )
+        elif item_type == 'flight':
+            results = FlightTicket.objects.for_listing().filter(
+                Q(flight_number__icontains=query) | 
+                Q(airline__icontains=query) |
+                Q(origin__name__icontains=query) | 
+                Q(destination__name__icontains=query)
+            )
+        elif item_type == 'tour':
+            results = Tour.objects.for_listing().filter(
+                Q(name__icontains=query) | Q(location__name__icontains=query)
+            )
+        elif item_type == 'car':
+            results = CarTransfer.objects.for_listing().filter(
+                Q(name__icontains=query) | Q(location__name__icontains=query)
+            )
+        page = paginate(results, SEARCH_ORDERING.get(item_type, ('id',)), cursor)
 
     context = {
-        'results': results,
+        'results': page,
+        'page': page,
         'query': query,
         'item_type': item_type,
     }
-    return render(request, 'home/search.html', context)
-
-def detail(request, item_type, item_id):
-    item = None
-    related_items = []
-    rooms = []
+    return listing_response(request, 'home/search.html', context, 'home/includes/search_results.html', page)
 
+def _detail(request, item_type, item_id):
+    # Related items find the item's location through a subquery, so nothing waits on the item itself
+    loads = {'related_items': list, 'rooms': list}
     if item_type == 'hotel':
-        item = get_object_or_404(Hotel, id=item_id)
-        related_items = Hotel.objects.filter(location=item.location).exclude(id=item_id)[:3]
-        rooms = Room.objects.filter(hotel=item, is_available=True).order_by('price')
+        location = Hotel.objects.filter(id=item_id).values('location')[:1]
+        loads['item'] = lambda: get_object_or_404(Hotel.objects.for_listing(), id=item_id)
+        loads['related_items'] = lambda: list(
+            Hotel.objects.for_listing().filter(location=Subquery(location)).exclude(id=item_id)[:3]
+        )
+        loads['rooms'] = lambda: list(
+            Room.objects.for_listing().filter(hotel_id=item_id, is_available=True).order_by('price')
+        )
     elif item_type == 'flight':
-        item = get_object_or_404(FlightTicket, id=item_id)
-        related_items = FlightTicket.objects.filter(
-            Q(origin=item.origin) | Q(destination=item.destination)
-        ).exclude(id=item_id)[:3]
+        flight = FlightTicket.objects.filter(id=item_id)
+        loads['item'] = lambda: get_object_or_404(FlightTicket.objects.for_listing(), id=item_id)
+        loads['related_items'] = lambda: list(FlightTicket.objects.for_listing().filter(
+            Q(origin=Subquery(flight.values('origin')[:1])) | Q(destination=Subquery(flight.values('destination')[:1]))
+        ).exclude(id=item_id)[:3])
     elif item_type == 'tour':
-        item = get_object_or_404(Tour, id=item_id)
-        related_items = Tour.objects.filter(location=item.location).exclude(id=item_id)[:3]
+        location = Tour.objects.filter(id=item_id).values('location')[:1]
+        loads['item'] = lambda: get_object_or_404(Tour.objects.for_listing(), id=item_id)
+        loads['related_items'] = lambda: list(
+            Tour.objects.for_listing().filter(location=Subquery(location)).exclude(id=item_id)[:3]
+        )
     elif item_type == 'car':
-        item = get_object_or_404(CarTransfer, id=item_id)
-        related_items = CarTransfer.objects.filter(location=item.location).exclude(id=item_id)[:3]
+        location = CarTransfer.objects.filter(id=item_id).values('location')[:1]
+        loads['item'] = lambda: get_object_or_404(CarTransfer.objects.for_listing(), id=item_id)
+        loads['related_items'] = lambda: list(
+            CarTransfer.objects.for_listing().filter(location=Subquery(location)).exclude(id=item_id)[:3]
+        )
     elif item_type == 'location':
-        item = get_object_or_404(Location, id=item_id)
-        related_items = Location.objects.filter(is_popular=True).exclude(id=item_id)[:3]
+        loads['item'] = lambda: get_object_or_404(Location, id=item_id)
+        loads['related_items'] = lambda: list(Location.objects.filter(is_popular=True).exclude(id=item_id)[:3])
     elif item_type == 'room':
-        room = get_object_or_404(Room, id=item_id)
-        item = room.hotel
+        hotel = Room.objects.filter(id=item_id).values('hotel')[:1]
+        # Just show this specific room
+        loads['rooms'] = lambda: [get_object_or_404(Room.objects.for_listing(), id=item_id)]
+        loads['item'] = lambda: get_object_or_404(Hotel.objects.for_listing(), id=Subquery(hotel))
+        loads['related_items'] = lambda: list(
+            Room.objects.for_listing().filter(hotel=Subquery(hotel), is_available=True).exclude(id=item_id)[:3]
+        )
         item_type = 'hotel'  # Switch back to hotel type for template rendering
-        rooms = [room]  # Just show this specific room
-        related_items = Room.objects.filter(hotel=item, is_available=True).exclude(id=item_id)[:3]
+    else:
+        loads['item'] = lambda: None
 
     # Get applicable promotions
-    promotions = Promotion.objects.filter(
-        Q(promotion_type=item_type) | Q(promotion_type='general'),
-        is_active=True,
-        end_date__gt=timezone.now()
-    )[:2]
+    loads['promotions'] = lambda: promo_resolver.active(item_type, limit=2)
 
-    context = {
-        'item': item,
-        'item_type': item_type,
-        'related_items': related_items,
-        'promotions': promotions,
-        'rooms': rooms,
-    }
-    return render(request, 'home/detail.html', context)
+    def respond(data):
+        context = dict(data, item_type=item_type)
+        return render(request, 'home/detail.html', context)
+    return loads, respond
+
+def detail(request, item_type, item_id):
+    return concurrency.respond(_detail, request, item_type, item_id)
+
+async def detail_async(request, item_type, item_id):
+    return await concurrency.arespond(_detail, request, item_type, item_id)
 
 @login_required
 def booking(request, item_type, item_id):
     if request.method == 'POST':
-        user = request.user
-        check_in_date = request.POST.get('check_in_date')
-        check_out_date = request.POST.get('check_out_date')
-        number_of_guests = int(request.POST.get('number_of_guests', 1))
-        special_requests = request.POST.get('special_requests', '')
-        promo_code = request.POST.get('promo_code', '')
-        room_id = request.POST.get('room_id')  # For hotel room bookings
-
-        # Initialize booking with common fields
-        booking_data = {
-            'user': user,
-            'booking_type': item_type,
-            'check_in_date': check_in_date if check_in_date else None,
-            'check_out_date': check_out_date if check_out_date else None,
-            'number_of_guests': number_of_guests,
-            'special_requests': special_requests,
-            'status': 'confirmed'
-        }
-
-        # Apply promotion if valid
-        if promo_code:
-            try:
-                promotion = Promotion.objects.get(
-                    promo_code=promo_code,
-                    is_active=True,
-                    start_date__lte=timezone.now(),
-                    end_date__gte=timezone.now()
-                )
-                booking_data['promotion'] = promotion
-            except Promotion.DoesNotExist:
-                messages.warning(request, 'Mã khuyến mãi không hợp lệ hoặc đã hết hạn.')
-
-        # Set item-specific fields and calculate total price
-        if item_type == 'hotel':
-            hotel = get_object_or_404(Hotel, id=item_id)
-            booking_data['hotel'] = hotel
-
-            # Calculate number of nights
-            if check_in_date and check_out_date:
-                check_in = datetime.strptime(check_in_date, '%Y-%m-%d').date()
-                check_out = datetime.strptime(check_out_date, '%Y-%m-%d').date()
-                nights = (check_out - check_in).days
-
-                # If a specific room was selected
-                if room_id:
-                    room = get_object_or_404(Room, id=room_id, hotel=hotel)
-                    booking_data['total_price'] = room.price * nights * number_of_guests
-                else:
-                    booking_data['total_price'] = hotel.price * nights * number_of_guests
-            else:
-                if room_id:
-                    room = get_object_or_404(Room, id=room_id, hotel=hotel)
-                    booking_data['total_price'] = room.price
-                else:
-                    booking_data['total_price'] = hotel.price
-
-        elif item_type == 'flight':
-            flight = get_object_or_404(FlightTicket, id=item_id)
-            booking_data['flight'] = flight
-            booking_data['total_price'] = flight.price * number_of_guests
-
-        elif item_type == 'tour':
-            tour = get_object_or_404(Tour, id=item_id)
-            booking_data['tour'] = tour
-            booking_data['total_price'] = tour.price * number_of_guests
-
-        elif item_type == 'car':
-            car = get_object_or_404(CarTransfer, id=item_id)
-            booking_data['car'] = car
-            booking_data['total_price'] = car.price
-
-        # Apply discount if promotion exists
-        if 'promotion' in booking_data:
-            promotion = booking_data['promotion']
-            if promotion.discount_percent > 0:
-                discount = booking_data['total_price'] * (promotion.discount_percent / 100)
-                booking_data['total_price'] -= discount
-            elif promotion.discount_amount > 0:
-                booking_data['total_price'] -= promotion.discount_amount
-
-        # Create booking
-        booking = Booking.objects.create(**booking_data)
+        # Room bookings post back to the room URL and are priced as their hotel
+        line = request.POST.dict()
+        line.update(item_type=item_type, item_id=item_id)
+        try:
+            line = pricing.quote([pricing.Quote.from_dict(line)])[0]
+        except pricing.PricingError as e:
+            messages.error(request, str(e))
+            return redirect(request.path)
+        if line.item is None:
+            raise Http404
+        if line.promo_error:
+            messages.warning(request, line.promo_error)
+
+        if intake.is_queued():
+            # A worker reserves and books it; the visitor waits on the request's status page
+            booking_request = intake.enqueue(request.user, line)
+            return redirect('home:booking_request', reference=booking_request.reference)
+
+        # Reserve room nights or seats and create the booking in one transaction
+        try:
+            booking, = pricing.checkout(request.user, [line])
+        except (pricing.PricingError, InventoryError) as e:
+            messages.error(request, str(e))
+            return redirect(request.path)
 
         # Redirect to payment page
         return redirect('home:payment', booking_id=booking.id)
     else:
         item = None
         room = None
+        # What the summary is quoted as; item_type itself is switched for the template below
+        quote_item = {'item_type': item_type, 'item_id': item_id}
 
         if item_type == 'hotel':
-            item = get_object_or_404(Hotel, id=item_id)
+            item = get_object_or_404(Hotel.objects.for_listing(), id=item_id)
             # Get available rooms for this hotel
             rooms = Room.objects.filter(hotel=item, is_available=True).order_by('price')
         elif item_type == 'room':
-            room = get_object_or_404(Room, id=item_id)
+            room = get_object_or_404(Room.objects.for_listing(), id=item_id)
             item = room.hotel
             item_type = 'hotel'  # Switch back to hotel type for template rendering
         elif item_type == 'flight':
-            item = get_object_or_404(FlightTicket, id=item_id)
+            item = get_object_or_404(FlightTicket.objects.for_listing(), id=item_id)
         elif item_type == 'tour':
-            item = get_object_or_404(Tour, id=item_id)
+            item = get_object_or_404(Tour.objects.for_listing(), id=item_id)
         elif item_type == 'car':
-            item = get_object_or_404(CarTransfer, id=item_id)
+            item = get_object_or_404(CarTransfer.objects.for_listing(), id=item_id)
 
         # Get valid promotions for this item type
-        promotions = Promotion.objects.filter(
-            Q(promotion_type=item_type) | Q(promotion_type='general'),
-            is_active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        )
+        promotions = promo_resolver.active(item_type)
 
         context = {
             'item': item,
@@ -244,11 +252,21 @@ def booking(request, item_type, item_id):
             'room': room,
             'rooms': rooms if item_type == 'hotel' and not room else None,
             'promotions': promotions,
+            'quote_item': quote_item,
             'today': timezone.now().date().isoformat(),
             'tomorrow': (timezone.now() + timedelta(days=1)).date().isoformat(),
         }
         return render(request, 'home/booking.html', context)
 
+@login_required
+def booking_request_status(request, reference):
+    # Polled with ?format=json by the waiting page until a worker has booked the request
+    booking_request = get_object_or_404(BookingRequest, reference=reference, user=request.user)
+    data = intake.status(booking_request)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(data)
+    return render(request, 'home/booking_pending.html', {'booking_request': booking_request, 'status': data})
+
 def user_login(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -281,13 +299,48 @@ def user_register(request):
             return redirect('home:login')
     return render(request, 'home/register.html')
 
+def _day_start(value, days=0):
+    try:
+        return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d') + timedelta(days=days))
+    except ValueError:
+        return None
+
 @login_required
 def user_orders(request):
-    bookings = Booking.objects.filter(user=request.user).order_by('-booking_date')
+    # One indexed query per page on the denormalized summaries, no joins
+    orders = OrderSummary.objects.filter(user=request.user)
+    status = request.GET.get('status', '')
+    if status in dict(Booking.BOOKING_STATUS_CHOICES):
+        orders = orders.filter(status=status)
+    date_from = request.GET.get('from', '')
+    date_to = request.GET.get('to', '')
+    # Both days are inclusive; a malformed date is ignored like on the search pages
+    start = _day_start(date_from)
+    if start:
+        orders = orders.filter(booking_date__gte=start)
+    end = _day_start(date_to, days=1)
+    if end:
+        orders = orders.filter(booking_date__lt=end)
+    page = paginate(orders, ('-booking_date', '-booking_id'), request.GET.get('cursor'))
     context = {
-        'bookings': bookings,
+        'orders': page,
+        'page': page,
+        'status': status,
+        'date_from': date_from,
+        'date_to': date_to,
+        'status_choices': Booking.BOOKING_STATUS_CHOICES,
     }
-    return render(request, 'home/orders.html', context)
+    return listing_response(request, 'home/orders.html', context, 'home/includes/order_rows.html', page)
+
+@login_required
+def user_cancel_booking(request, booking_id):
+    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    if request.method == 'POST':
+        if cancel_booking(booking):
+            messages.success(request, 'Đơn hàng đã được hủy.')
+        else:
+            messages.error(request, 'Đơn hàng này không thể hủy.')
+    return redirect('home:orders')
 
 @login_required
 def user_profile(request):
@@ -320,7 +373,24 @@ def user_profile(request):
     }
     return render(request, 'home/profile.html', context)
 
-def hotel_search(request):
+def _listing_loads(category, location_id, queryset, cursor):
+    # The selected location, the slider's statistics and the page are read independently
+    location_pk = int(location_id) if location_id.isdigit() else None
+    return {
+        # The location picker loads suggestions on demand; only the selected one is needed here
+        'selected_location': lambda: Location.objects.filter(id=location_pk).first() if location_pk else None,
+        'all_prices': lambda: price_stats.get(category),
+        'location_prices': lambda: price_stats.get(category, location_pk) if location_pk else None,
+        'page': lambda: paginate(queryset, ('price', 'id'), cursor),
+    }
+
+def _listing_prices(data):
+    # (min/max for the price slider, histogram buckets of the selected location or of everything)
+    statistic = data['location_prices'] if data['selected_location'] else data['all_prices']
+    price_range = {'min_price': data['all_prices'].min_price, 'max_price': data['all_prices'].max_price}
+    return price_range, price_stats.buckets(statistic)
+
+def _hotel_search(request):
     # Get filter parameters
     location_id = request.GET.get('location', '')
     check_in = request.GET.get('check_in', '')
@@ -331,7 +401,18 @@ def hotel_search(request):
     stars = request.GET.getlist('stars', [])
 
     # Base queryset
-    hotels = Hotel.objects.all()
+    hotels = Hotel.objects.for_listing()
+
+    # Only show hotels with a room free for every night of the stay
+    if check_in and check_out:
+        try:
+            check_in_day = datetime.strptime(check_in, '%Y-%m-%d').date()
+            check_out_day = datetime.strptime(check_out, '%Y-%m-%d').date()
+            guest_count = max(int(guests), 1)
+        except ValueError:
+            check_in_day = check_out_day = None
+        if check_in_day and check_out_day and check_out_day > check_in_day:
+            hotels = available_hotels(check_in_day, check_out_day, guest_count, hotels)
 
     # Apply filters
     if location_id:
@@ -346,29 +427,35 @@ def hotel_search(request):
     if stars:
         hotels = hotels.filter(stars__in=stars)
 
-    # Get all locations for the filter dropdown
-    locations = Location.objects.all()
+    def respond(data):
+        page = data['page']
+        price_range, price_buckets = _listing_prices(data)
+        context = {
+            'hotels': page,
+            'page': page,
+            'selected_location': data['selected_location'],
+            'price_range': price_range,
+            'price_buckets': price_buckets,
+            'filters': {
+                'location_id': location_id,
+                'check_in': check_in,
+                'check_out': check_out,
+                'guests': guests,
+                'min_price': min_price or price_range['min_price'],
+                'max_price': max_price or price_range['max_price'],
+                'stars': stars,
+            }
+        }
+        return listing_response(request, 'home/hotel_search.html', context, 'home/includes/hotel_results.html', page)
+    return _listing_loads('hotel', location_id, hotels, request.GET.get('cursor')), respond
 
-    # Get min and max prices for the price slider
-    price_range = Hotel.objects.aggregate(min_price=Min('price'), max_price=Max('price'))
+def hotel_search(request):
+    return concurrency.respond(_hotel_search, request)
 
-    context = {
-        'hotels': hotels,
-        'locations': locations,
-        'price_range': price_range,
-        'filters': {
-            'location_id': location_id,
-            'check_in': check_in,
-            'check_out': check_out,
-            'guests': guests,
-            'min_price': min_price or price_range['min_price'],
-            'max_price': max_price or price_range['max_price'],
-            'stars': stars,
-        }
-    }
-    return render(request, 'home/hotel_search.html', context)
+async def hotel_search_async(request):
+    return await concurrency.arespond(_hotel_search, request)
 
-def flight_search(request):
+def _flight_search(request):
     # Get filter parameters
     origin_id = request.GET.get('origin', '')
     destination_id = request.GET.get('destination', '')
@@ -378,7 +465,7 @@ def flight_search(request):
     seat_class = request.GET.get('seat_class', '')
 
     # Base queryset
-    flights = FlightTicket.objects.all()
+    flights = FlightTicket.objects.for_listing()
     return_flights = None
 
     # Apply filters
@@ -403,7 +490,7 @@ def flight_search(request):
     if return_date and destination_id and origin_id:
         return_datetime = datetime.strptime(return_date, '%Y-%m-%d')
         next_day = return_datetime + timedelta(days=1)
-        return_flights = FlightTicket.objects.filter(
+        return_flights = FlightTicket.objects.for_listing().filter(
             origin_id=destination_id,
             destination_id=origin_id,
             departure_time__gte=return_datetime,
@@ -413,33 +500,75 @@ def flight_search(request):
         if seat_class:
             return_flights = return_flights.filter(seat_class=seat_class)
 
-    # Get all locations for the filter dropdowns
-    locations = Location.objects.all()
+    # Outbound and return lists scroll independently, each with its own cursor
+    ordering = ('departure_time', 'id')
+    # The location pickers load suggestions on demand; only the selected ones are needed here
+    location_ids = [int(pk) for pk in (origin_id, destination_id) if pk.isdigit()]
+    loads = {
+        'page': lambda: paginate(flights, ordering, request.GET.get('cursor')),
+        'return_page': lambda: None if return_flights is None else paginate(
+            return_flights, ordering, request.GET.get('return_cursor'),
+        ),
+        'selected': lambda: Location.objects.in_bulk(location_ids),
+    }
 
-    context = {
-        'flights': flights,
-        'return_flights': return_flights,
-        'locations': locations,
-        'seat_classes': FlightTicket.SEAT_CLASS_CHOICES,
-        'filters': {
-            'origin_id': origin_id,
-            'destination_id': destination_id,
-            'departure_date': departure_date,
-            'return_date': return_date,
-            'passengers': passengers,
-            'seat_class': seat_class,
+    def respond(data):
+        page, return_page, selected = data['page'], data['return_page'], data['selected']
+        context = {
+            'flights': page,
+            'page': page,
+            'return_flights': return_page,
+            'return_page': return_page,
+            'selected_origin': selected.get(int(origin_id)) if origin_id.isdigit() else None,
+            'selected_destination': selected.get(int(destination_id)) if destination_id.isdigit() else None,
+            'seat_classes': FlightTicket.SEAT_CLASS_CHOICES,
+            'filters': {
+                'origin_id': origin_id,
+                'destination_id': destination_id,
+                'departure_date': departure_date,
+                'return_date': return_date,
+                'passengers': passengers,
+                'seat_class': seat_class,
+            }
         }
-    }
-    return render(request, 'home/flight_search.html', context)
+        if request.GET.get('list') == 'return' and return_page is not None:
+            context['flights'] = return_page
+            return listing_response(request, 'home/flight._search.html', context,
+                                    'home/includes/flight_results.html', return_page)
+        return listing_response(request, 'home/flight._search.html', context, 'home/includes/flight_results.html', page)
+    return loads, respond
 
-def tour_search(request):
+def flight_search(request):
+    return concurrency.respond(_flight_search, request)
+
+async def flight_search_async(request):
+    return await concurrency.arespond(_flight_search, request)
+
+def fare_calendar_view(request):
+    # Cheapest bookable fare per day for one route, for comparing dates at a glance
+    try:
+        origin_id = int(request.GET['origin'])
+        destination_id = int(request.GET['destination'])
+        days = int(request.GET.get('days', fare_calendar.DEFAULT_DAYS))
+        start = request.GET.get('start')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'origin and destination are required'}, status=400)
+    seat_class = request.GET.get('seat_class', '')
+    if seat_class and seat_class not in dict(FlightTicket.SEAT_CLASS_CHOICES):
+        return JsonResponse({'error': 'unknown seat_class'}, status=400)
+
+    calendar = fare_calendar.fares(origin_id, destination_id, seat_class, start, days)
+    return JsonResponse({'days': calendar})
+
+def _tour_search(request):
     # Get filter parameters
     location_id = request.GET.get('location', '')
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
 
     # Base queryset
-    tours = Tour.objects.all()
+    tours = Tour.objects.for_listing()
 
     # Apply filters
     if location_id:
@@ -451,25 +580,35 @@ def tour_search(request):
     if max_price:
         tours = tours.filter(price__lte=max_price)
 
-    # Get all locations for the filter dropdown
-    locations = Location.objects.all()
-
-    # Get min and max prices for the price slider
-    price_range = Tour.objects.aggregate(min_price=Min('price'), max_price=Max('price'))
+    loads = _listing_loads('tour', location_id, tours, request.GET.get('cursor'))
+    loads['popular_locations'] = _popular_locations
 
-    context = {
-        'tours': tours,
-        'locations': locations,
-        'price_range': price_range,
-        'filters': {
-            'location_id': location_id,
-            'min_price': min_price or price_range['min_price'],
-            'max_price': max_price or price_range['max_price'],
+    def respond(data):
+        page = data['page']
+        price_range, price_buckets = _listing_prices(data)
+        context = {
+            'tours': page,
+            'page': page,
+            'selected_location': data['selected_location'],
+            'popular_locations': data['popular_locations'],
+            'price_range': price_range,
+            'price_buckets': price_buckets,
+            'filters': {
+                'location_id': location_id,
+                'min_price': min_price or price_range['min_price'],
+                'max_price': max_price or price_range['max_price'],
+            }
         }
-    }
-    return render(request, 'home/tour_search.html', context)
+        return listing_response(request, 'home/tour_search.html', context, 'home/includes/tour_results.html', page)
+    return loads, respond
 
-def car_search(request):
+def tour_search(request):
+    return concurrency.respond(_tour_search, request)
+
+async def tour_search_async(request):
+    return await concurrency.arespond(_tour_search, request)
+
+def _car_search(request):
     # Get filter parameters
     location_id = request.GET.get('location', '')
     car_type = request.GET.get('car_type', '')
@@ -478,7 +617,7 @@ def car_search(request):
     min_capacity = request.GET.get('min_capacity', '')
 
     # Base queryset
-    cars = CarTransfer.objects.all()
+    cars = CarTransfer.objects.for_listing()
 
     # Apply filters
     if location_id:
@@ -496,32 +635,133 @@ def car_search(request):
     if min_capacity:
         cars = cars.filter(capacity__gte=min_capacity)
 
-    # Get all locations for the filter dropdown
-    locations = Location.objects.all()
+    def respond(data):
+        page = data['page']
+        price_range, price_buckets = _listing_prices(data)
+        context = {
+            'cars': page,
+            'page': page,
+            'selected_location': data['selected_location'],
+            'car_types': CarTransfer.CAR_TYPE_CHOICES,
+            'price_range': price_range,
+            'price_buckets': price_buckets,
+            'filters': {
+                'location_id': location_id,
+                'car_type': car_type,
+                'min_price': min_price or price_range['min_price'],
+                'max_price': max_price or price_range['max_price'],
+                'min_capacity': min_capacity,
+            }
+        }
+        return listing_response(request, 'home/car_search.html', context, 'home/includes/car_results.html', page)
+    return _listing_loads('car', location_id, cars, request.GET.get('cursor')), respond
+
+def car_search(request):
+    return concurrency.respond(_car_search, request)
 
-    # Get min and max prices for the price slider
-    price_range = CarTransfer.objects.aggregate(min_price=Min('price'), max_price=Max('price'))
+async def car_search_async(request):
+    return await concurrency.arespond(_car_search, request)
 
-    context = {
-        'cars': cars,
-        'locations': locations,
-        'car_types': CarTransfer.CAR_TYPE_CHOICES,
-        'price_range': price_range,
-        'filters': {
-            'location_id': location_id,
-            'car_type': car_type,
-            'min_price': min_price or price_range['min_price'],
-            'max_price': max_price or price_range['max_price'],
-            'min_capacity': min_capacity,
-        }
-    }
-    return render(request, 'home/car_search.html', context)
+def autocomplete(request):
+    query = request.GET.get('q', '')
+    kinds = [kind for kind in request.GET.getlist('type') if kind in typeahead.KINDS] or typeahead.KINDS
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    return JsonResponse({'results': typeahead.suggest(query, kinds, limit)})
+
+# Caps of the map and distance endpoints
+NEARBY_MAX_RADIUS_KM = 100
+NEARBY_MAX_RESULTS = 100
+MAP_MAX_CELLS = 2000
+
+def _geo_params(request, *names):
+    # Floats from the query string; ValueError names the first missing or malformed one
+    values = []
+    for name in names:
+        try:
+            value = float(request.GET[name])
+        except (KeyError, ValueError):
+            raise ValueError(f'{name} is required and must be a number')
+        if not math.isfinite(value):
+            raise ValueError(f'{name} must be a number')
+        values.append(value)
+    return values
+
+def _geo_payload(kind, obj, lat, lng):
+    payload = {'id': obj.pk, 'name': obj.name, 'lat': lat, 'lng': lng}
+    if kind == 'hotel':
+        payload.update(
+            price=obj.price, stars=obj.stars, location_id=obj.location_id,
+            url=reverse('home:detail', args=['hotel', obj.pk]),
+        )
+    else:
+        payload['url'] = f"{reverse('home:hotel_search')}?location={obj.pk}"
+    return payload
+
+def nearby(request, kind):
+    # Hotels or locations within ?radius km of ?lat/?lng, nearest first
+    if kind not in geo.GEO_MODELS:
+        raise Http404
+    try:
+        lat, lng = _geo_params(request, 'lat', 'lng')
+        radius = float(request.GET.get('radius', 5))
+        limit = int(request.GET.get('limit', 20))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return JsonResponse({'error': 'lat/lng out of range'}, status=400)
+    if not 0 < radius <= NEARBY_MAX_RADIUS_KM:
+        return JsonResponse({'error': f'radius must be between 0 and {NEARBY_MAX_RADIUS_KM} km'}, status=400)
+    limit = max(1, min(limit, NEARBY_MAX_RESULTS))
+
+    results = []
+    for obj in geo.nearby(kind, lat, lng, radius, limit):
+        payload = _geo_payload(kind, obj, obj.latitude, obj.longitude)
+        payload['distance_km'] = round(obj.distance_km, 3)
+        results.append(payload)
+    return JsonResponse({'radius_km': radius, 'results': results})
+
+def _map_data(kind, cells, zoom):
+    data = geo.clusters(kind, cells, zoom)
+    # Only markers that stand alone need their details; there is at most one per grid cell
+    markers = data.pop('markers')
+    objects = geo.listing_queryset(kind).in_bulk([pk for pk, _, _ in markers])
+    data['markers'] = [
+        _geo_payload(kind, objects[pk], lat, lng) for pk, lat, lng in markers if pk in objects
+    ]
+    return data
+
+def map_markers(request, kind):
+    """
+    Markers for a map viewport, ?bbox=west,south,east,north at ?zoom. Points
+    that would overlap on screen come back as one cluster with a count, so
+    the response stays at one entry per grid cell however many rows match.
+    """
+    if kind not in geo.GEO_MODELS:
+        raise Http404
+    try:
+        west, south, east, north = (float(value) for value in request.GET['bbox'].split(','))
+        zoom = int(request.GET['zoom'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'bbox=west,south,east,north and zoom are required'}, status=400)
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        return JsonResponse({'error': 'bbox out of range'}, status=400)
+    if not 0 <= zoom <= geo.MAX_ZOOM:
+        return JsonResponse({'error': f'zoom must be between 0 and {geo.MAX_ZOOM}'}, status=400)
+    cells = geo.grid_cells(south, west, north, east, zoom)
+    if geo.cell_count(cells, zoom) > MAP_MAX_CELLS:
+        return JsonResponse({'error': 'bbox too large for this zoom'}, status=400)
+
+    # Keyed by grid cells rather than the raw bbox, so panning maps share entries
+    data = catalog_cache.get_or_set(
+        f'map.{kind}', lambda: _map_data(kind, cells, zoom), models=(geo.GEO_MODELS[kind],), key=(cells, zoom),
+    )
+    return JsonResponse(dict(data, zoom=zoom))
 
 def promotions(request):
-    active_promotions = Promotion.objects.filter(
-        is_active=True,
-        end_date__gt=timezone.now()
-    ).order_by('end_date')
+    active_promotions = promo_resolver.active()
 
     context = {
         'promotions': active_promotions,
@@ -529,66 +769,149 @@ def promotions(request):
     return render(request, 'home/promotions.html', context)
 
 def apply_promotion(request):
-    if request.method == 'POST' and request.is_ajax():
-        promo_code = request.POST.get('promo_code')
-        item_type = request.POST.get('item_type')
-        item_price = float(request.POST.get('item_price', 0))
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=405)
 
-        try:
-            promotion = Promotion.objects.get(
-                promo_code=promo_code,
-                is_active=True,
-                start_date__lte=timezone.now(),
-                end_date__gte=timezone.now()
-            )
+    # Priced from the item, dates and guests like the booking itself, never from a price the client sends
+    try:
+        line = pricing.quote([pricing.Quote.from_dict(request.POST.dict())])[0]
+    except pricing.PricingError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    if line.error:
+        return JsonResponse({'success': False, 'message': line.error})
+
+    promotion = line.promotion
+    if promotion is None:
+        # Check if promotion applies to this item type
+        if promo_resolver.by_code(line.promo_code) is not None:
+            message = 'Mã khuyến mãi không áp dụng cho loại dịch vụ này.'
+        else:
+            message = 'Mã khuyến mãi không hợp lệ hoặc đã hết hạn.'
+        return JsonResponse({'success': False, 'message': message})
+
+    if promotion.discount_percent > 0:
+        message = f'Giảm {promotion.discount_percent}%'
+    elif promotion.discount_amount > 0:
+        message = f'Giảm {int(line.discount):,} VND'
+    else:
+        message = 'Không có giảm giá'
+
+    return JsonResponse({
+        'success': True,
+        'base_price': line.base_price,
+        'discount': line.discount,
+        'new_price': line.total_price,
+        'message': message
+    })
+
+def _cart_lines(request):
+    try:
+        items = json.loads(request.body)['items']
+        return [pricing.Quote.from_dict(item) for item in items]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise pricing.PricingError('Dữ liệu đặt chỗ không hợp lệ.')
+
+def quote(request):
+    # Prices a whole cart with one query per item type
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=405)
+    try:
+        lines = pricing.quote(_cart_lines(request))
+    except pricing.PricingError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    return JsonResponse({
+        'success': True,
+        'items': [line.as_dict() for line in lines],
+        'total_price': sum(line.total_price for line in lines if not line.error),
+    })
 
-            # Check if promotion applies to this item type
-            if promotion.promotion_type not in [item_type, 'general']:
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Mã khuyến mãi không áp dụng cho loại dịch vụ này.'
-                })
-
-            # Calculate discount
-            if promotion.discount_percent > 0:
-                discount = item_price * (promotion.discount_percent / 100)
-                new_price = item_price - discount
-                message = f'Giảm {promotion.discount_percent}%'
-            elif promotion.discount_amount > 0:
-                discount = promotion.discount_amount
-                new_price = item_price - discount
-                message = f'Giảm {int(discount):,} VND'
-            else:
-                discount = 0
-                new_price = item_price
-                message = 'Không có giảm giá'
-
-            return JsonResponse({
-                'success': True,
-                'discount': discount,
-                'new_price': new_price,
-                'message': message
-            })
-
-        except Promotion.DoesNotExist:
-            return JsonResponse({
-                'success': False,
-                'message': 'Mã khuyến mãi không hợp lệ hoặc đã hết hạn.'
-            })
-
-    return JsonResponse({'success': False, 'message': 'Invalid request'})
+@login_required
+def checkout(request):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=405)
+    try:
+        lines = pricing.quote(_cart_lines(request))
+        bookings = pricing.checkout(request.user, lines)
+    except pricing.PricingError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except InventoryError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=409)
+    return JsonResponse({
+        'success': True,
+        'bookings': [booking.id for booking in bookings],
+        'total_price': sum(booking.total_price for booking in bookings),
+    })
+
+@staff_member_required
+def export_bookings(request):
+    # Streams every matching booking; memory stays flat however many rows there are
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in exports.FORMATS:
+        return JsonResponse({'error': 'format must be csv or jsonl'}, status=400)
+    try:
+        start = request.GET.get('start')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = request.GET.get('end')
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except ValueError:
+        return JsonResponse({'error': 'start and end must be YYYY-MM-DD'}, status=400)
+    statuses = request.GET.getlist('status')
+    if set(statuses) - set(dict(Booking.BOOKING_STATUS_CHOICES)):
+        return JsonResponse({'error': 'unknown status'}, status=400)
+
+    rows = exports.rows(exports.bookings(start, end, statuses, request.GET.get('type')))
+    response = StreamingHttpResponse(
+        exports.buffered(exports.lines(rows, file_format)),
+        content_type=exports.FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="bookings.{file_format}"'
+    return response
+
+# Sort keys of the endpoint table, worst first
+PERF_SORTS = ('total_ms', 'p95_ms', 'avg_queries', 'repeated_per_request', 'avg_db_ms', 'avg_template_ms')
+
+@staff_member_required
+def perf_report(request):
+    # Endpoints of this worker process over the profiler's rolling window
+    sort = request.GET.get('sort')
+    if sort not in PERF_SORTS:
+        sort = PERF_SORTS[0]
+    rows = sorted(profiler.report(), key=lambda row: -row[sort])
+    # Admission control counts come from the shared store, so they cover every process
+    shedding = admission.stats()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'sort': sort, 'window': profiler.window_seconds(), 'endpoints': rows,
+            'admission_window': admission.window_seconds(), 'admission': shedding,
+            'catalog_cache': catalog_cache.stats(),
+        })
+    context = {
+        'rows': rows,
+        'shedding': shedding,
+        'cache_rows': catalog_cache.stats(),
+        'admission_window_minutes': admission.window_seconds() // 60,
+        'sort': sort,
+        'sorts': PERF_SORTS,
+        'window_minutes': profiler.window_seconds() // 60,
+        'sample_rate': profiler.sample_rate(),
+        'repeat_threshold': profiler.REPEAT_THRESHOLD,
+    }
+    return render(request, 'home/perf.html', context)
 
 @login_required
 def payment(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.for_listing(), id=booking_id, user=request.user)
 
     if request.method == 'POST':
         # Process payment (in a real app, this would integrate with a payment gateway)
         payment_method = request.POST.get('payment_method')
 
-        # Update booking status
-        booking.status = 'confirmed'
-        booking.save()
+        # Conditional update: a booking cancel_booking already released must not be confirmed again
+        paid = Booking.objects.filter(pk=booking.pk, status__in=['pending', 'confirmed']).update(status='confirmed')
+        if not paid:
+            messages.error(request, 'Đơn đặt chỗ này đã bị hủy và không thể thanh toán.')
+            return redirect('home:orders')
+        order_summaries.refresh([booking.pk])
 
         messages.success(request, 'Thanh toán thành công! Đặt phòng của bạn đã được xác nhận.')
         return redirect('home:orders')
@@ -599,15 +922,25 @@ def payment(request, booking_id):
     return render(request, 'home/payment.html', context)
 
 def room_detail(request, room_id):
-    room = get_object_or_404(Room, id=room_id)
+    room = get_object_or_404(Room.objects.for_listing(), id=room_id)
     hotel = room.hotel
 
     # Get other rooms from the same hotel
-    related_rooms = Room.objects.filter(hotel=hotel, is_available=True).exclude(id=room_id)[:3]
+    related_rooms = Room.objects.for_listing().filter(hotel=hotel, is_available=True).exclude(id=room_id)[:3]
 
     context = {
         'room': room,
         'hotel': hotel,
         'related_rooms': related_rooms,
     }
-    return render(request, 'home/room_detail.html', context)
\ No newline at end of file
+    return render(request, 'home/room_detail.html', context)
+
+def serve_media(request, path):
+    # A partly written upload is never a file to hand out
+    if path.rsplit('/', 1)[-1].startswith(storage.TEMPORARY_PREFIX):
+        raise Http404(path)
+    return serving.serve_file(request, settings.MEDIA_ROOT, path)
+
+def serve_static(request, path):
+    # Collected static files; runserver serves them itself while DEBUG is on
+    return serving.serve_file(request, settings.STATIC_ROOT, path)